@@ -10,37 +10,82 @@ class DatabaseManager:
         self.conn = sqlite3.connect(self.db_file)
         cursor = self.conn.cursor()
         
-        # Tabla de usuarios
-        cursor.execute('''
+        # BD nuevas: el espacio de los depositos archivados se libera con incremental_vacuum
+        cursor.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        
+        # WAL + synchronous FULL: cada commit queda en disco aunque se corte la luz
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=FULL')
+        
+        # Tabla de usuarios (fechas en milisegundos desde 1970 UTC, ver marcas_tiempo.py)
+        cursor.execute(f'''
             CREATE TABLE IF NOT EXISTS usuarios (
-                uid TEXT PRIMARY KEY,
+                uid INTEGER PRIMARY KEY,
                 nombre TEXT NOT NULL,
-                fecha_registro TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                fecha_registro INTEGER DEFAULT ({SQL_AHORA_MS})
             )
         ''')
         
-        cursor.execute('''
+        cursor.execute(f'''
             CREATE TABLE IF NOT EXISTS depositos (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
-                uid TEXT NOT NULL,
+                uid INTEGER NOT NULL,
                 porcentaje_depositado INTEGER NOT NULL,
                 kg_estimado REAL NOT NULL,
                 nivel_final INTEGER NOT NULL,
-                fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                fecha INTEGER DEFAULT ({SQL_AHORA_MS}),
                 FOREIGN KEY (uid) REFERENCES usuarios(uid)
             )
         ''')
         
-        cursor.execute('''
+        cursor.execute(f'''
             CREATE TABLE IF NOT EXISTS estadisticas (
-                uid TEXT PRIMARY KEY,
+                uid INTEGER PRIMARY KEY,
                 total_depositos INTEGER DEFAULT 0,
                 kg_total REAL DEFAULT 0.0,
-                ultima_actualizacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                ultima_actualizacion INTEGER DEFAULT ({SQL_AHORA_MS}),
+                nombre TEXT,  -- copia de usuarios.nombre: el ranking no necesita JOIN
                 FOREIGN KEY (uid) REFERENCES usuarios(uid)
             )
         ''')
+        
+        # Historial y rangos de fechas ordenan/filtran por fecha
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_depositos_fecha ON depositos(fecha)')
+        
+        # Outbox append-only de depositos (seq nunca se reutiliza)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS outbox_depositos (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                deposito_id INTEGER NOT NULL,
+                uid INTEGER NOT NULL,
+                nombre TEXT NOT NULL,
+                porcentaje_depositado INTEGER NOT NULL,
+                kg_estimado REAL NOT NULL,
+                nivel_final INTEGER NOT NULL,
+                fecha INTEGER NOT NULL
+            )
+        ''')
+        
+        # Posicion de cada consumidor del outbox (ultimo seq confirmado)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS outbox_consumidores (
+                consumidor TEXT PRIMARY KEY,
+                ultimo_seq INTEGER NOT NULL DEFAULT 0,
+                ultima_actualizacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
         self.conn.commit()
+        
+        # BD antiguas con uid TEXT: pasar a enteros de 4 bytes
+        migradas = migrar_uids_enteros(self.conn)
+        if migradas:
+            print(f"? UIDs migrados a enteros en: {', '.join(migradas)}")
+        # BD antiguas con fechas TIMESTAMP en texto: pasar a milisegundos
+        migradas = migrar_fechas_ms(self.conn)
+        if migradas:
+            print(f"? Fechas migradas a milisegundos en: {', '.join(migradas)}")
+        preparar_ranking(self.conn)
+        preparar_reconciliacion(self.conn)  # Triggers que anotan depositos corregidos
         print(f"? Base de datos iniciada: {self.db_file}")
     
     def registrar_usuario(self, uid, nombre):
@@ -52,7 +97,7 @@ class DatabaseManager:
         existe = cursor.fetchone()
         
         if existe:
-            print(f"??  Usuario {uid} ya existe en BD")
+            print(f"??  Usuario {uid_a_hex(uid)} ya existe en BD")
             return False
         
         # Insertar nuevo usuario
@@ -62,21 +107,44 @@ class DatabaseManager:
         ''', (uid, nombre))
         
         cursor.execute('''
-            INSERT INTO estadisticas (uid, total_depositos, kg_total) 
-            VALUES (?, 0, 0.0)
-        ''', (uid,))
+            INSERT INTO estadisticas (uid, nombre, total_depositos, kg_total) 
+            VALUES (?, ?, 0, 0.0)
+        ''', (uid, nombre))
         
         self.conn.commit()
-        print(f"? Usuario {nombre} ({uid}) registrado en BD")
+        print(f"? Usuario {nombre} ({uid_a_hex(uid)}) registrado en BD")
         return True
     
+    def cargar_usuarios(self):
+        """Todos los usuarios en una sola consulta: {uid (entero): nombre}"""
+        return dict(self.conn.execute('SELECT uid, nombre FROM usuarios'))
+    
+    def importar_usuarios(self, usuarios):
+        """
+        Alta masiva de usuarios [(uid, nombre), ...] en una sola transaccion.
+        Los UIDs que ya existen se ignoran. Devuelve el numero de usuarios nuevos.
+        """
+        usuarios = list(usuarios)
+        antes = self.conn.total_changes
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO usuarios (uid, nombre) VALUES (?, ?)', usuarios
+            )
+            nuevos = self.conn.total_changes - antes
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO estadisticas (uid, nombre, total_depositos, kg_total) VALUES (?, ?, 0, 0.0)',
+                usuarios
+            )
+        print(f"? {nuevos} usuarios importados ({len(usuarios) - nuevos} ya existian)")
+        return nuevos
+    
     def guardar_deposito(self, uid, porcentaje, kg, nivel_final):
         cursor = self.conn.cursor()
         
         # VERIFICAR que el usuario existe ANTES de guardar
         cursor.execute('SELECT uid FROM usuarios WHERE uid = ?', (uid,))
         if not cursor.fetchone():
-            print(f"? ERROR: Usuario {uid} no existe en BD. No se puede guardar depisito.")
+            print(f"? ERROR: Usuario {uid_a_hex(uid)} no existe en BD. No se puede guardar depisito.")
             return False
         
         cursor.execute('''
@@ -87,34 +155,38 @@ class DatabaseManager:
         deposito_id = cursor.lastrowid
         print(f"? Deposito #{deposito_id} guardado: {porcentaje}% ({kg:.2f}kg)")
         
+        # Encolar en el outbox en la misma transaccion que el deposito
+        cursor.execute('''
+            INSERT INTO outbox_depositos
+                (deposito_id, uid, nombre, porcentaje_depositado, kg_estimado, nivel_final, fecha)
+            SELECT d.id, d.uid, u.nombre, d.porcentaje_depositado, d.kg_estimado, d.nivel_final, d.fecha
+            FROM depositos d
+            JOIN usuarios u ON d.uid = u.uid
+            WHERE d.id = ?
+        ''', (deposito_id,))
+        
         cursor.execute('''
             UPDATE estadisticas 
             SET total_depositos = total_depositos + 1,
                 kg_total = kg_total + ?,
-                ultima_actualizacion = CURRENT_TIMESTAMP
+                ultima_actualizacion = ?
             WHERE uid = ?
-        ''', (kg, uid))
+        ''', (kg, ahora_ms(), uid))
         
-        print(f"? Estadisticas actualizadas para {uid}")
+        print(f"? Estadisticas actualizadas para {uid_a_hex(uid)}")
         
         self.conn.commit()
         return True
     
-    def obtener_estadisticas(self):
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            SELECT u.uid, u.nombre, e.total_depositos, e.kg_total
-            FROM usuarios u
-            JOIN estadisticas e ON u.uid = e.uid
-            ORDER BY e.kg_total DESC
-        ''')
-        resultados = cursor.fetchall()
+    def obtener_estadisticas(self, limit=None):
+        """Ranking por kg (los 'limit' primeros): recorre el indice del ranking sin ordenar"""
+        resultados = top_usuarios(self.conn, limit)
         print(f"?? {len(resultados)} usuarios con estadisticas")
         return resultados
     
     def obtener_historial(self, uid=None, limit=10):
         cursor = self.conn.cursor()
-        if uid:
+        if uid is not None:
             cursor.execute('''
                 SELECT d.fecha, u.nombre, d.porcentaje_depositado, d.kg_estimado, d.nivel_final
                 FROM depositos d
@@ -174,67 +246,39 @@ class DatabaseManager:
                     direccion TEXT,
                     municipio TEXT,
                     lat REAL,
-                    lon REAL
+                    lon REAL,
+                    tipo TEXT
                 )
             ''')
             conn_reciclaje.commit()
+            # Columna 'tipo' en BD antiguas e indices de busqueda (lat, lon) y por tipo
+            preparar_puntos(conn_reciclaje)
             conn_reciclaje.close()
             print(f"? Base de datos de reciclaje iniciada: {RECICLAJE_DB_FILE}")
         except Exception as e:
             print(f"!! Error inicializando BD de reciclaje: {e}")
     
-    def actualizar_puntos_reciclaje(self):
+    def actualizar_puntos_reciclaje(self, fuentes=None, forzar=False):
         """
-        Descarga puntos de reciclaje desde una API pública y los guarda en la BD.
-        API usada (reciclaje / puntos limpios):
-        https://datos.madrid.es/egob/catalogo/200284-0-puntos-limpios-fijos.json
+        Descarga los puntos de reciclaje de los datos abiertos de Madrid (puntos limpios
+        fijos, moviles, de proximidad y contenedores) y los guarda en la BD.
+        Las fuentes se descargan en paralelo y solo si han cambiado (ver descarga_puntos.py).
         """
         try:
-            conn_reciclaje = sqlite3.connect(RECICLAJE_DB_FILE)
-            cursor = conn_reciclaje.cursor()
-            
-            url = "https://datos.madrid.es/egob/catalogo/200284-0-puntos-limpios-fijos.json"
             print("\n? Actualizando puntos de reciclaje desde API publica...")
+            inicio = time.perf_counter()
+            for r in actualizar_puntos(RECICLAJE_DB_FILE, fuentes or FUENTES, forzar=forzar):
+                if r['estado'] == 'nuevo':
+                    print(f"? {r['tipo']}: {r['total']} puntos ({r['segundos']:.1f} s)")
+                elif r['estado'] == 'sin_cambios':
+                    print(f"? {r['tipo']}: sin cambios")
+                else:
+                    print(f"!! {r['tipo']}: {r['error']} (se conservan los puntos anteriores)")
             
-            resp = requests.get(url, timeout=10)
-            resp.raise_for_status()
-            data = resp.json()
-            
-            puntos = data.get("@graph", [])
-            if not puntos:
-                print("!! La API no devolvio puntos de reciclaje (@graph vacio).")
-                conn_reciclaje.close()
-                return
-            
-            # Limpiamos la tabla antes de insertar
-            cursor.execute("DELETE FROM puntos_reciclaje")
-            
-            insert_sql = """
-                INSERT INTO puntos_reciclaje (nombre, direccion, municipio, lat, lon)
-                VALUES (?, ?, ?, ?, ?)
-            """
-            
-            for p in puntos:
-                nombre = p.get("title", "Punto reciclaje")
-                address = p.get("address", {}) or {}
-                direccion = address.get("street-address", "")
-                municipio = address.get("locality", "")
-                
-                coord = p.get("location", {}) or {}
-                lat = None
-                lon = None
-                try:
-                    lat = float(coord.get("latitude")) if coord.get("latitude") is not None else None
-                    lon = float(coord.get("longitude")) if coord.get("longitude") is not None else None
-                except (TypeError, ValueError):
-                    lat, lon = None, None
-                
-                cursor.execute(insert_sql, (nombre, direccion, municipio, lat, lon))
-            
-            conn_reciclaje.commit()
-            total = cursor.execute("SELECT COUNT(*) FROM puntos_reciclaje").fetchone()[0]
-            print(f"? Puntos de reciclaje guardados en BD: {total}")
+            conn_reciclaje = sqlite3.connect(RECICLAJE_DB_FILE)
+            total = conn_reciclaje.execute("SELECT COUNT(*) FROM puntos_reciclaje").fetchone()[0]
             conn_reciclaje.close()
+            print(f"? Puntos de reciclaje guardados en BD: {total} ({time.perf_counter() - inicio:.1f} s)")
         except Exception as e:
             print(f"!! Error actualizando puntos de reciclaje desde API: {e}")
     
@@ -327,34 +371,68 @@ class DatabaseManager:
 """
 Sistema de Papelera Inteligente
 - Boton debe estar presionado para que funcione
-- Tarjeta debe mantenerse 5 segundos para registrar
+- El deposito se registra a la tarjeta presente en cuanto el nivel se estabiliza
+
+Las librerias de hardware (smbus2, grove, gpiod) y requests se importan solo
+cuando se usan, para que papelera_cli.py pueda consultar la BD sin ellas.
 """
 
+import os
+import csv
 import time
 import math
+import gzip
+import json
 import sqlite3
-import requests
+import queue
+import threading
+from collections import deque
 from datetime import datetime
-from smbus2 import SMBus
-from grove.gpio import GPIO
-from grove.grove_ultrasonic_ranger import GroveUltrasonicRanger
-from grove.display.jhd1802 import JHD1802
+from detector_depositos import DetectorDepositos
+from sesion_tarjeta import SesionTarjetas, INACTIVO, ESPERANDO, ACTIVA
+from uid_tarjeta import uid_a_hex, hex_a_uid, bytes_a_uid, migrar_uids_enteros
+from marcas_tiempo import SQL_AHORA_MS, ahora_ms, ms_a_iso, migrar_fechas_ms
+from informes import preparar_ranking, top_usuarios, generar_informe, formatear_tabla
+from reconciliacion import preparar_reconciliacion
+from descarga_puntos import preparar_puntos, actualizar_puntos, FUENTES
 
 # ============== CONFIGURACIN =============
 DISTANCIA_VACIA = 12  # cm cuando est vaca
 DISTANCIA_LLENA = 0   # cm cuando est llena
-TIEMPO_CONFIRMACION = 5  # segundos que debe estar la tarjeta
 DB_FILE = "papelera_inteligente.db"  # Base de datos SQLite
 RECICLAJE_DB_FILE = "reciclaje.db"  # Base de datos para puntos de reciclaje
 
+# Boton y ultrasonidos por la interfaz GPIO del kernel (reposo.py, ultrasonido.py). Si no
+# hay gpiod o /dev/gpiochip, o con False, se usan GPIO y GroveUltrasonicRanger de Grove
+GPIO_KERNEL = True
+
+# Reposo: antena RFID apagada y sin medir ni refrescar el LCD hasta que se pulsa el boton
+REPOSO_ACTIVO = True
+TIEMPO_HASTA_REPOSO = 2.0  # segundos inactiva antes de entrar en reposo
+ESPERA_REPOSO = 1.0  # s maximo por espera del boton (para atender Ctrl+C)
+
 # Coordenadas aproximadas de la papelera
 # Ejemplo: centro de Madrid
 LAT_PAPELERA = 40.4168
 LON_PAPELERA = -3.7038
 
+# Subida incremental de depositos al servidor central (None = desactivada)
+# Ejemplo: "http://10.172.117.10:5000/api/ingesta"
+INGESTA_URL = None
+PAPELERA_ID = "papelera-01"  # Identificador unico de esta papelera
+INTERVALO_SUBIDA = 30  # segundos entre envios
+TAMANO_LOTE_SUBIDA = 500  # depositos maximos por lote
+
+# Metricas de tiempos del bucle principal
+METRICAS_BUCLE_FILE = "metricas_bucle.json"  # Resumen periodico de percentiles
+INTERVALO_METRICAS = 60  # segundos entre volcados
+PRESUPUESTO_BUCLE = 0.2  # segundos maximos de trabajo por iteracion
+VENTANA_METRICAS = 1000  # muestras recientes por fase
+
 # ============== CLASE RFID ==============
 class WS1850S:
     def __init__(self, bus=1, addr=0x28):
+        from smbus2 import SMBus
         self.bus = SMBus(bus)
         self.addr = addr
     
@@ -373,9 +451,14 @@ class WS1850S:
         self._wr(0x2C, 0)
         self._wr(0x15, 0x40)
         self._wr(0x11, 0x3D)
+        self.antena(True)
+    
+    def antena(self, encendida):
+        """Enciende/apaga el campo RF (TxControlReg 0x14, bits Tx1RFEn y Tx2RFEn)"""
         val = self._rd(0x14)
-        if not (val & 0x03):
-            self._wr(0x14, val | 0x03)
+        nuevo = val | 0x03 if encendida else val & ~0x03
+        if nuevo != val:
+            self._wr(0x14, nuevo)
     
     def _transceive(self, data):
         self._wr(0x02, 0xF7)
@@ -406,18 +489,360 @@ class WS1850S:
         uid = self._transceive([0x93, 0x20])
         if uid and len(uid) == 5:
             if (uid[0] ^ uid[1] ^ uid[2] ^ uid[3]) == uid[4]:
-                return ''.join(f'{b:02X}' for b in uid[:4])
+                # Entero de 4 bytes; 0 (todo ceros) es ruido del bus, no una tarjeta
+                return bytes_a_uid(uid) or None
         return None
     
     def close(self):
         self.bus.close()
+# ============== OUTBOX DE DEPOSITOS ==============
+class OutboxDepositos:
+    """
+    Lectura del outbox de depositos para consumidores incrementales.
+    guardar_deposito encola cada deposito en la misma transaccion en que lo guarda;
+    cada consumidor avanza su propia posicion y compactar() borra lo que ya han
+    confirmado todos. Usa su propia conexion, asi que puede vivir en otro hilo o proceso.
+    """
+    def __init__(self, db_file):
+        self.conn = sqlite3.connect(db_file)
+        self.conn.execute('PRAGMA synchronous=FULL')
+    
+    def registrar_consumidor(self, consumidor):
+        """Da de alta un consumidor; empieza por los depositos aun no compactados"""
+        self.conn.execute(
+            'INSERT OR IGNORE INTO outbox_consumidores (consumidor, ultimo_seq) VALUES (?, 0)',
+            (consumidor,)
+        )
+        self.conn.commit()
+    
+    def posicion(self, consumidor):
+        fila = self.conn.execute(
+            'SELECT ultimo_seq FROM outbox_consumidores WHERE consumidor = ?', (consumidor,)
+        ).fetchone()
+        return fila[0] if fila else 0
+    
+    def pendientes(self, consumidor):
+        return self.conn.execute(
+            'SELECT COUNT(*) FROM outbox_depositos WHERE seq > ?', (self.posicion(consumidor),)
+        ).fetchone()[0]
+    
+    def leer_lote(self, consumidor, limite=TAMANO_LOTE_SUBIDA):
+        """Siguientes depositos sin confirmar por el consumidor, en orden de seq"""
+        cursor = self.conn.execute('''
+            SELECT seq, deposito_id, uid, nombre, porcentaje_depositado, kg_estimado, nivel_final, fecha
+            FROM outbox_depositos
+            WHERE seq > ?
+            ORDER BY seq
+            LIMIT ?
+        ''', (self.posicion(consumidor), limite))
+        return [
+            {
+                'seq': seq,
+                'deposito_id': deposito_id,
+                'uid': uid,
+                'nombre': nombre,
+                'porcentaje': porcentaje,
+                'kg': kg,
+                'nivel': nivel,
+                'fecha': fecha  # ms; SubidorDepositos la envia en ISO 8601
+            }
+            for seq, deposito_id, uid, nombre, porcentaje, kg, nivel, fecha in cursor.fetchall()
+        ]
+    
+    def confirmar(self, consumidor, hasta_seq):
+        """Avanza la posicion del consumidor (nunca retrocede)"""
+        self.conn.execute('''
+            INSERT INTO outbox_consumidores (consumidor, ultimo_seq) VALUES (?, ?)
+            ON CONFLICT(consumidor) DO UPDATE SET
+                ultimo_seq = MAX(ultimo_seq, excluded.ultimo_seq),
+                ultima_actualizacion = CURRENT_TIMESTAMP
+        ''', (consumidor, hasta_seq))
+        self.conn.commit()
+    
+    def drenar(self, consumidor, procesar, limite=TAMANO_LOTE_SUBIDA):
+        """
+        Entrega lotes a procesar(lote) hasta vaciar el outbox del consumidor.
+        procesar devuelve el ultimo seq que ha aplicado; se confirma hasta ahi.
+        Devuelve el numero de depositos confirmados.
+        """
+        confirmados = 0
+        while True:
+            lote = self.leer_lote(consumidor, limite)
+            if not lote:
+                break
+            hasta_seq = procesar(lote)
+            if hasta_seq is None or hasta_seq < lote[0]['seq']:
+                break
+            self.confirmar(consumidor, hasta_seq)
+            confirmados += sum(1 for d in lote if d['seq'] <= hasta_seq)
+            if hasta_seq < lote[-1]['seq'] or len(lote) < limite:
+                break
+        return confirmados
+    
+    def compactar(self):
+        """Borra los depositos ya confirmados por todos los consumidores"""
+        fila = self.conn.execute('SELECT MIN(ultimo_seq) FROM outbox_consumidores').fetchone()
+        if fila[0] is None:
+            return 0
+        borrados = self.conn.execute('DELETE FROM outbox_depositos WHERE seq <= ?', (fila[0],)).rowcount
+        self.conn.commit()
+        return borrados
+    
+    def cerrar(self):
+        self.conn.close()
+
+# ============== SUBIDA AL SERVIDOR CENTRAL ==============
+class SubidorDepositos(threading.Thread):
+    """
+    Envia en segundo plano los depositos del outbox al servidor central.
+    Cada lote va comprimido con gzip; el servidor responde con el ultimo seq
+    aplicado (high-water mark) y solo entonces se confirma en el outbox.
+    """
+    CONSUMIDOR = 'central'
+    
+    def __init__(self, db_file, url, papelera_id, intervalo=INTERVALO_SUBIDA, tamano_lote=TAMANO_LOTE_SUBIDA):
+        super().__init__(daemon=True)
+        self.db_file = db_file
+        self.url = url
+        self.papelera_id = papelera_id
+        self.intervalo = intervalo
+        self.tamano_lote = tamano_lote
+        self._parar = threading.Event()
+    
+    def run(self):
+        # Conexion propia: sqlite3 no permite compartir la del hilo principal
+        outbox = OutboxDepositos(self.db_file)
+        outbox.registrar_consumidor(self.CONSUMIDOR)
+        try:
+            while not self._parar.wait(self.intervalo):
+                self.subir_pendientes(outbox)
+            self.subir_pendientes(outbox)
+        finally:
+            outbox.cerrar()
+    
+    def detener(self):
+        self._parar.set()
+        self.join(timeout=15)
+    
+    def _enviar_lote(self, lote):
+        """POST del lote comprimido; devuelve el ack del servidor"""
+        import requests
+        # En la API los UID viajan en hexadecimal y las fechas en ISO 8601
+        cuerpo = gzip.compress(json.dumps({
+            'papelera_id': self.papelera_id,
+            'depositos': [dict(d, uid=uid_a_hex(d['uid']), fecha=ms_a_iso(d['fecha'])) for d in lote]
+        }, separators=(',', ':')).encode('utf-8'))
+        resp = requests.post(
+            self.url,
+            data=cuerpo,
+            headers={'Content-Type': 'application/json', 'Content-Encoding': 'gzip'},
+            timeout=10
+        )
+        resp.raise_for_status()
+        return int(resp.json()['ack'])
+    
+    def subir_pendientes(self, outbox):
+        """Envia lotes hasta vaciar el outbox. Devuelve el numero de depositos confirmados."""
+        enviados = 0
+        try:
+            enviados = outbox.drenar(self.CONSUMIDOR, self._enviar_lote, self.tamano_lote)
+            outbox.compactar()
+        except Exception as e:
+            print(f"!! Error subiendo depositos al servidor central: {e}")
+        
+        if enviados:
+            print(f"? {enviados} depositos sincronizados con el servidor central")
+        return enviados
+
+# ============== IMPORTACION DE USUARIOS ==============
+def leer_usuarios_archivo(ruta):
+    """
+    Lee usuarios de un CSV (columnas uid,nombre; cabecera opcional) o de un JSON
+    (lista de {"uid": ..., "nombre": ...} o diccionario {uid: nombre}).
+    Los UID vienen en hexadecimal; devuelve [(uid, nombre), ...] con UIDs enteros.
+    """
+    with open(ruta, encoding='utf-8', newline='') as f:
+        if ruta.lower().endswith('.json'):
+            datos = json.load(f)
+            if isinstance(datos, dict):
+                filas = datos.items()
+            else:
+                filas = ((d['uid'], d.get('nombre')) for d in datos)
+        else:
+            filas = [fila[:2] for fila in csv.reader(f) if fila]
+            if filas and filas[0][0].strip().lower() == 'uid':
+                filas = filas[1:]
+    
+    usuarios = []
+    for fila in filas:
+        if not str(fila[0]).strip():
+            continue
+        uid = hex_a_uid(fila[0])
+        nombre = (fila[1] if len(fila) > 1 else None) or f"User-{uid_a_hex(uid)[-4:]}"
+        usuarios.append((uid, str(nombre).strip()))
+    return usuarios
+
+# ============== ESCRITURA DE DEPOSITOS ==============
+class EscritorDepositos(threading.Thread):
+    """
+    Escribe los depositos en la BD fuera del bucle principal, para que un commit
+    lento en la tarjeta SD no bloquee las lecturas de tarjetas.
+    Los resultados se recogen desde el bucle con resultados_listos().
+    """
+    def __init__(self, db_file):
+        super().__init__(daemon=True)
+        self.db_file = db_file
+        self.pendientes = queue.Queue()
+        self.resultados = queue.Queue()
+    
+    def run(self):
+        # Conexion propia: sqlite3 no permite compartir la del hilo principal
+        db = DatabaseManager(self.db_file)
+        try:
+            while True:
+                peticion = self.pendientes.get()
+                if peticion is None:
+                    break
+                uid, nombre, porcentaje, kg, nivel, usuario_nuevo = peticion
+                inicio = time.perf_counter()
+                try:
+                    if usuario_nuevo:
+                        db.registrar_usuario(uid, nombre)
+                    guardado = db.guardar_deposito(uid, porcentaje, kg, nivel)
+                    fila = db.conn.execute(
+                        'SELECT total_depositos, kg_total FROM estadisticas WHERE uid = ?', (uid,)
+                    ).fetchone()
+                except sqlite3.Error as e:
+                    print(f"\n!! Error guardando deposito de {uid_a_hex(uid)}: {e}")
+                    guardado, fila = False, None
+                self.resultados.put({
+                    'uid': uid,
+                    'nombre': nombre,
+                    'porcentaje': porcentaje,
+                    'kg': kg,
+                    'nivel': nivel,
+                    'guardado': guardado,
+                    'total_depositos': fila[0] if fila else None,
+                    'kg_total': fila[1] if fila else None,
+                    'duracion': time.perf_counter() - inicio
+                })
+        finally:
+            db.conn.close()
+    
+    def encolar(self, uid, nombre, porcentaje, kg, nivel, usuario_nuevo):
+        self.pendientes.put((uid, nombre, porcentaje, kg, nivel, usuario_nuevo))
+    
+    def resultados_listos(self):
+        while True:
+            try:
+                yield self.resultados.get_nowait()
+            except queue.Empty:
+                return
+    
+    def detener(self):
+        """Termina las escrituras pendientes y cierra la conexion"""
+        self.pendientes.put(None)
+        self.join()
+
+# ============== METRICAS DEL BUCLE ==============
+class TemporizadorFases:
+    """
+    Tiempos de cada fase del bucle principal (boton, ultrasonido, rfid, lcd, bd, despertar)
+    en ventanas deslizantes. Cada INTERVALO_METRICAS segundos vuelca percentiles
+    a METRICAS_BUCLE_FILE, junto con las iteraciones que superan el presupuesto.
+    """
+    def __init__(self, archivo=METRICAS_BUCLE_FILE, intervalo=INTERVALO_METRICAS,
+                 presupuesto=PRESUPUESTO_BUCLE, ventana=VENTANA_METRICAS):
+        self.archivo = archivo
+        self.intervalo = intervalo
+        self.presupuesto = presupuesto
+        self.ventana = ventana
+        self.muestras = {}  # {fase: deque de segundos}
+        self.iteraciones = 0
+        self.excesos = 0
+        self.ultimo_volcado = time.monotonic()
+    
+    def registrar(self, fase, inicio):
+        """Anota la duracion de una fase iniciada en 'inicio' (perf_counter) y devuelve el instante actual"""
+        ahora = time.perf_counter()
+        self.anotar(fase, ahora - inicio)
+        return ahora
+    
+    def anotar(self, fase, duracion):
+        muestras = self.muestras.get(fase)
+        if muestras is None:
+            muestras = self.muestras[fase] = deque(maxlen=self.ventana)
+        muestras.append(duracion)
+    
+    def fin_iteracion(self, inicio):
+        """Cierra una iteracion del bucle y vuelca el resumen si toca"""
+        duracion = self.registrar('iteracion', inicio) - inicio
+        self.iteraciones += 1
+        if duracion > self.presupuesto:
+            self.excesos += 1
+        if time.monotonic() - self.ultimo_volcado >= self.intervalo:
+            self.volcar()
+    
+    def resumen(self):
+        fases = {}
+        for fase, muestras in self.muestras.items():
+            if not muestras:
+                continue
+            ordenadas = sorted(muestras)
+            n = len(ordenadas)
+            fases[fase] = {
+                'n': n,
+                'p50_ms': round(ordenadas[int(n * 0.50)] * 1000, 2),
+                'p95_ms': round(ordenadas[min(n - 1, int(n * 0.95))] * 1000, 2),
+                'p99_ms': round(ordenadas[min(n - 1, int(n * 0.99))] * 1000, 2),
+                'max_ms': round(ordenadas[-1] * 1000, 2)
+            }
+        return {
+            'fecha': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'iteraciones': self.iteraciones,
+            'excesos_presupuesto': self.excesos,
+            'presupuesto_ms': self.presupuesto * 1000,
+            'fases': fases
+        }
+    
+    def volcar(self):
+        """Escribe el resumen de forma atomica (archivo temporal + rename)"""
+        self.ultimo_volcado = time.monotonic()
+        try:
+            temporal = self.archivo + '.tmp'
+            with open(temporal, 'w') as f:
+                json.dump(self.resumen(), f, indent=2)
+            os.replace(temporal, self.archivo)
+        except OSError as e:
+            print(f"\n!! Error guardando metricas del bucle: {e}")
+
+# ============== ESTADISTICAS ==============
+def imprimir_estadisticas(db):
+    """Muestra estadisticas desde la base de datos (agregadas en SQL, ver informes.py)"""
+    print("\n" + formatear_tabla(generar_informe(db.conn)))
+
 # ============== CLASE SISTEMA ==============
 class SistemaPapelera:
-    def __init__(self):
+    def __init__(self, actualizar_puntos=True):
+        from grove.gpio import GPIO
+        from grove.grove_ultrasonic_ranger import GroveUltrasonicRanger
+        from grove.display.jhd1802 import JHD1802
+        from ultrasonido import UltrasonidoGPIO, PIN_ULTRASONIDO
+        from reposo import BotonGPIOD, BotonSondeo, PIN_BOTON
+        
         # Hardware
         self.rfid = WS1850S()
-        self.boton = GPIO(5, GPIO.IN)
-        self.ultrasonic = GroveUltrasonicRanger(18)
+        self.boton = self.ultrasonic = None
+        if GPIO_KERNEL:
+            try:
+                self.boton = BotonGPIOD()
+                self.ultrasonic = UltrasonidoGPIO()
+            except (RuntimeError, OSError) as e:
+                print(f"!! GPIO del kernel no disponible ({e}), se usa Grove")
+        if self.boton is None:
+            self.boton = BotonSondeo(GPIO(PIN_BOTON, GPIO.IN))
+        if self.ultrasonic is None:
+            self.ultrasonic = GroveUltrasonicRanger(PIN_ULTRASONIDO)
         self.lcd = JHD1802()
         
         # Base de datos
@@ -425,7 +850,8 @@ class SistemaPapelera:
         
         # Inicializar base de datos de reciclaje
         self.db.inicializar_reciclaje_db()
-        self.db.actualizar_puntos_reciclaje()
+        if actualizar_puntos:
+            self.db.actualizar_puntos_reciclaje()
         
         # Mostrar punto mas cercano al inicio
         punto_cercano = self.db.obtener_punto_reciclaje_mas_cercano()
@@ -440,12 +866,23 @@ class SistemaPapelera:
             print("=" * 50 + "\n")
         
         # Estado
-        self.tarjeta_actual = None
-        self.tiempo_tarjeta = 0
-        self.porcentaje_inicial = 0
-        self.ultima_lectura_exitosa = 0  # Timestamp ltima lectura RFID
-        self.timeout_perdida = 1.5  # Segundos sin lectura para considerar retirada
-        self.usuarios = {}  # Cache local: {uid: {'nombre': str}}
+        self.sesion = SesionTarjetas()  # Presencia de tarjetas y registro en curso
+        self.detector = DetectorDepositos()  # Subidas de nivel sobre la serie continua
+        self.escritor = EscritorDepositos(DB_FILE)  # Escrituras en BD fuera del bucle
+        self.escritor.start()
+        self.usuarios = self.db.cargar_usuarios()  # Cache local: {uid: nombre}
+        print(f"? {len(self.usuarios)} usuarios cargados en cache")
+        self.tiempos = TemporizadorFases()  # Tiempos de cada fase del bucle
+        self.texto_lcd = None  # Ultimo texto escrito: no se reescribe si no cambia
+        self.estado_mostrado = None
+        self.inactivo_desde = None  # Para entrar en reposo tras TIEMPO_HASTA_REPOSO
+        self.despertar = None  # perf_counter al salir del reposo, hasta la primera lectura RFID
+        
+        # Subida incremental al servidor central
+        self.subidor = None
+        if INGESTA_URL:
+            self.subidor = SubidorDepositos(DB_FILE, INGESTA_URL, PAPELERA_ID)
+            self.subidor.start()
         
         # Inicializar
         self.rfid.init()
@@ -458,76 +895,112 @@ class SistemaPapelera:
         return max(0, min(100, int(porcentaje)))
     
     def mostrar_lcd(self, linea1, linea2=""):
-        """Muestra texto en LCD"""
+        """Muestra texto en LCD (solo si cambia)"""
+        if (linea1, linea2) == self.texto_lcd:
+            return
+        self.texto_lcd = (linea1, linea2)
+        inicio = time.perf_counter()
         self.lcd.setCursor(0, 0)
         self.lcd.write(f"{linea1:<16}")
         self.lcd.setCursor(1, 0)
         self.lcd.write(f"{linea2:<16}")
+        self.tiempos.registrar('lcd', inicio)
+    
+    def nombre_usuario(self, uid):
+        return self.usuarios.get(uid) or f"User-{uid_a_hex(uid)[-4:]}"
     
     def registrar_deposito(self, uid, porcentaje_depositado, porcentaje_final):
-        """Registra depsito del usuario despus de 5 segundos"""
+        """Encola el deposito del usuario cuando el detector confirma la subida de nivel"""
         # Obtener o crear usuario
-        if uid not in self.usuarios:
-            nombre = f"User-{uid[-4:]}"
-            self.usuarios[uid] = {'nombre': nombre}
-            self.db.registrar_usuario(uid, nombre)
-        else:
-            nombre = self.usuarios[uid]['nombre']
+        usuario_nuevo = uid not in self.usuarios
+        nombre = self.nombre_usuario(uid)
+        if usuario_nuevo:
+            self.usuarios[uid] = nombre
         
         # Estimar kg (aproximado: 1% = 0.05 kg)
         kg = porcentaje_depositado * 0.05
         
-        # Guardar en base de datos
-        self.db.guardar_deposito(uid, porcentaje_depositado, kg, porcentaje_final)
+        # Guardar en base de datos (hilo escritor)
+        self.escritor.encolar(uid, nombre, porcentaje_depositado, kg, porcentaje_final, usuario_nuevo)
+        self.sesion.inicio_registro(time.time(), uid)
+        self.mostrar_lcd("Guardando...", f"{nombre[:12]}")
+    
+    def deposito_registrado(self, resultado):
+        """Resultado del hilo escritor"""
+        self.tiempos.anotar('bd', resultado['duracion'])
+        self.sesion.fin_registro(time.time())
+        if not resultado['guardado']:
+            self.mostrar_lcd("Error al guardar", resultado['nombre'][:16])
+            return
         
-        # Obtener estadsticas actualizadas
-        stats = self.db.obtener_estadisticas()
-        usuario_stats = next((s for s in stats if s[0] == uid), None)
-        if usuario_stats:
-            _, _, total_depositos, kg_total = usuario_stats
-            
-            print(f"\n? REGISTRADO - {nombre}:")
-            print(f"  Depositado ahora: +{porcentaje_depositado}% (~{kg:.2f}kg)")
-            print(f"  Total usuario: {kg_total:.2f}kg en {total_depositos} depositos")
-            print(f"  Nivel papelera: {porcentaje_final}%")
-            print(f"  ?? Guardado en base de datos")
-        
-        self.mostrar_lcd(f"Registrado!", f"{nombre[:12]}")
-        time.sleep(2)
+        print(f"\n? REGISTRADO - {resultado['nombre']}:")
+        print(f"  Depositado ahora: +{resultado['porcentaje']}% (~{resultado['kg']:.2f}kg)")
+        if resultado['kg_total'] is not None:
+            print(f"  Total usuario: {resultado['kg_total']:.2f}kg en {resultado['total_depositos']} depositos")
+        print(f"  Nivel papelera: {resultado['nivel']}%")
+        print(f"  ?? Guardado en base de datos")
+        
+        self.mostrar_lcd(f"Registrado!", f"{resultado['nombre'][:12]}")
+    
+    def notificar_eventos(self):
+        """Mensajes de consola/LCD para las transiciones de la sesion"""
+        for tipo, uid in self.sesion.eventos_pendientes():
+            nombre = self.nombre_usuario(uid)
+            if tipo == 'nueva':
+                print(f"\n? Tarjeta detectada: {nombre}")
+                print(f"   Deposita los residuos...")
+            elif tipo == 'retirada':
+                print(f"\n? Tarjeta retirada")
+            elif tipo == 'cancelada':
+                print(f"\n??  Boton soltado - Registro cancelado")
+            elif tipo == 'en_cola':
+                print(f"\n? {nombre} en espera: se activa al terminar el registro actual")
+    
+    def mostrar_estado(self, porcentaje_actual):
+        """LCD y linea de estado segun el estado de la sesion"""
+        estado = self.sesion.estado
+        if estado == INACTIVO:
+            self.mostrar_lcd("Sistema listo", "Presiona boton")
+            if self.estado_mostrado != INACTIVO:
+                print("\r?? Sistema inactivo - Presiona el boton para usar    ", end="")
+        elif estado == ESPERANDO:
+            self.mostrar_lcd("Boton presionado", f"Nivel: {porcentaje_actual}%")
+            print(f"\r?? Nivel: {porcentaje_actual}% | Esperando tarjeta...    ", end="")
+        elif estado == ACTIVA:
+            porcentaje_depositado = self.detector.incremento_en_curso()
+            if self.detector.subiendo:
+                linea1 = "Midiendo..."
+            else:
+                linea1 = f"Hola {self.nombre_usuario(self.sesion.uid)[:11]}"
+            self.mostrar_lcd(linea1, f"Nivel: {porcentaje_actual}% (+{porcentaje_depositado}%)")
+            print(f"\r??  {linea1} | Nivel: {porcentaje_actual}% (+{porcentaje_depositado}%)    ", end="")
+        # REGISTRANDO: se mantiene el mensaje de "Guardando..."/"Registrado!"
+        self.estado_mostrado = estado
+    
+    def puede_reposar(self, ahora):
+        """Inactiva (boton suelto, sin registros en curso) durante TIEMPO_HASTA_REPOSO"""
+        if not REPOSO_ACTIVO or self.sesion.estado != INACTIVO:
+            self.inactivo_desde = None
+            return False
+        if self.inactivo_desde is None:
+            self.inactivo_desde = ahora
+        return ahora - self.inactivo_desde >= TIEMPO_HASTA_REPOSO
+    
+    def reposo(self):
+        """Apaga la antena y duerme hasta que se pulsa el boton"""
+        self.rfid.antena(False)
+        self.mostrar_lcd("En reposo", "Presiona boton")
+        print("\r?? En reposo - Presiona el boton para usar          ", end="")
+        # Esperas acotadas para atender Ctrl+C tambien en reposo
+        while not self.boton.esperar_pulsacion(ESPERA_REPOSO):
+            pass
+        self.despertar = time.perf_counter()
+        self.rfid.antena(True)
+        self.inactivo_desde = None
+    
     def mostrar_estadisticas(self):
         """Muestra estadsticas desde la base de datos"""
-        print("\n" + "="*60)
-        print("       ESTADISTICAS DE USO - BASE DE DATOS")
-        print("="*60)
-        
-        stats = self.db.obtener_estadisticas()
-        
-        if not stats:
-            print("No hay registros todavia")
-            return
-        
-        for uid, nombre, total_depositos, kg_total in stats:
-            print(f"\n{nombre}")
-            print(f"  UID: {uid}")
-            print(f"  Depositos: {total_depositos}")
-            print(f"  Total: {kg_total:.2f}kg")
-        
-        total_kg = sum(s[3] for s in stats)
-        total_depositos = sum(s[2] for s in stats)
-        print("\n" + "-"*60)
-        print(f"TOTAL GENERAL: {total_kg:.2f}kg en {total_depositos} depositos")
-        print("="*60)
-        # Mostrar ltimos 5 depsitos
-        print("\n" + "="*60)
-        print("       ULTIMOS 5 DEPOSITOS")
-        print("="*60)
-        historial = self.db.obtener_historial(limit=5)
-        
-        for fecha, nombre, porcentaje, kg, nivel in historial:
-            fecha_formateada = datetime.strptime(fecha, '%Y-%m-%d %H:%M:%S').strftime('%d/%m/%Y %H:%M')
-            print(f"{fecha_formateada} - {nombre}: +{porcentaje}% (~{kg:.2f}kg) ? Nivel: {nivel}%")
-        
-        print("="*60)
+        imprimir_estadisticas(self.db)
         
     def ejecutar(self):
         """Bucle principal del sistema"""
@@ -537,113 +1010,77 @@ class SistemaPapelera:
         print("\nFUNCIONAMIENTO:")
         print("  1. Manten PRESIONADO el boton")
         print("  2. Acerca tu tarjeta RFID")
-        print("  3. Manten la tarjeta 5 segundos para confirmar")
-        print("  4. Deposito quedo registrado")
+        print("  3. Deposita los residuos con la tarjeta acercada")
+        print("  4. El deposito se registra al estabilizarse el nivel")
         print("\nPresiona Ctrl+C para ver estadasticas y salir\n")
         
+        porcentaje_actual = 0
         try:
             while True:
+                inicio_iteracion = time.perf_counter()
                 boton_presionado = self.boton.read()
+                t = self.tiempos.registrar('boton', inicio_iteracion)
+                ahora = time.time()
+                
+                # Escrituras terminadas en el hilo escritor
+                for resultado in self.escritor.resultados_listos():
+                    self.deposito_registrado(resultado)
                 
                 # SISTEMA SOLO FUNCIONA SI BOTN EST PRESIONADO
+                self.sesion.boton(ahora, boton_presionado)
                 if boton_presionado:
+                    # Leer tarjeta antes de medir: sin eco, la medida puede tardar
+                    # INTENTOS_MEDIDA x TIMEOUT_ECO y retrasaria la lectura al despertar
+                    uid = self.rfid.read_uid()
+                    t = self.tiempos.registrar('rfid', t)
+                    if self.despertar is not None:
+                        # Del boton a la primera lectura de tarjeta tras el reposo (< 100 ms)
+                        self.tiempos.registrar('despertar', self.despertar)
+                    self.sesion.lectura(ahora, uid)
+                    
                     # Medir nivel
                     distancia = self.ultrasonic.get_distance()
-                    porcentaje_actual = self.calcular_porcentaje(distancia)
+                    self.tiempos.registrar('ultrasonido', t)
+                    if distancia is not None:  # Sin eco se mantiene el ultimo nivel
+                        porcentaje_actual = self.calcular_porcentaje(distancia)
                     
-                    # Leer tarjeta
-                    uid = self.rfid.read_uid()
+                    # Detectar subidas de nivel sobre la serie continua
+                    deposito = self.detector.actualizar(ahora, porcentaje_actual)
                     
-                    if uid:
-                        # Actualizar timestamp de ltima lectura exitosa
-                        self.ultima_lectura_exitosa = time.time()
-                        
-                        # Si es nueva tarjeta
-                        if uid != self.tarjeta_actual:
-                            # Nueva tarjeta detectada
-                            self.tarjeta_actual = uid
-                            self.tiempo_tarjeta = time.time()
-                            self.porcentaje_inicial = porcentaje_actual
-                            
-                            nombre = self.usuarios.get(uid, {}).get('nombre', f"User-{uid[-4:]}")
-                            print(f"\n? Tarjeta detectada: {nombre}")
-                            print(f"   Manten la tarjeta para confirmar...")
-                            
-                            self.mostrar_lcd(f"Hola {nombre[:12]}", "Mantenla 5 seg")
-                        
-                        # Calcular tiempo transcurrido
-                        tiempo_transcurrido = time.time() - self.tiempo_tarjeta
-                        tiempo_restante = TIEMPO_CONFIRMACION - tiempo_transcurrido
-                        
-                        if tiempo_restante > 0:
-                            # An no han pasado 5 segundos
-                            porcentaje_depositado = porcentaje_actual - self.porcentaje_inicial
-                            
-                            self.mostrar_lcd(
-                                f"Confirma: {int(tiempo_restante)}s",
-                                f"Nivel: {porcentaje_actual}% (+{porcentaje_depositado}%)"
-                            )
-                            
-                            print(f"\r??  Confirmando... {int(tiempo_restante)}s | Nivel: {porcentaje_actual}% (+{porcentaje_depositado}%)    ", end="")
-                        else:
-                            # 5 segundos cumplidos! Registrar
-                            porcentaje_depositado = porcentaje_actual - self.porcentaje_inicial
-                            self.registrar_deposito(uid, porcentaje_depositado, porcentaje_actual)
-                            
-                            # Resetear para permitir nuevo registro
-                            self.porcentaje_inicial = porcentaje_actual
-                            self.tiempo_tarjeta = time.time()
-                    
-                    else:
-                        # No se ley tarjeta en este ciclo
-                        # Solo considerar retirada si ha pasado el timeout SIN lecturas
-                        if self.tarjeta_actual:
-                            tiempo_sin_lectura = time.time() - self.ultima_lectura_exitosa
-                            
-                            if tiempo_sin_lectura > self.timeout_perdida:
-                                # Realmente se retir la tarjeta
-                                print(f"\n? Tarjeta retirada (no confirmado)")
-                                self.tarjeta_actual = None
-                            else:
-                                # Fallo temporal de lectura, seguir mostrando progreso
-                                tiempo_transcurrido = time.time() - self.tiempo_tarjeta
-                                tiempo_restante = TIEMPO_CONFIRMACION - tiempo_transcurrido
-                                
-                                if tiempo_restante > 0:
-                                    porcentaje_depositado = porcentaje_actual - self.porcentaje_inicial
-                                    
-                                    self.mostrar_lcd(
-                                        f"Confirma: {int(tiempo_restante)}s",
-                                        f"Nivel: {porcentaje_actual}% (+{porcentaje_depositado}%)"
-                                    )
-                                    
-                                    print(f"\r??  Confirmando... {int(tiempo_restante)}s | Nivel: {porcentaje_actual}% (+{porcentaje_depositado}%)    ", end="")
+                    if deposito:
+                        # El nivel se ha estabilizado tras una subida: registrar ya
+                        uid_deposito = self.sesion.atribuir(ahora)
+                        if uid_deposito:
+                            self.registrar_deposito(uid_deposito, deposito.incremento, deposito.nivel_final)
                         else:
-                            # No hay tarjeta y no haba ninguna antes
-                            self.mostrar_lcd(
-                                "Boton presionado",
-                                f"Nivel: {porcentaje_actual}%"
-                            )
-                            print(f"\r?? Nivel: {porcentaje_actual}% | Esperando tarjeta...    ", end="")
+                            print(f"\n!! Deposito de +{deposito.incremento}% sin tarjeta (no registrado)")
                 
-                else:
-                    # BOTN NO PRESIONADO - Sistema inactivo
-                    if self.tarjeta_actual:
-                        print(f"\n??  Boton soltado - Registro cancelado")
-                        self.tarjeta_actual = None
-                    
-                    self.mostrar_lcd("Sistema listo", "Presiona boton")
-                    print("\r?? Sistema inactivo - Presiona el boton para usar    ", end="")
+                self.despertar = None
+                
+                self.sesion.tick(ahora)
+                self.notificar_eventos()
+                self.mostrar_estado(porcentaje_actual)
                 
+                self.tiempos.fin_iteracion(inicio_iteracion)
+                if self.puede_reposar(ahora):
+                    self.reposo()
+                    continue  # Sin la pausa: la primera lectura de tarjeta sale ya
                 time.sleep(0.2) 
                         
         
         except KeyboardInterrupt:
             print("\n\n?? Deteniendo sistema...")
+            self.escritor.detener()  # Terminar las escrituras pendientes antes del resumen
+            self.tiempos.volcar()
             self.mostrar_estadisticas()
             self.lcd.clear()
             self.mostrar_lcd("Sistema", "detenido")
             self.rfid.close()
+            self.boton.cerrar()
+            if hasattr(self.ultrasonic, 'cerrar'):
+                self.ultrasonic.cerrar()  # Libera la linea GPIO (UltrasonidoGPIO)
+            if self.subidor:
+                self.subidor.detener()
             self.db.cerrar()
             print(f"\n? Datos guardados en: {DB_FILE}")
             print("? Sistema cerrado correctamente\n")
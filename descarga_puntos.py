@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Descarga de los puntos de reciclaje de los datos abiertos de Madrid
+Ademas de los puntos limpios fijos se cargan los moviles, los de proximidad y los
+contenedores de calle (decenas de miles de puntos) en 'reciclaje.db', con una columna
+'tipo' por fuente:
+
+- Las fuentes se descargan en paralelo (un hilo por fuente) con GET condicional
+  (ETag / Last-Modified guardados en 'fuentes_reciclaje'): si no han cambiado el
+  servidor responde 304 y no se descargan ni se reescriben.
+- Solo el hilo principal escribe en la BD, cada fuente en cuanto llega y en su propia
+  transaccion: una fuente lenta o caida no retrasa a las demas y conserva sus puntos.
+- Una fuente puede ser una URL http(s), file:// o una ruta local (para probar con
+  ficheros de ejemplo); en los ficheros locales la fecha de modificacion hace de ETag.
+
+Uso:
+    python papelera_cli.py refresh-points [--fuentes fuentes.json] [--forzar]
+"""
+
+import os
+import io
+import csv
+import json
+import time
+import sqlite3
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse, unquote
+
+# ============== CONFIGURACION ==============
+# (tipo, url, formato). Se pueden sustituir con un JSON: [{"tipo": .., "url": .., "formato": ..}]
+FUENTES = [
+    ("punto_limpio_fijo", "https://datos.madrid.es/egob/catalogo/200284-0-puntos-limpios-fijos.json", "json"),
+    ("punto_limpio_movil", "https://datos.madrid.es/egob/catalogo/200284-1-puntos-limpios-moviles.json", "json"),
+    ("punto_limpio_proximidad", "https://datos.madrid.es/egob/catalogo/300198-0-puntos-limpios-proximidad.json", "json"),
+    ("contenedor", "https://datos.madrid.es/egob/catalogo/300198-1-contenedores-residuos.csv", "csv"),
+]
+TIPO_ANTERIOR = "punto_limpio_fijo"  # filas cargadas antes de existir la columna 'tipo'
+TIMEOUT_DESCARGA = 30  # segundos (conexion y lectura) por fuente
+
+COLUMNAS = ('tipo', 'nombre', 'direccion', 'municipio', 'lat', 'lon')
+
+
+def preparar_puntos(conn):
+    """Columna 'tipo' (BD antiguas), indices e indice de texto de 'puntos_reciclaje' (idempotente)"""
+    columnas = [c[1] for c in conn.execute('PRAGMA table_info(puntos_reciclaje)')]
+    if not columnas:
+        return
+    if 'tipo' not in columnas:
+        conn.execute('ALTER TABLE puntos_reciclaje ADD COLUMN tipo TEXT')
+        conn.execute('UPDATE puntos_reciclaje SET tipo = ? WHERE tipo IS NULL', (TIPO_ANTERIOR,))
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_puntos_lat_lon ON puntos_reciclaje(lat, lon)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_puntos_tipo ON puntos_reciclaje(tipo)')
+    conn.commit()
+    preparar_busqueda(conn)
+
+
+def preparar_busqueda(conn):
+    """
+    Indice FTS5 'puntos_fts' (nombre, direccion, municipio) sobre 'puntos_reciclaje'.
+    Es de contenido externo (no duplica el texto) y lo mantienen al dia unos triggers,
+    asi que cualquier escritura (descarga, sincronizacion) lo actualiza.
+    Si el SQLite instalado no tiene FTS5 no se crea y la busqueda no esta disponible.
+    """
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'puntos_fts'").fetchone():
+        return
+    try:
+        conn.executescript('''
+            BEGIN;
+            CREATE VIRTUAL TABLE puntos_fts USING fts5(
+                nombre, direccion, municipio,
+                content='puntos_reciclaje', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            );
+
+            CREATE TRIGGER IF NOT EXISTS trg_puntos_fts_insertado
+            AFTER INSERT ON puntos_reciclaje
+            BEGIN
+                INSERT INTO puntos_fts (rowid, nombre, direccion, municipio)
+                VALUES (NEW.id, NEW.nombre, NEW.direccion, NEW.municipio);
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS trg_puntos_fts_borrado
+            AFTER DELETE ON puntos_reciclaje
+            BEGIN
+                INSERT INTO puntos_fts (puntos_fts, rowid, nombre, direccion, municipio)
+                VALUES ('delete', OLD.id, OLD.nombre, OLD.direccion, OLD.municipio);
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS trg_puntos_fts_modificado
+            AFTER UPDATE OF nombre, direccion, municipio ON puntos_reciclaje
+            BEGIN
+                INSERT INTO puntos_fts (puntos_fts, rowid, nombre, direccion, municipio)
+                VALUES ('delete', OLD.id, OLD.nombre, OLD.direccion, OLD.municipio);
+                INSERT INTO puntos_fts (rowid, nombre, direccion, municipio)
+                VALUES (NEW.id, NEW.nombre, NEW.direccion, NEW.municipio);
+            END;
+
+            -- Indexar los puntos que ya habia
+            INSERT INTO puntos_fts (puntos_fts) VALUES ('rebuild');
+            COMMIT;
+        ''')
+    except sqlite3.OperationalError as e:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        if 'fts5' not in str(e):
+            raise
+
+
+def leer_fuentes(ruta):
+    """Lista de fuentes desde un JSON [{"tipo", "url", "formato"}]"""
+    with open(ruta, encoding='utf-8') as f:
+        return [(d['tipo'], d['url'], d.get('formato')) for d in json.load(f)]
+
+
+# ============== FORMATOS ==============
+def _numero(valor):
+    if valor is None or str(valor).strip() == '':
+        return None
+    try:
+        return float(str(valor).strip().replace(',', '.'))
+    except ValueError:
+        return None
+
+
+def parsear_json(contenido, tipo):
+    """Formato JSON-LD de datos.madrid.es: lista '@graph' con title, address y location"""
+    puntos = []
+    for p in json.loads(contenido).get("@graph", []):
+        address = p.get("address", {}) or {}
+        coord = p.get("location", {}) or {}
+        puntos.append((
+            tipo,
+            p.get("title", "Punto reciclaje"),
+            address.get("street-address", ""),
+            address.get("locality", ""),
+            _numero(coord.get("latitude")),
+            _numero(coord.get("longitude")),
+        ))
+    return puntos
+
+
+def _clave(texto):
+    """'LATITUD' / 'Latitud ' / 'Dirección' -> 'latitud' / 'latitud' / 'direccion'"""
+    texto = unicodedata.normalize('NFKD', texto.strip().lower())
+    return ''.join(c for c in texto if not unicodedata.combining(c))
+
+
+def parsear_csv(contenido, tipo):
+    """CSV de datos.madrid.es (';', UTF-8 o Latin-1) con columnas LATITUD y LONGITUD"""
+    try:
+        texto = contenido.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        texto = contenido.decode('latin-1')
+    separador = ';' if texto.split('\n', 1)[0].count(';') else ','
+    lector = csv.reader(io.StringIO(texto), delimiter=separador)
+    cabecera = [_clave(c) for c in next(lector, [])]
+
+    def columna(*nombres):
+        for nombre in nombres:
+            if nombre in cabecera:
+                return cabecera.index(nombre)
+        return None
+
+    i_nombre = columna('nombre', 'tipo contenedor', 'descripcion modelo')
+    i_direccion = columna('direccion')
+    i_municipio = columna('municipio', 'distrito')
+    i_lat = columna('latitud', 'lat')
+    i_lon = columna('longitud', 'lon')
+
+    def valor(fila, i, defecto=''):
+        return fila[i].strip() if i is not None and i < len(fila) else defecto
+
+    return [
+        (tipo, valor(fila, i_nombre, tipo), valor(fila, i_direccion), valor(fila, i_municipio),
+         _numero(valor(fila, i_lat, None)), _numero(valor(fila, i_lon, None)))
+        for fila in lector if fila
+    ]
+
+
+# ============== DESCARGA (hilos) ==============
+def _ruta_local(url):
+    if url.startswith('file://'):
+        return unquote(urlparse(url).path)
+    if '://' not in url:
+        return url
+    return None
+
+
+def descargar(tipo, url, formato=None, etag=None, ultima_modificacion=None, timeout=TIMEOUT_DESCARGA):
+    """
+    Descarga y parsea una fuente. No toca la BD (se ejecuta en un hilo del pool).
+    Devuelve {'tipo', 'estado': 'nuevo'|'sin_cambios'|'error', 'puntos', 'etag',
+    'ultima_modificacion', 'error', 'segundos'}.
+    """
+    inicio = time.perf_counter()
+    resultado = {'tipo': tipo, 'url': url, 'estado': 'nuevo', 'puntos': [], 'etag': None,
+                 'ultima_modificacion': None, 'error': None}
+    try:
+        ruta = _ruta_local(url)
+        if ruta is not None:
+            version = str(os.stat(ruta).st_mtime_ns)
+            if version == ultima_modificacion:
+                resultado['estado'] = 'sin_cambios'
+                return resultado
+            with open(ruta, 'rb') as f:
+                contenido = f.read()
+            resultado['ultima_modificacion'] = version
+        else:
+            import requests
+
+            cabeceras = {}
+            if etag:
+                cabeceras['If-None-Match'] = etag
+            if ultima_modificacion:
+                cabeceras['If-Modified-Since'] = ultima_modificacion
+            resp = requests.get(url, headers=cabeceras, timeout=timeout)
+            if resp.status_code == 304:
+                resultado['estado'] = 'sin_cambios'
+                return resultado
+            resp.raise_for_status()
+            contenido = resp.content
+            resultado['etag'] = resp.headers.get('ETag')
+            resultado['ultima_modificacion'] = resp.headers.get('Last-Modified')
+
+        if (formato or ('csv' if url.lower().endswith('.csv') else 'json')) == 'csv':
+            resultado['puntos'] = parsear_csv(contenido, tipo)
+        else:
+            resultado['puntos'] = parsear_json(contenido, tipo)
+        if not resultado['puntos']:
+            raise ValueError("la fuente no devolvio puntos")
+    except Exception as e:
+        resultado['estado'] = 'error'
+        resultado['error'] = str(e)
+        resultado['puntos'] = []
+    finally:
+        resultado['segundos'] = time.perf_counter() - inicio
+    return resultado
+
+
+# ============== ESCRITURA (hilo principal) ==============
+def _preparar_fuentes(conn):
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS fuentes_reciclaje (
+            tipo TEXT PRIMARY KEY,
+            url TEXT NOT NULL,
+            etag TEXT,
+            ultima_modificacion TEXT,
+            puntos INTEGER NOT NULL DEFAULT 0,
+            ultima_descarga TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    ''')
+
+
+def _guardar_fuente(conn, resultado):
+    """
+    Sustituye los puntos de una fuente (solo las filas de su 'tipo') en una transaccion.
+    Las filas nuevas reciben ids por encima de los anteriores: sync_sqlite.py detecta asi
+    que tipos han cambiado y los replica enteros.
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute('DELETE FROM puntos_reciclaje WHERE tipo = ?', (resultado['tipo'],))
+        conn.executemany(
+            f"INSERT INTO puntos_reciclaje ({', '.join(COLUMNAS)}) VALUES (?, ?, ?, ?, ?, ?)",
+            resultado['puntos']
+        )
+        conn.execute('''
+            INSERT INTO fuentes_reciclaje (tipo, url, etag, ultima_modificacion, puntos)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(tipo) DO UPDATE SET
+                url = excluded.url,
+                etag = excluded.etag,
+                ultima_modificacion = excluded.ultima_modificacion,
+                puntos = excluded.puntos,
+                ultima_descarga = CURRENT_TIMESTAMP
+        ''', (resultado['tipo'], resultado['url'], resultado['etag'],
+              resultado['ultima_modificacion'], len(resultado['puntos'])))
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+
+def actualizar_puntos(db_file, fuentes=FUENTES, forzar=False, hilos=None, timeout=TIMEOUT_DESCARGA):
+    """
+    Descarga las fuentes en paralelo y guarda cada una en cuanto llega.
+    Devuelve la lista de resultados (sin los puntos) en orden de llegada.
+    """
+    conn = sqlite3.connect(db_file, isolation_level=None, timeout=30)
+    try:
+        _preparar_fuentes(conn)
+        preparar_puntos(conn)
+        validadores = {}
+        if not forzar:
+            # Solo si la URL no ha cambiado y sus puntos siguen en la tabla
+            for tipo, url, etag, ultima in conn.execute('''
+                SELECT f.tipo, f.url, f.etag, f.ultima_modificacion FROM fuentes_reciclaje f
+                WHERE EXISTS (SELECT 1 FROM puntos_reciclaje p WHERE p.tipo = f.tipo)
+            '''):
+                validadores[(tipo, url)] = (etag, ultima)
+
+        resultados = []
+        with ThreadPoolExecutor(max_workers=hilos or len(fuentes) or 1) as pool:
+            futuros = [
+                pool.submit(descargar, tipo, url, formato, *validadores.get((tipo, url), (None, None)),
+                            timeout=timeout)
+                for tipo, url, formato in fuentes
+            ]
+            for futuro in as_completed(futuros):
+                resultado = futuro.result()
+                if resultado['estado'] == 'nuevo':
+                    try:
+                        _guardar_fuente(conn, resultado)
+                    except sqlite3.Error as e:
+                        resultado['estado'], resultado['error'] = 'error', str(e)
+                resultado['total'] = len(resultado.pop('puntos'))
+                resultados.append(resultado)
+        return resultados
+    finally:
+        conn.close()
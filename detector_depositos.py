@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Deteccion de depositos sobre la serie continua de nivel de llenado
+En lugar de medir la diferencia de nivel en una ventana fija de 5 segundos, se
+busca el cambio de nivel (change-point) y se confirma en cuanto se estabiliza:
+- mediana de las ultimas muestras para filtrar picos del ultrasonido (debounce)
+- histeresis: se entra en "subiendo" al superar la base en UMBRAL_SUBIDA y solo
+  se descarta si vuelve por debajo de la base + UMBRAL_BAJADA
+- el deposito se confirma cuando el nivel lleva TIEMPO_ESTABLE segundos dentro
+  de una banda de BANDA_ESTABLE
+"""
+
+from collections import deque, namedtuple
+
+# ============== CONFIGURACION ==============
+UMBRAL_SUBIDA = 3  # % sobre la base para considerar que empieza un deposito
+UMBRAL_BAJADA = 1  # % sobre la base por debajo del cual se descarta (histeresis)
+BANDA_ESTABLE = 1  # % de variacion maxima para considerar el nivel asentado
+TIEMPO_ESTABLE = 1.0  # segundos asentado para confirmar el deposito
+MUESTRAS_MEDIANA = 3  # muestras del filtro de mediana
+MAX_HUECO = 2.0  # segundos sin muestras tras los que se reinicia la base
+
+DepositoDetectado = namedtuple('DepositoDetectado', 'inicio fin nivel_inicial nivel_final incremento')
+
+
+class DetectorDepositos:
+    def __init__(self, umbral_subida=UMBRAL_SUBIDA, umbral_bajada=UMBRAL_BAJADA,
+                 banda_estable=BANDA_ESTABLE, tiempo_estable=TIEMPO_ESTABLE,
+                 muestras_mediana=MUESTRAS_MEDIANA, max_hueco=MAX_HUECO):
+        self.umbral_subida = umbral_subida
+        self.umbral_bajada = umbral_bajada
+        self.banda_estable = banda_estable
+        self.tiempo_estable = tiempo_estable
+        self.max_hueco = max_hueco
+        self.muestras = deque(maxlen=muestras_mediana)
+        self.reiniciar()
+
+    def reiniciar(self):
+        """Olvida la base (p.ej. tras un rato sin medir: la papelera pudo vaciarse)"""
+        self.muestras.clear()
+        self.base = None
+        self.subiendo = False
+        self.inicio = None
+        self.nivel_referencia = None
+        self.desde_estable = None
+        self.ultimo_t = None
+
+    def nivel(self):
+        """Nivel filtrado (mediana de las ultimas muestras)"""
+        if not self.muestras:
+            return None
+        return sorted(self.muestras)[len(self.muestras) // 2]
+
+    def incremento_en_curso(self):
+        """Subida respecto a la base del deposito que se esta produciendo"""
+        if not self.subiendo:
+            return 0
+        return self.nivel() - self.base
+
+    def actualizar(self, t, porcentaje):
+        """
+        Procesa una muestra (t en segundos, porcentaje de llenado).
+        Devuelve un DepositoDetectado cuando se confirma una subida, o None.
+        """
+        if self.ultimo_t is not None and t - self.ultimo_t > self.max_hueco:
+            self.reiniciar()
+        self.ultimo_t = t
+        self.muestras.append(porcentaje)
+        nivel = self.nivel()
+
+        if self.base is None:
+            if len(self.muestras) == self.muestras.maxlen:
+                self.base = nivel
+            return None
+
+        if not self.subiendo:
+            if nivel >= self.base + self.umbral_subida:
+                self.subiendo = True
+                self.inicio = t
+                self.nivel_referencia = nivel
+                self.desde_estable = t
+            elif nivel <= self.base - self.umbral_subida:
+                # Bajada clara (vaciado o compactacion): la base la sigue
+                self.base = nivel
+            return None
+
+        if nivel < self.base + self.umbral_bajada:
+            # Ha vuelto a la base: era una mano o ruido, no un deposito
+            self.subiendo = False
+            return None
+
+        if abs(nivel - self.nivel_referencia) > self.banda_estable:
+            # Sigue cambiando: reiniciar la cuenta de estabilidad
+            self.nivel_referencia = nivel
+            self.desde_estable = t
+            return None
+
+        if t - self.desde_estable >= self.tiempo_estable:
+            deposito = DepositoDetectado(self.inicio, t, self.base, nivel, nivel - self.base)
+            self.base = nivel
+            self.subiendo = False
+            return deposito
+        return None
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Informes de uso de la Papelera Inteligente
+Abre la base de datos en solo lectura (puede ejecutarse con la papelera en marcha,
+la BD esta en modo WAL) y hace toda la agregacion en SQL con funciones de ventana:
+ranking, porcentaje sobre el total y totales generales en una sola consulta.
+
+Uso:
+    python papelera_cli.py stats --top 10 --desde 2024-01-01 --hasta 2024-01-31 --formato json
+"""
+
+import io
+import os
+import csv
+import json
+import sqlite3
+from uid_tarjeta import uid_a_hex
+from marcas_tiempo import rango_dias_ms
+from retencion import rango_mes, adjuntar_archivos
+
+# Indice del ranking: cubre todas las columnas de SQL_TOP_USUARIOS, asi que el
+# "top N" recorre N entradas del indice sin ordenar ni leer la tabla
+SQL_INDICE_RANKING = '''
+    CREATE INDEX IF NOT EXISTS idx_estadisticas_ranking
+    ON estadisticas(kg_total DESC, uid, nombre, total_depositos, ultima_actualizacion)
+'''
+
+# Puesto de un usuario (mismo criterio que RANK() en SQL_RANKING_TOTAL): cuenta las
+# entradas de idx_estadisticas_ranking por encima de su kg_total, sin leer la tabla
+SQL_PUESTO = 'SELECT COUNT(*) + 1 FROM estadisticas WHERE kg_total > ?'
+
+# Ultimos depositos de un usuario: N entradas del indice (uid, fecha), sin ordenar
+SQL_INDICE_HISTORIAL = '''
+    CREATE INDEX IF NOT EXISTS idx_depositos_uid_fecha ON depositos(uid, fecha)
+'''
+
+SQL_HISTORIAL_USUARIO = '''
+    SELECT id, porcentaje_depositado, kg_estimado, nivel_final, fecha
+    FROM depositos
+    WHERE uid = ?
+    ORDER BY fecha DESC
+    LIMIT ?
+'''
+
+SQL_PERFIL = '''
+    SELECT u.nombre, u.fecha_registro, e.total_depositos, e.kg_total, e.ultima_actualizacion
+    FROM usuarios u
+    LEFT JOIN estadisticas e ON e.uid = u.uid
+    WHERE u.uid = ?
+'''
+
+SQL_TOP_USUARIOS = '''
+    SELECT uid, nombre, total_depositos, kg_total, ultima_actualizacion
+    FROM estadisticas
+    ORDER BY kg_total DESC, uid
+    LIMIT ?
+'''
+
+# Sin rango de fechas se usan los contadores de 'estadisticas' (con el nombre
+# desnormalizado, sin JOIN); con rango se agrega 'depositos' ({origen}: 'depositos_historico'
+# si el rango corta algun mes archivado, ver _adjuntar_meses_parciales)
+SQL_RANKING_TOTAL = '''
+    SELECT RANK() OVER (ORDER BY kg_total DESC) AS puesto,
+           uid, nombre, total_depositos AS depositos, kg_total AS kg,
+           100.0 * kg_total / NULLIF(SUM(kg_total) OVER (), 0) AS porcentaje,
+           SUM(total_depositos) OVER () AS total_depositos,
+           SUM(kg_total) OVER () AS total_kg,
+           COUNT(*) OVER () AS total_usuarios
+    FROM estadisticas
+    ORDER BY puesto, nombre
+    LIMIT ?
+'''
+
+SQL_RANKING_PERIODO = '''
+    WITH agregado AS (
+        SELECT uid, SUM(depositos) AS depositos, TOTAL(kg) AS kg
+        FROM (
+            SELECT uid, COUNT(*) AS depositos, TOTAL(kg_estimado) AS kg
+            FROM {origen}
+            WHERE fecha >= COALESCE(:desde_ms, -9e18)
+              AND fecha < COALESCE(:hasta_ms, 9e18)
+            GROUP BY uid
+            {archivados}
+        )
+        GROUP BY uid
+    )
+    SELECT RANK() OVER (ORDER BY a.kg DESC) AS puesto,
+           a.uid, u.nombre, a.depositos, a.kg,
+           100.0 * a.kg / NULLIF(SUM(a.kg) OVER (), 0) AS porcentaje,
+           SUM(a.depositos) OVER () AS total_depositos,
+           SUM(a.kg) OVER () AS total_kg,
+           COUNT(*) OVER () AS total_usuarios
+    FROM agregado a
+    JOIN usuarios u ON u.uid = a.uid
+    ORDER BY puesto, u.nombre
+    LIMIT :limite
+'''
+
+# Meses archivados (retencion.py) completamente dentro del rango: su resumen mensual
+SQL_ARCHIVADOS = '''
+            UNION ALL
+            SELECT uid, depositos, kg
+            FROM depositos_mensual
+            WHERE (:desde IS NULL OR mes || '-01' >= :desde)
+              AND (:hasta IS NULL OR date(mes || '-01', '+1 month') <= date(:hasta, '+1 day'))
+'''
+
+SQL_ULTIMOS = '''
+    SELECT strftime('%d/%m/%Y %H:%M', d.fecha / 1000, 'unixepoch') AS fecha, u.nombre,
+           d.porcentaje_depositado, d.kg_estimado, d.nivel_final
+    FROM {origen} d
+    JOIN usuarios u ON d.uid = u.uid
+    WHERE d.fecha >= COALESCE(:desde_ms, -9e18)
+      AND d.fecha < COALESCE(:hasta_ms, 9e18)
+    ORDER BY d.fecha DESC
+    LIMIT :limite
+'''
+
+
+def preparar_ranking(conn):
+    """
+    Anade a 'estadisticas' el nombre del usuario (BD antiguas) y crea los indices del
+    ranking y del perfil de usuario. Se llama al abrir la BD en escritura; las nuevas
+    filas ya guardan el nombre.
+    """
+    columnas = [c[1] for c in conn.execute('PRAGMA table_info(estadisticas)')]
+    if not columnas:
+        return
+    if 'nombre' not in columnas:
+        conn.execute('ALTER TABLE estadisticas ADD COLUMN nombre TEXT')
+    conn.execute('''
+        UPDATE estadisticas
+        SET nombre = (SELECT u.nombre FROM usuarios u WHERE u.uid = estadisticas.uid)
+        WHERE nombre IS NULL
+    ''')
+    conn.execute(SQL_INDICE_RANKING)
+    conn.execute(SQL_INDICE_HISTORIAL)
+    conn.commit()
+
+
+def top_usuarios(conn, limite=None):
+    """[(uid, nombre, total_depositos, kg_total, ultima_actualizacion)] de mas a menos kg"""
+    return conn.execute(SQL_TOP_USUARIOS, (limite if limite else -1,)).fetchall()
+
+
+def perfil_usuario(conn, uid, ultimos=5):
+    """
+    Estadisticas, puesto en el ranking y ultimos depositos de un usuario, o None si no
+    existe. Un usuario sin depositos aun no tiene puesto (None): en 'estadisticas' tiene
+    kg_total 0 y saldria empatado en el ultimo puesto.
+    """
+    fila = conn.execute(SQL_PERFIL, (uid,)).fetchone()
+    if fila is None:
+        return None
+    nombre, fecha_registro, depositos, kg, actualizacion = fila
+    puesto = conn.execute(SQL_PUESTO, (kg,)).fetchone()[0] if depositos else None
+    return {
+        'uid': uid,
+        'nombre': nombre,
+        'fecha_registro': fecha_registro,
+        'total_depositos': depositos or 0,
+        'kg_total': kg or 0.0,
+        'ultima_actualizacion': actualizacion,
+        'puesto': puesto,
+        'ultimos_depositos': conn.execute(SQL_HISTORIAL_USUARIO, (uid, ultimos)).fetchall(),
+    }
+
+
+def _tabla_existe(conn, tabla):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (tabla,)
+    ).fetchone() is not None
+
+
+def _adjuntar_meses_parciales(conn, desde_ms, hasta_ms):
+    """
+    Meses archivados que el rango cubre solo en parte: su resumen mensual no sirve, asi
+    que se adjuntan sus archivos SQLite (vista 'depositos_historico'). Devuelve el origen
+    de los depositos y los avisos de los meses que no se pueden consultar (CSV o sin archivo).
+    """
+    if not _tabla_existe(conn, 'archivos_depositos'):
+        return 'depositos', []
+    desde_ms = -9e18 if desde_ms is None else desde_ms
+    hasta_ms = 9e18 if hasta_ms is None else hasta_ms
+    adjuntables, avisos = [], []
+    for mes, ruta, formato in conn.execute('SELECT mes, ruta, formato FROM archivos_depositos ORDER BY mes'):
+        inicio, fin = rango_mes(mes)
+        if (desde_ms <= inicio and fin <= hasta_ms) or fin <= desde_ms or inicio >= hasta_ms:
+            continue  # completo en el rango (resumen mensual) o fuera de el
+        if formato == 'sqlite' and os.path.exists(ruta):
+            adjuntables.append(mes)
+        else:
+            avisos.append(f"El mes {mes} esta archivado en {ruta} ({formato}) y el rango lo cubre "
+                          f"solo en parte: sus depositos archivados no se incluyen")
+    if not adjuntables:
+        return 'depositos', avisos
+    adjuntados = adjuntar_archivos(conn, adjuntables)
+    avisos += [f"No se pudo adjuntar el archivo del mes {mes}: sus depositos archivados no se incluyen"
+               for mes in adjuntables if mes not in adjuntados]
+    return 'depositos_historico', avisos
+
+
+def abrir_bd_lectura(db_file):
+    """Conexion de solo lectura: no bloquea ni modifica la BD de la papelera"""
+    return sqlite3.connect(f"file:{db_file}?mode=ro", uri=True)
+
+
+def generar_informe(conn, top=None, desde=None, hasta=None, ultimos=5):
+    """
+    Ranking de usuarios, totales y ultimos depositos (opcionalmente en un rango de fechas).
+    Los meses archivados entran por su resumen mensual si el rango los cubre enteros y por
+    su archivo SQLite si los cubre en parte; los que no se pueden consultar van en 'avisos'.
+    """
+    limite = top if top else -1  # LIMIT -1 = sin limite
+    # Dias -> [desde_ms, hasta_ms): el filtro compara enteros sobre idx_depositos_fecha
+    desde_ms, hasta_ms = rango_dias_ms(desde, hasta)
+    periodo = {'desde': desde, 'hasta': hasta, 'desde_ms': desde_ms, 'hasta_ms': hasta_ms}
+    origen, avisos = 'depositos', []
+    if desde or hasta:
+        origen, avisos = _adjuntar_meses_parciales(conn, desde_ms, hasta_ms)
+        archivados = _tabla_existe(conn, 'depositos_mensual')
+        sql = SQL_RANKING_PERIODO.format(origen=origen, archivados=SQL_ARCHIVADOS if archivados else '')
+        filas = conn.execute(sql, dict(periodo, limite=limite)).fetchall()
+    else:
+        filas = conn.execute(SQL_RANKING_TOTAL, (limite,)).fetchall()
+
+    usuarios = [
+        {
+            'puesto': puesto,
+            'uid': uid_a_hex(uid),
+            'nombre': nombre,
+            'depositos': depositos,
+            'kg': round(kg, 2),
+            'porcentaje': round(porcentaje or 0.0, 1)
+        }
+        for puesto, uid, nombre, depositos, kg, porcentaje, _, _, _ in filas
+    ]
+    if filas:
+        total_depositos, total_kg, total_usuarios = filas[0][6:9]
+    else:
+        total_depositos, total_kg, total_usuarios = 0, 0.0, 0
+
+    ultimos_depositos = [
+        {'fecha': fecha, 'nombre': nombre, 'porcentaje': porcentaje, 'kg': round(kg, 2), 'nivel': nivel}
+        for fecha, nombre, porcentaje, kg, nivel in conn.execute(
+            SQL_ULTIMOS.format(origen=origen), dict(periodo, limite=ultimos)
+        )
+    ]
+
+    return {
+        'periodo': {'desde': desde, 'hasta': hasta},
+        'totales': {
+            'usuarios': total_usuarios,
+            'depositos': total_depositos,
+            'kg_total': round(total_kg or 0.0, 2)
+        },
+        'usuarios': usuarios,
+        'ultimos_depositos': ultimos_depositos,
+        'avisos': avisos
+    }
+
+
+# ============== FORMATOS DE SALIDA ==============
+def formatear_tabla(informe):
+    lineas = []
+    periodo = informe['periodo']
+    titulo = "ESTADISTICAS DE USO - BASE DE DATOS"
+    if periodo['desde'] or periodo['hasta']:
+        titulo += f" ({periodo['desde'] or '...'} a {periodo['hasta'] or '...'})"
+    lineas.append("=" * 60)
+    lineas.append(f"       {titulo}")
+    lineas.append("=" * 60)
+
+    if not informe['usuarios']:
+        lineas.append("No hay registros todavia")
+    else:
+        lineas.append(f"{'#':>3}  {'Nombre':<20} {'UID':<10} {'Depos.':>7} {'Kg':>9} {'%':>6}")
+        for u in informe['usuarios']:
+            lineas.append(
+                f"{u['puesto']:>3}  {u['nombre'][:20]:<20} {u['uid']:<10} "
+                f"{u['depositos']:>7} {u['kg']:>9.2f} {u['porcentaje']:>6.1f}"
+            )
+    totales = informe['totales']
+    lineas.append("-" * 60)
+    lineas.append(f"TOTAL GENERAL: {totales['kg_total']:.2f}kg en {totales['depositos']} depositos "
+                  f"({totales['usuarios']} usuarios)")
+    lineas.append("=" * 60)
+    for aviso in informe.get('avisos', []):
+        lineas.append(f"!! {aviso}")
+
+    if informe['ultimos_depositos']:
+        lineas.append("")
+        lineas.append("=" * 60)
+        lineas.append(f"       ULTIMOS {len(informe['ultimos_depositos'])} DEPOSITOS")
+        lineas.append("=" * 60)
+        for d in informe['ultimos_depositos']:
+            lineas.append(f"{d['fecha']} - {d['nombre']}: +{d['porcentaje']}% (~{d['kg']:.2f}kg) -> Nivel: {d['nivel']}%")
+        lineas.append("=" * 60)
+    return "\n".join(lineas)
+
+
+def formatear_json(informe):
+    return json.dumps(informe, ensure_ascii=False, indent=2)
+
+
+def formatear_csv(informe):
+    """Solo el ranking de usuarios, una fila por usuario"""
+    salida = io.StringIO()
+    campos = ['puesto', 'uid', 'nombre', 'depositos', 'kg', 'porcentaje']
+    escritor = csv.DictWriter(salida, fieldnames=campos, lineterminator="\n")
+    escritor.writeheader()
+    escritor.writerows(informe['usuarios'])
+    return salida.getvalue()
+
+
+def formatear(informe, formato="tabla"):
+    if formato == "json":
+        return formatear_json(informe)
+    if formato == "csv":
+        return formatear_csv(informe)
+    return formatear_tabla(informe)
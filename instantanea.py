@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Instantanea de solo lectura para el modo navegador (sql.js) del panel web
+papeleraWeb.html carga bases de datos enteras en memoria. En lugar de la BD de la
+papelera, con todo el historial, se publica una BD reducida:
+- 'usuarios' y el ranking ('estadisticas')
+- 'depositos' de los ultimos DIAS_RECIENTES dias
+- 'resumen_mensual': depositos, kg y usuarios por mes de todo el historial (incluido el archivado)
+- 'puntos_reciclaje': los PUNTOS_CERCANOS puntos mas cercanos a la papelera
+- 'instantanea': cuando se genero
+
+Se copia todo en una sola transaccion de lectura (snapshot consistente, la papelera puede
+seguir escribiendo), se compacta con VACUUM INTO y se publica junto con su version gzip
+con os.replace(): quien la descarga ve la anterior o la nueva, nunca una a medias.
+La API la sirve en /db/papelera.db con soporte de Range y GET condicional.
+
+Uso:
+    python papelera_cli.py snapshot [--intervalo 300]
+"""
+
+import os
+import gzip
+import time
+import shutil
+import sqlite3
+from puntos_cercanos import BuscadorPuntos
+from marcas_tiempo import ahora_ms, MS_DIA
+
+# ============== CONFIGURACION ==============
+DIRECTORIO_INSTANTANEA = "web"
+NOMBRE_INSTANTANEA = "papelera.db"
+DIAS_RECIENTES = 30  # depositos individuales incluidos; el resto solo en el resumen mensual
+PUNTOS_CERCANOS = 50
+INTERVALO_INSTANTANEA = 300  # segundos entre instantaneas con --intervalo
+
+# Mismas columnas y orden que la BD de la papelera y reciclaje.db: el panel lee SELECT *
+# por posicion ('puntos_reciclaje' solo anade distancia_km al final)
+ESQUEMA = '''
+    CREATE TABLE usuarios (
+        uid INTEGER PRIMARY KEY,
+        nombre TEXT NOT NULL,
+        fecha_registro INTEGER
+    );
+    CREATE TABLE depositos (
+        id INTEGER PRIMARY KEY,
+        uid INTEGER NOT NULL,
+        porcentaje_depositado INTEGER NOT NULL,
+        kg_estimado REAL NOT NULL,
+        nivel_final INTEGER NOT NULL,
+        fecha INTEGER
+    );
+    CREATE TABLE estadisticas (
+        uid INTEGER PRIMARY KEY,
+        total_depositos INTEGER,
+        kg_total REAL,
+        ultima_actualizacion INTEGER,
+        nombre TEXT
+    );
+    CREATE TABLE resumen_mensual (
+        mes TEXT PRIMARY KEY,
+        depositos INTEGER NOT NULL,
+        kg REAL NOT NULL,
+        usuarios INTEGER NOT NULL
+    );
+    CREATE TABLE puntos_reciclaje (
+        id INTEGER PRIMARY KEY,
+        nombre TEXT,
+        direccion TEXT,
+        municipio TEXT,
+        lat REAL,
+        lon REAL,
+        tipo TEXT,
+        distancia_km REAL
+    );
+    CREATE TABLE instantanea (
+        generada INTEGER NOT NULL,
+        dias_recientes INTEGER NOT NULL
+    );
+'''
+
+# Meses de 'depositos' (todavia sin archivar) mas los ya archivados por retencion.py
+SQL_MENSUAL = '''
+    INSERT INTO resumen_mensual (mes, depositos, kg, usuarios)
+    SELECT mes, SUM(depositos), TOTAL(kg), COUNT(DISTINCT uid)
+    FROM (
+        SELECT strftime('%Y-%m', fecha / 1000, 'unixepoch') AS mes, uid,
+               COUNT(*) AS depositos, TOTAL(kg_estimado) AS kg
+        FROM origen.depositos
+        GROUP BY mes, uid
+        {archivados}
+    )
+    GROUP BY mes
+'''
+
+SQL_ARCHIVADOS = '''
+        UNION ALL
+        SELECT mes, uid, depositos, kg FROM origen.depositos_mensual
+'''
+
+
+def _copiar_datos(conn, desde_ms):
+    """Copia de 'origen' a la BD en memoria, dentro de una transaccion de lectura"""
+    conn.execute('BEGIN')
+    conn.execute('''
+        INSERT INTO usuarios (uid, nombre, fecha_registro)
+        SELECT uid, nombre, fecha_registro FROM origen.usuarios
+    ''')
+    conn.execute('''
+        INSERT INTO estadisticas (uid, total_depositos, kg_total, ultima_actualizacion, nombre)
+        SELECT uid, total_depositos, kg_total, ultima_actualizacion, nombre
+        FROM origen.estadisticas
+    ''')
+    # Rango sobre idx_depositos_fecha: no se lee el historial antiguo
+    conn.execute('''
+        INSERT INTO depositos (id, uid, porcentaje_depositado, kg_estimado, nivel_final, fecha)
+        SELECT id, uid, porcentaje_depositado, kg_estimado, nivel_final, fecha
+        FROM origen.depositos
+        WHERE fecha >= ?
+        ORDER BY id
+    ''', (desde_ms,))
+    archivados = conn.execute(
+        "SELECT 1 FROM origen.sqlite_master WHERE type = 'table' AND name = 'depositos_mensual'"
+    ).fetchone()
+    conn.execute(SQL_MENSUAL.format(archivados=SQL_ARCHIVADOS if archivados else ''))
+    conn.execute('COMMIT')
+
+
+def _copiar_puntos(conn, reciclaje_db, lat, lon, limite):
+    if not os.path.exists(reciclaje_db):
+        return 0
+    puntos, _ = BuscadorPuntos(reciclaje_db).buscar(lat, lon, None, limite)
+    conn.executemany('''
+        INSERT INTO puntos_reciclaje (nombre, direccion, municipio, lat, lon, tipo, distancia_km)
+        VALUES (:nombre, :direccion, :municipio, :lat, :lon, :tipo, :distancia_km)
+    ''', puntos)
+    return len(puntos)
+
+
+def _publicar(temporal, ruta):
+    """fsync y rename atomico sobre la version publicada"""
+    with open(temporal, 'rb') as f:
+        os.fsync(f.fileno())
+    os.replace(temporal, ruta)
+
+
+def exportar_instantanea(db_file, reciclaje_db, lat, lon, directorio=DIRECTORIO_INSTANTANEA,
+                         nombre=NOMBRE_INSTANTANEA, dias=DIAS_RECIENTES, puntos=PUNTOS_CERCANOS):
+    """
+    Genera y publica la instantanea (directorio/nombre y directorio/nombre.gz).
+    Devuelve un resumen con las filas copiadas y los tamanos.
+    """
+    os.makedirs(directorio, exist_ok=True)
+    ruta = os.path.join(directorio, nombre)
+    temporal = os.path.join(directorio, f".{nombre}.tmp")
+    for f in (temporal, temporal + '.gz'):
+        if os.path.exists(f):
+            os.remove(f)  # restos de una exportacion interrumpida
+
+    # Se construye en memoria y VACUUM INTO la escribe ya compactada
+    conn = sqlite3.connect(':memory:', uri=True, isolation_level=None)
+    try:
+        conn.executescript(ESQUEMA)
+        conn.execute("ATTACH DATABASE ? AS origen", (f"file:{db_file}?mode=ro",))
+        generada = ahora_ms()
+        _copiar_datos(conn, generada - dias * MS_DIA)
+        conn.execute("DETACH DATABASE origen")
+        n_puntos = _copiar_puntos(conn, reciclaje_db, lat, lon, puntos)
+        conn.execute('INSERT INTO instantanea (generada, dias_recientes) VALUES (?, ?)', (generada, dias))
+        filas = {
+            tabla: conn.execute(f'SELECT COUNT(*) FROM {tabla}').fetchone()[0]
+            for tabla in ('usuarios', 'estadisticas', 'depositos', 'resumen_mensual')
+        }
+        filas['puntos_reciclaje'] = n_puntos
+        conn.execute("VACUUM INTO ?", (temporal,))
+    finally:
+        conn.close()
+
+    # Version comprimida para los clientes que aceptan gzip (la descarga completa)
+    with open(temporal, 'rb') as origen, gzip.open(temporal + '.gz', 'wb', compresslevel=9) as destino:
+        shutil.copyfileobj(origen, destino)
+
+    # Primero la BD y despues su .gz: cada fichero publicado esta siempre completo
+    _publicar(temporal, ruta)
+    _publicar(temporal + '.gz', ruta + '.gz')
+    return {
+        'ruta': ruta,
+        'filas': filas,
+        'bytes': os.path.getsize(ruta),
+        'bytes_gzip': os.path.getsize(ruta + '.gz'),
+    }
+
+
+def exportar_periodicamente(intervalo=INTERVALO_INSTANTANEA, **kwargs):
+    """Regenera la instantanea cada 'intervalo' segundos (Ctrl+C para salir)"""
+    while True:
+        inicio = time.monotonic()
+        try:
+            resumen = exportar_instantanea(**kwargs)
+            print(f"? Instantanea {resumen['ruta']}: {resumen['bytes']} bytes "
+                  f"({resumen['bytes_gzip']} con gzip), {resumen['filas']['depositos']} depositos")
+        except Exception as e:
+            print(f"!! Error al generar la instantanea: {e}")
+        time.sleep(max(0, intervalo - (time.monotonic() - inicio)))
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Marcas de tiempo de la base de datos
+Las fechas de 'depositos', 'usuarios', 'estadisticas' y 'outbox_depositos' se guardan
+como enteros: milisegundos desde 1970-01-01 UTC. Ocupan menos que el texto de
+CURRENT_TIMESTAMP, los rangos y ORDER BY comparan enteros sobre el indice y no hay que
+volver a interpretar cada fecha. El texto ISO 8601 ("2024-01-31T10:15:00.000Z") solo
+se usa en los bordes: API REST, lotes de ingesta, informes y archivos CSV.
+
+migrar_fechas_ms() convierte las bases de datos antiguas (TIMESTAMP en texto).
+"""
+
+import re
+import time
+from datetime import datetime, date, timezone
+from migracion_bd import existe_tabla, tipo_columna, reescribir_tablas
+
+# Expresion SQL de "ahora" en ms (sin unixepoch('subsec'), que requiere SQLite 3.42)
+SQL_AHORA_MS = "CAST(ROUND((julianday('now') - 2440587.5) * 86400000) AS INTEGER)"
+
+# Columnas de fecha por tabla
+COLUMNAS_FECHA = {
+    'usuarios': 'fecha_registro',
+    'depositos': 'fecha',
+    'estadisticas': 'ultima_actualizacion',
+    'outbox_depositos': 'fecha',
+}
+
+MS_DIA = 86400000
+
+
+def ahora_ms():
+    return time.time_ns() // 1_000_000
+
+
+def ms_a_iso(ms):
+    """Milisegundos -> '2024-01-31T10:15:00.000Z' (None se mantiene)"""
+    if ms is None:
+        return None
+    instante = datetime.fromtimestamp(ms / 1000, timezone.utc)
+    return instante.isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+
+def iso_a_ms(valor):
+    """
+    Fecha ISO 8601 o de CURRENT_TIMESTAMP ('2024-01-31 10:15:00', en UTC) -> milisegundos.
+    Los numeros se devuelven como enteros. Lanza ValueError si no es una fecha.
+    """
+    if valor is None:
+        return None
+    if isinstance(valor, (int, float)):
+        return int(valor)
+    instante = datetime.fromisoformat(str(valor).strip().replace('Z', '+00:00'))
+    if instante.tzinfo is None:
+        instante = instante.replace(tzinfo=timezone.utc)
+    return round(instante.timestamp() * 1000)
+
+
+def dia_a_ms(dia):
+    """'2024-01-31' (o date) -> milisegundos al inicio de ese dia UTC"""
+    if not isinstance(dia, date):
+        dia = date.fromisoformat(str(dia))
+    return (dia - date(1970, 1, 1)).days * MS_DIA
+
+
+def rango_dias_ms(desde=None, hasta=None):
+    """Dias 'desde'..'hasta' (ambos incluidos) -> [desde_ms, hasta_ms) para WHERE fecha >= ? AND fecha < ?"""
+    return (dia_a_ms(desde) if desde else None,
+            dia_a_ms(hasta) + MS_DIA if hasta else None)
+
+
+# ============== MIGRACION ==============
+def _esquema_ms(columnas):
+    def adaptar(tabla, esquema):
+        columna = re.escape(columnas[tabla])
+        esquema = re.sub(rf'\b({columna})\s+TIMESTAMP\b', r'\1 INTEGER', esquema, flags=re.IGNORECASE)
+        return re.sub(rf'\b({columna} INTEGER(\s+NOT NULL)?)\s+DEFAULT\s+CURRENT_TIMESTAMP\b',
+                      rf'\1 DEFAULT ({SQL_AHORA_MS})', esquema, flags=re.IGNORECASE)
+    return adaptar
+
+
+def migrar_fechas_ms(conn, columnas=COLUMNAS_FECHA):
+    """
+    Reescribe las columnas de fecha TIMESTAMP (texto) como INTEGER en milisegundos.
+    Conserva indices, triggers y contadores. Todo en una transaccion; no hace nada si
+    la BD ya esta migrada. Devuelve las tablas migradas.
+    """
+    pendientes = [
+        t for t, c in columnas.items()
+        if existe_tabla(conn, t) and tipo_columna(conn, t, c) == 'TIMESTAMP'
+    ]
+    if not pendientes:
+        return []
+
+    conn.create_function('iso_a_ms', 1, iso_a_ms, deterministic=True)
+    reescribir_tablas(
+        conn, pendientes, _esquema_ms(columnas),
+        {c: f'iso_a_ms({c})' for t, c in columnas.items() if t in pendientes}
+    )
+    return pendientes
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Reescritura de tablas SQLite para cambiar el tipo de columnas existentes
+SQLite no permite ALTER COLUMN: se crea la tabla con el esquema nuevo, se copian las
+filas convirtiendo las columnas afectadas y se sustituye la antigua. Lo usan las
+migraciones de uid_tarjeta.py (uid TEXT -> INTEGER) y marcas_tiempo.py (fechas TEXT ->
+milisegundos).
+"""
+
+import re
+
+
+def existe_tabla(conn, tabla):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (tabla,)
+    ).fetchone() is not None
+
+
+def tipo_columna(conn, tabla, columna):
+    """Tipo declarado de la columna (en mayusculas) o None si no existe"""
+    for _, nombre, tipo, *_ in conn.execute(f"PRAGMA table_info({tabla})"):
+        if nombre == columna:
+            return tipo.upper()
+    return None
+
+
+def reescribir_tablas(conn, tablas, adaptar_esquema, conversiones):
+    """
+    Reescribe cada tabla de 'tablas' con el esquema adaptar_esquema(tabla, sql) y copia
+    sus filas aplicando conversiones {columna: expresion SQL}. Conserva indices, triggers
+    y contadores AUTOINCREMENT. Todo en una transaccion.
+    """
+    if conn.in_transaction:
+        conn.commit()
+    with conn:
+        # BEGIN explicito: sqlite3 no abre transaccion por su cuenta antes de un CREATE/DROP
+        conn.execute('BEGIN IMMEDIATE')
+        for tabla in tablas:
+            esquema = conn.execute(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (tabla,)
+            ).fetchone()[0]
+            # DROP TABLE tambien borra indices y triggers: se vuelven a crear al final
+            dependientes = [sql for (sql,) in conn.execute(
+                "SELECT sql FROM sqlite_master WHERE type IN ('index', 'trigger') AND tbl_name = ? "
+                "AND sql IS NOT NULL ORDER BY type",
+                (tabla,)
+            )]
+            secuencia = None
+            if existe_tabla(conn, 'sqlite_sequence'):
+                fila = conn.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (tabla,)).fetchone()
+                secuencia = fila[0] if fila else None
+
+            # Tabla nueva con el esquema adaptado; se copia y se renombra
+            nueva = f"{tabla}_migrada"
+            esquema = adaptar_esquema(tabla, esquema)
+            esquema = re.sub(rf'^(CREATE TABLE\s+(IF NOT EXISTS\s+)?)"?{tabla}"?', rf'\g<1>{nueva}', esquema)
+            conn.execute(esquema)
+
+            columnas = [c[1] for c in conn.execute(f"PRAGMA table_info({tabla})")]
+            seleccion = ", ".join(conversiones.get(c, c) for c in columnas)
+            conn.execute(f"INSERT INTO {nueva} ({', '.join(columnas)}) SELECT {seleccion} FROM {tabla}")
+            conn.execute(f"DROP TABLE {tabla}")
+            conn.execute(f"ALTER TABLE {nueva} RENAME TO {tabla}")
+            for sql in dependientes:
+                conn.execute(sql)
+
+            if secuencia is not None:
+                # Los seq/id ya usados (p.ej. outbox compactado) no se deben reutilizar
+                conn.execute('DELETE FROM sqlite_sequence WHERE name = ?', (tabla,))
+                conn.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (tabla, secuencia))
@@ -5,14 +5,26 @@ API REST para el Sistema de Papelera Inteligente
 Expone endpoints para acceder a datos de usuarios, depositos, estadisticas y puntos de reciclaje
 """
 
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, send_file
 from flask_cors import CORS
+from papelera_metricas import instalar_metricas, ConexionMedida
+from papelera_respuestas import instalar_respuestas
+from uid_tarjeta import uid_a_hex, hex_a_uid, migrar_uids_enteros
+from marcas_tiempo import SQL_AHORA_MS, ahora_ms, ms_a_iso, iso_a_ms, migrar_fechas_ms
+from informes import preparar_ranking, top_usuarios, perfil_usuario
+from reconciliacion import preparar_reconciliacion
+from puntos_cercanos import BuscadorPuntos, expresion_fts
+from instantanea import DIRECTORIO_INSTANTANEA, NOMBRE_INSTANTANEA
 import sqlite3
 import os
-from datetime import datetime
+import threading
+import gzip
+import json
 
 app = Flask(__name__)
 CORS(app)  # Permitir CORS para que la web pueda acceder
+metricas = instalar_metricas(app)  # Latencias, tiempo SQL y profiler en /api/metrics
+instalar_respuestas(app)  # orjson, MessagePack (Accept) y compresion brotli/gzip
 
 # Configuracion
 DB_FILE = "papelera_inteligente.db"
@@ -24,25 +36,81 @@ LON_PAPELERA = -3.7038
 
 def get_db_connection(db_file):
     """Obtener conexión a la base de datos"""
-    conn = sqlite3.connect(db_file)
+    conn = sqlite3.connect(db_file, factory=ConexionMedida)
     conn.row_factory = sqlite3.Row
     return conn
 
-def distancia_km(lat1, lon1, lat2, lon2):
-    """Calcula la distancia en km entre dos puntos usando la fórmula de Haversine."""
-    import math
-    if None in (lat1, lon1, lat2, lon2):
-        return None
-    
-    R = 6371.0  # Radio medio de la Tierra en km
-    phi1 = math.radians(lat1)
-    phi2 = math.radians(lat2)
-    dphi = math.radians(lat2 - lat1)
-    dlambda = math.radians(lon2 - lon1)
+# Puntos cercanos a cualquier origen, con cache por zona (geohash)
+buscador_puntos = BuscadorPuntos(RECICLAJE_DB_FILE, metricas=metricas)
+
+def origen_consulta():
+    """
+    Origen de la busqueda de puntos: ?lat=&lon= (por defecto la papelera) y ?radius_km= opcional.
+    Lanza ValueError si los parametros no son validos.
+    """
+    if ('lat' in request.args) != ('lon' in request.args):
+        raise ValueError('lat y lon se indican juntos')
+    lat = float(request.args.get('lat', LAT_PAPELERA))
+    lon = float(request.args.get('lon', LON_PAPELERA))
+    radio = request.args.get('radius_km')
+    radio = float(radio) if radio is not None else None
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError('lat/lon fuera de rango')
+    if radio is not None and not radio > 0:
+        raise ValueError('radius_km debe ser positivo')
+    return lat, lon, radio
+
+# ============== COALESCENCIA DE PETICIONES ==============
+
+class _Vuelo:
+    """Calculo en curso: los que esperan leen su resultado (o su error) al terminar"""
+    def __init__(self):
+        self.terminado = threading.Event()
+        self.resultado = None
+        self.error = None
+
+class CoalescenciaPeticiones:
+    """
+    Single-flight: las peticiones identicas que llegan mientras otra esta consultando la
+    BD esperan a esa consulta y comparten su resultado, en lugar de repetirla. No guarda
+    nada: al terminar, la siguiente peticion vuelve a consultar. Cada peticion serializa
+    el resultado por su cuenta (JSON o MessagePack), asi que no se debe modificar.
+    """
+    def __init__(self, metricas=None, nombre='coalescencia'):
+        self.lock = threading.Lock()
+        self.en_curso = {}
+        self.metricas = metricas
+        self.nombre = nombre
     
-    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    return R * c
+    def ejecutar(self, clave, calcular):
+        with self.lock:
+            vuelo = self.en_curso.get(clave)
+            compartido = vuelo is not None
+            if not compartido:
+                vuelo = self.en_curso[clave] = _Vuelo()
+        if self.metricas:
+            # Acierto = peticion que no ha ido a la BD
+            self.metricas.contar_cache(self.nombre, compartido)
+        
+        if compartido:
+            vuelo.terminado.wait()
+            if vuelo.error is not None:
+                raise vuelo.error
+            return vuelo.resultado
+        
+        try:
+            vuelo.resultado = calcular()
+            return vuelo.resultado
+        except Exception as e:
+            vuelo.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.en_curso[clave]
+            vuelo.terminado.set()
+
+# Tormentas de refresco de los paneles: /api/resumen y /api/estadisticas
+coalescencia = CoalescenciaPeticiones(metricas)
 
 # ============== ENDPOINTS DE USUARIOS Y DEPOSITOS ==============
 
@@ -56,103 +124,143 @@ def get_usuarios():
         usuarios = []
         for row in cursor.fetchall():
             usuarios.append({
-                'uid': row[0],
+                'uid': uid_a_hex(row[0]),
                 'nombre': row[1],
-                'fecha_registro': row[2]
+                'fecha_registro': ms_a_iso(row[2])
             })
         conn.close()
         return jsonify({'usuarios': usuarios, 'total': len(usuarios)})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/usuarios/<uid>', methods=['GET'])
+def get_usuario(uid):
+    """Perfil de un usuario: estadisticas, puesto en el ranking y ultimos depositos (?limit=5)"""
+    try:
+        limit = request.args.get('limit', 5, type=int)
+        try:
+            uid = hex_a_uid(uid)
+        except ValueError:
+            return jsonify({'error': 'uid no valido (hexadecimal de 8 caracteres)'}), 400
+        
+        # Consultas por indice: no se recorre la tabla de usuarios ni la de depositos
+        conn = get_db_connection(DB_FILE)
+        perfil = perfil_usuario(conn, uid, limit)
+        conn.close()
+        if perfil is None:
+            return jsonify({'error': 'Usuario no encontrado'}), 404
+        
+        perfil['uid'] = uid_a_hex(perfil['uid'])
+        perfil['fecha_registro'] = ms_a_iso(perfil['fecha_registro'])
+        perfil['ultima_actualizacion'] = ms_a_iso(perfil['ultima_actualizacion'])
+        perfil['ultimos_depositos'] = [
+            {'id': id_, 'porcentaje': porcentaje, 'kg': kg, 'nivel': nivel, 'fecha': ms_a_iso(fecha)}
+            for id_, porcentaje, kg, nivel, fecha in perfil['ultimos_depositos']
+        ]
+        return jsonify(perfil)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/depositos', methods=['GET'])
 def get_depositos():
-    """Obtener lista de depositos"""
+    """Obtener lista de depositos (?uid= por tarjeta, ?desde=&hasta= en ISO 8601, hasta excluido)"""
     try:
         limit = request.args.get('limit', 10, type=int)
         uid = request.args.get('uid', None)
+        if uid:
+            try:
+                uid = hex_a_uid(uid)
+            except ValueError:
+                return jsonify({'error': 'uid no valido (hexadecimal de 8 caracteres)'}), 400
+        try:
+            desde = iso_a_ms(request.args.get('desde'))
+            hasta = iso_a_ms(request.args.get('hasta'))
+        except ValueError:
+            return jsonify({'error': 'desde/hasta no validos (ISO 8601, p.ej. 2024-01-31 o 2024-01-31T10:00:00Z)'}), 400
         
         conn = get_db_connection(DB_FILE)
         cursor = conn.cursor()
         
-        if uid:
-            cursor.execute('''
-                SELECT d.id, d.uid, u.nombre, d.porcentaje_depositado, d.kg_estimado, 
-                       d.nivel_final, d.fecha
-                FROM depositos d
-                JOIN usuarios u ON d.uid = u.uid
-                WHERE d.uid = ?
-                ORDER BY d.fecha DESC
-                LIMIT ?
-            ''', (uid, limit))
-        else:
-            cursor.execute('''
-                SELECT d.id, d.uid, u.nombre, d.porcentaje_depositado, d.kg_estimado, 
-                       d.nivel_final, d.fecha
-                FROM depositos d
-                JOIN usuarios u ON d.uid = u.uid
-                ORDER BY d.fecha DESC
-                LIMIT ?
-            ''', (limit,))
+        # Rango en milisegundos: se recorre idx_depositos_fecha (o por uid) comparando enteros
+        condiciones, parametros = [], []
+        if uid is not None:
+            condiciones.append('d.uid = ?')
+            parametros.append(uid)
+        if desde is not None:
+            condiciones.append('d.fecha >= ?')
+            parametros.append(desde)
+        if hasta is not None:
+            condiciones.append('d.fecha < ?')
+            parametros.append(hasta)
+        where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ''
+        cursor.execute(f'''
+            SELECT d.id, d.uid, u.nombre, d.porcentaje_depositado, d.kg_estimado, 
+                   d.nivel_final, d.fecha
+            FROM depositos d
+            JOIN usuarios u ON d.uid = u.uid
+            {where}
+            ORDER BY d.fecha DESC
+            LIMIT ?
+        ''', parametros + [limit])
         
         depositos = []
         for row in cursor.fetchall():
             depositos.append({
                 'id': row[0],
-                'uid': row[1],
+                'uid': uid_a_hex(row[1]),
                 'nombre': row[2],
                 'porcentaje': row[3],
                 'kg': row[4],
                 'nivel': row[5],
-                'fecha': row[6]
+                'fecha': ms_a_iso(row[6])
             })
         conn.close()
         return jsonify({'depositos': depositos, 'total': len(depositos)})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def consultar_estadisticas(limit):
+    """Ranking (top N) y totales de /api/estadisticas"""
+    conn = get_db_connection(DB_FILE)
+    cursor = conn.cursor()
+    
+    estadisticas = []
+    for row in top_usuarios(conn, limit):
+        estadisticas.append({
+            'uid': uid_a_hex(row[0]),
+            'nombre': row[1],
+            'total_depositos': row[2],
+            'kg_total': row[3],
+            'ultima_actualizacion': ms_a_iso(row[4])
+        })
+    
+    # Totales de todos los usuarios (no solo del top N)
+    cursor.execute('SELECT COALESCE(SUM(kg_total), 0), COALESCE(SUM(total_depositos), 0) FROM estadisticas')
+    total_kg, total_depositos = cursor.fetchone()
+    
+    # Obtener nivel actual de la papelera (ultimo depósito)
+    cursor.execute('SELECT nivel_final FROM depositos ORDER BY fecha DESC LIMIT 1')
+    nivel_actual = cursor.fetchone()
+    nivel_actual = nivel_actual[0] if nivel_actual else 0
+    
+    conn.close()
+    
+    return {
+        'estadisticas': estadisticas,
+        'totales': {
+            'kg_total': total_kg,
+            'total_depositos': total_depositos,
+            'nivel_actual': nivel_actual
+        }
+    }
+
 @app.route('/api/estadisticas', methods=['GET'])
 def get_estadisticas():
-    """Obtener estadisticas de todos los usuarios"""
+    """Obtener estadisticas de los usuarios, de mas a menos kg (?limit=N para el top N)"""
     try:
-        conn = get_db_connection(DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT u.uid, u.nombre, e.total_depositos, e.kg_total, e.ultima_actualizacion
-            FROM usuarios u
-            JOIN estadisticas e ON u.uid = e.uid
-            ORDER BY e.kg_total DESC
-        ''')
-        
-        estadisticas = []
-        for row in cursor.fetchall():
-            estadisticas.append({
-                'uid': row[0],
-                'nombre': row[1],
-                'total_depositos': row[2],
-                'kg_total': row[3],
-                'ultima_actualizacion': row[4]
-            })
-        
-        # Calcular totales
-        total_kg = sum(s['kg_total'] for s in estadisticas)
-        total_depositos = sum(s['total_depositos'] for s in estadisticas)
-        
-        # Obtener nivel actual de la papelera (ultimo depósito)
-        cursor.execute('SELECT nivel_final FROM depositos ORDER BY fecha DESC LIMIT 1')
-        nivel_actual = cursor.fetchone()
-        nivel_actual = nivel_actual[0] if nivel_actual else 0
-        
-        conn.close()
-        
-        return jsonify({
-            'estadisticas': estadisticas,
-            'totales': {
-                'kg_total': total_kg,
-                'total_depositos': total_depositos,
-                'nivel_actual': nivel_actual
-            }
-        })
+        limit = request.args.get('limit', None, type=int)
+        # Peticiones simultaneas con el mismo limit comparten una sola consulta
+        return jsonify(coalescencia.ejecutar(('estadisticas', limit), lambda: consultar_estadisticas(limit)))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -177,140 +285,305 @@ def get_nivel_actual():
 
 @app.route('/api/puntos-reciclaje', methods=['GET'])
 def get_puntos_reciclaje():
-    """Obtener lista de puntos de reciclaje ordenados por distancia"""
+    """Obtener puntos de reciclaje ordenados por distancia (?lat=&lon=&radius_km=&limit=)"""
     try:
         limit = request.args.get('limit', 10, type=int)
+        try:
+            lat, lon, radio = origen_consulta()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         if not os.path.exists(RECICLAJE_DB_FILE):
             return jsonify({'puntos': [], 'total': 0, 'mensaje': 'Base de datos de reciclaje no encontrada'})
         
-        conn = get_db_connection(RECICLAJE_DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute('SELECT nombre, direccion, municipio, lat, lon FROM puntos_reciclaje')
-        filas = cursor.fetchall()
-        conn.close()
+        puntos, total = buscador_puntos.buscar(lat, lon, radio, limit, conectar=get_db_connection)
+        
+        return jsonify({
+            'puntos': puntos,
+            'total': total
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/puntos-reciclaje/buscar', methods=['GET'])
+def buscar_puntos_reciclaje():
+    """Buscar puntos por nombre, calle o municipio (?q=, por prefijo), ordenados por distancia"""
+    try:
+        limit = request.args.get('limit', 10, type=int)
+        consulta = expresion_fts(request.args.get('q'))
+        if consulta is None:
+            return jsonify({'error': 'Falta el texto a buscar (q)'}), 400
+        try:
+            lat, lon, radio = origen_consulta()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        puntos_con_distancia = []
-        for row in filas:
-            nombre, direccion, municipio, lat, lon = row
-            d = distancia_km(LAT_PAPELERA, LON_PAPELERA, lat, lon)
-            if d is not None:
-                puntos_con_distancia.append({
-                    'nombre': nombre,
-                    'direccion': direccion,
-                    'municipio': municipio,
-                    'lat': lat,
-                    'lon': lon,
-                    'distancia_km': round(d, 2)
-                })
+        if not os.path.exists(RECICLAJE_DB_FILE):
+            return jsonify({'puntos': [], 'total': 0, 'mensaje': 'Base de datos de reciclaje no encontrada'})
         
-        # Ordenar por distancia
-        puntos_con_distancia.sort(key=lambda x: x['distancia_km'])
+        puntos, total = buscador_puntos.buscar(lat, lon, radio, limit, conectar=get_db_connection,
+                                               consulta=consulta)
         
         return jsonify({
-            'puntos': puntos_con_distancia[:limit],
-            'total': len(puntos_con_distancia)
+            'q': request.args.get('q'),
+            'puntos': puntos,
+            'total': total
         })
+    except sqlite3.OperationalError as e:
+        if 'puntos_fts' in str(e):
+            return jsonify({'error': 'Busqueda de texto no disponible (SQLite sin FTS5)'}), 503
+        return jsonify({'error': str(e)}), 500
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/punto-reciclaje-cercano', methods=['GET'])
 def get_punto_reciclaje_cercano():
-    """Obtener el punto de reciclaje mas cercano"""
+    """Obtener el punto de reciclaje mas cercano (a la papelera o a ?lat=&lon=, opcionalmente en ?radius_km=)"""
     try:
+        try:
+            lat, lon, radio = origen_consulta()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
         if not os.path.exists(RECICLAJE_DB_FILE):
             return jsonify({'error': 'Base de datos de reciclaje no encontrada'}), 404
         
-        conn = get_db_connection(RECICLAJE_DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute('SELECT nombre, direccion, municipio, lat, lon FROM puntos_reciclaje')
-        filas = cursor.fetchall()
-        conn.close()
-        
-        if not filas:
-            return jsonify({'mensaje': 'No hay puntos de reciclaje disponibles'})
+        puntos, total = buscador_puntos.buscar(lat, lon, radio, 1, conectar=get_db_connection)
         
-        mejor = None
-        mejor_dist = None
-        
-        for nombre, direccion, municipio, lat, lon in filas:
-            d = distancia_km(LAT_PAPELERA, LON_PAPELERA, lat, lon)
-            if d is None:
-                continue
-            if mejor_dist is None or d < mejor_dist:
-                mejor_dist = d
-                mejor = {
-                    'nombre': nombre,
-                    'direccion': direccion,
-                    'municipio': municipio,
-                    'lat': lat,
-                    'lon': lon,
-                    'distancia_km': round(d, 2)
-                }
-        
-        if mejor:
-            return jsonify(mejor)
+        if puntos:
+            return jsonify(puntos[0])
+        elif radio is not None:
+            return jsonify({'mensaje': f'No hay puntos de reciclaje a menos de {radio} km'})
         else:
-            return jsonify({'mensaje': 'No se pudo calcular la distancia a ningún punto'})
+            return jsonify({'mensaje': 'No hay puntos de reciclaje disponibles'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def consultar_resumen():
+    """Contadores, nivel y punto de reciclaje mas cercano de /api/resumen"""
+    # Estadisticas
+    conn = get_db_connection(DB_FILE)
+    cursor = conn.cursor()
+    
+    cursor.execute('SELECT COUNT(*) FROM usuarios')
+    num_usuarios = cursor.fetchone()[0]
+    
+    cursor.execute('SELECT COUNT(*) FROM depositos')
+    num_depositos = cursor.fetchone()[0]
+    
+    cursor.execute('SELECT SUM(kg_total) FROM estadisticas')
+    total_kg = cursor.fetchone()[0] or 0.0
+    
+    cursor.execute('SELECT nivel_final FROM depositos ORDER BY fecha DESC LIMIT 1')
+    nivel_row = cursor.fetchone()
+    nivel_actual = nivel_row[0] if nivel_row else 0
+    
+    conn.close()
+    
+    # Punto mas cercano
+    punto_cercano = None
+    if os.path.exists(RECICLAJE_DB_FILE):
+        try:
+            puntos, _ = buscador_puntos.buscar(LAT_PAPELERA, LON_PAPELERA, None, 1,
+                                               conectar=get_db_connection)
+            if puntos:
+                punto_cercano = {k: puntos[0][k] for k in ('nombre', 'direccion', 'municipio', 'distancia_km')}
+        except:
+            pass
+    
+    return {
+        'usuarios': num_usuarios,
+        'depositos': num_depositos,
+        'kg_total': round(total_kg, 2),
+        'nivel_actual': nivel_actual,
+        'punto_reciclaje_cercano': punto_cercano
+    }
+
 @app.route('/api/resumen', methods=['GET'])
 def get_resumen():
     """Obtener resumen completo del sistema"""
     try:
-        # Estadisticas
+        # Los paneles refrescan a la vez: una sola consulta para todas las peticiones en curso
+        return jsonify(coalescencia.ejecutar(('resumen',), consultar_resumen))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# ============== INGESTA DESDE LAS PAPELERAS ==============
+
+# Las tablas y migraciones de la ingesta se preparan una vez por proceso, en el primer lote
+_tablas_ingesta_listas = False
+_lock_tablas_ingesta = threading.Lock()
+
+def inicializar_tablas_ingesta(conn):
+    """Crear en la BD central las tablas necesarias para recibir lotes"""
+    cursor = conn.cursor()
+    # Fechas en milisegundos desde 1970 UTC (ver marcas_tiempo.py)
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS usuarios (
+            uid INTEGER PRIMARY KEY,
+            nombre TEXT NOT NULL,
+            fecha_registro INTEGER DEFAULT ({SQL_AHORA_MS})
+        )
+    ''')
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS depositos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            uid INTEGER NOT NULL,
+            porcentaje_depositado INTEGER NOT NULL,
+            kg_estimado REAL NOT NULL,
+            nivel_final INTEGER NOT NULL,
+            fecha INTEGER DEFAULT ({SQL_AHORA_MS}),
+            FOREIGN KEY (uid) REFERENCES usuarios(uid)
+        )
+    ''')
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS estadisticas (
+            uid INTEGER PRIMARY KEY,
+            total_depositos INTEGER DEFAULT 0,
+            kg_total REAL DEFAULT 0.0,
+            ultima_actualizacion INTEGER DEFAULT ({SQL_AHORA_MS}),
+            nombre TEXT,
+            FOREIGN KEY (uid) REFERENCES usuarios(uid)
+        )
+    ''')
+    # Ultimo seq aplicado por cada papelera (high-water mark)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ingesta_marcas (
+            papelera_id TEXT PRIMARY KEY,
+            ultimo_seq INTEGER NOT NULL DEFAULT 0,
+            ultima_ingesta TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.commit()
+    migrar_uids_enteros(conn)
+    migrar_fechas_ms(conn)
+    # Rangos de fechas e historial (despues de migrar: compara enteros)
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_depositos_fecha ON depositos(fecha)')
+    preparar_ranking(conn)
+    preparar_reconciliacion(conn)
+
+def asegurar_tablas_ingesta():
+    """inicializar_tablas_ingesta() la primera vez que se llama en el proceso"""
+    global _tablas_ingesta_listas
+    if _tablas_ingesta_listas:
+        return
+    with _lock_tablas_ingesta:
+        if _tablas_ingesta_listas:
+            return
+        conn = get_db_connection(DB_FILE)
+        try:
+            inicializar_tablas_ingesta(conn)
+        finally:
+            conn.close()
+        _tablas_ingesta_listas = True
+
+@app.route('/api/ingesta', methods=['POST'])
+def post_ingesta():
+    """
+    Recibir un lote de depositos nuevos de una papelera.
+    Cuerpo JSON (opcionalmente con Content-Encoding: gzip):
+        {"papelera_id": "...", "depositos": [{"seq": 1, "uid": "...", "fecha": "ISO 8601", ...}]}
+    Es idempotente: los depositos con seq <= ultimo seq aplicado se ignoran.
+    Responde con el ultimo seq aplicado ('ack') para que la papelera libere su outbox.
+    """
+    try:
+        cuerpo = request.get_data()
+        if request.headers.get('Content-Encoding', '').lower() == 'gzip':
+            cuerpo = gzip.decompress(cuerpo)
+        lote = json.loads(cuerpo)
+    except (OSError, ValueError) as e:
+        return jsonify({'error': f'Lote no valido: {e}'}), 400
+    
+    papelera_id = lote.get('papelera_id') if isinstance(lote, dict) else None
+    if not papelera_id:
+        return jsonify({'error': 'Falta papelera_id'}), 400
+    try:
+        depositos = sorted(
+            (int(d['seq']), hex_a_uid(d['uid']), d['nombre'], d['porcentaje'], d['kg'], d['nivel'],
+             iso_a_ms(d['fecha']))
+            for d in lote.get('depositos') or []
+        )
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'error': f'Deposito incompleto: {e}'}), 400
+    
+    conn = None
+    try:
+        asegurar_tablas_ingesta()
         conn = get_db_connection(DB_FILE)
         cursor = conn.cursor()
         
-        cursor.execute('SELECT COUNT(*) FROM usuarios')
-        num_usuarios = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM depositos')
-        num_depositos = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT SUM(kg_total) FROM estadisticas')
-        total_kg = cursor.fetchone()[0] or 0.0
+        # Bloqueo de escritura desde el principio: dos lotes de la misma papelera
+        # no pueden leer la misma marca a la vez
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('SELECT ultimo_seq FROM ingesta_marcas WHERE papelera_id = ?', (papelera_id,))
+        fila = cursor.fetchone()
+        ultimo_seq = fila[0] if fila else 0
         
-        cursor.execute('SELECT nivel_final FROM depositos ORDER BY fecha DESC LIMIT 1')
-        nivel_row = cursor.fetchone()
-        nivel_actual = nivel_row[0] if nivel_row else 0
+        nuevos = [d for d in depositos if d[0] > ultimo_seq]
+        for seq, uid, nombre, porcentaje, kg, nivel, fecha in nuevos:
+            cursor.execute('INSERT OR IGNORE INTO usuarios (uid, nombre) VALUES (?, ?)', (uid, nombre))
+            cursor.execute('''
+                INSERT OR IGNORE INTO estadisticas (uid, nombre, total_depositos, kg_total)
+                VALUES (?, ?, 0, 0.0)
+            ''', (uid, nombre))
+            cursor.execute('''
+                INSERT INTO depositos (uid, porcentaje_depositado, kg_estimado, nivel_final, fecha)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (uid, porcentaje, kg, nivel, fecha))
+            cursor.execute('''
+                UPDATE estadisticas
+                SET total_depositos = total_depositos + 1,
+                    kg_total = kg_total + ?,
+                    ultima_actualizacion = ?
+                WHERE uid = ?
+            ''', (kg, ahora_ms(), uid))
         
-        conn.close()
+        if nuevos:
+            ultimo_seq = nuevos[-1][0]
+            cursor.execute('''
+                INSERT INTO ingesta_marcas (papelera_id, ultimo_seq) VALUES (?, ?)
+                ON CONFLICT(papelera_id) DO UPDATE SET
+                    ultimo_seq = excluded.ultimo_seq,
+                    ultima_ingesta = CURRENT_TIMESTAMP
+            ''', (papelera_id, ultimo_seq))
         
-        # Punto mas cercano
-        punto_cercano = None
-        if os.path.exists(RECICLAJE_DB_FILE):
-            try:
-                conn_rec = get_db_connection(RECICLAJE_DB_FILE)
-                cursor_rec = conn_rec.cursor()
-                cursor_rec.execute('SELECT nombre, direccion, municipio, lat, lon FROM puntos_reciclaje')
-                filas = cursor_rec.fetchall()
-                conn_rec.close()
-                
-                mejor_dist = None
-                for nombre, direccion, municipio, lat, lon in filas:
-                    d = distancia_km(LAT_PAPELERA, LON_PAPELERA, lat, lon)
-                    if d is not None and (mejor_dist is None or d < mejor_dist):
-                        mejor_dist = d
-                        punto_cercano = {
-                            'nombre': nombre,
-                            'direccion': direccion,
-                            'municipio': municipio,
-                            'distancia_km': round(d, 2)
-                        }
-            except:
-                pass
+        conn.commit()
         
         return jsonify({
-            'usuarios': num_usuarios,
-            'depositos': num_depositos,
-            'kg_total': round(total_kg, 2),
-            'nivel_actual': nivel_actual,
-            'punto_reciclaje_cercano': punto_cercano
+            'ack': ultimo_seq,
+            'insertados': len(nuevos),
+            'duplicados': len(depositos) - len(nuevos)
         })
     except Exception as e:
+        if conn is not None:
+            conn.rollback()
         return jsonify({'error': str(e)}), 500
+    finally:
+        if conn is not None:
+            conn.close()
+
+# ============== INSTANTANEA PARA EL MODO SQL.JS ==============
+
+@app.route('/db/<nombre>', methods=['GET'])
+def get_instantanea(nombre):
+    """Instantanea de solo lectura para el panel (ver instantanea.py), con Range y GET condicional"""
+    ruta = os.path.abspath(os.path.join(DIRECTORIO_INSTANTANEA, NOMBRE_INSTANTANEA))
+    if nombre != NOMBRE_INSTANTANEA or not os.path.exists(ruta):
+        return jsonify({'error': 'Instantanea no disponible (python papelera_cli.py snapshot)'}), 404
+    
+    # Descarga completa: version gzip si el cliente la acepta. Los Range siempre se
+    # sirven sobre la BD sin comprimir, para que los desplazamientos sean de la BD.
+    comprimida = ruta + '.gz'
+    if 'Range' not in request.headers and request.accept_encodings['gzip'] and os.path.exists(comprimida):
+        respuesta = send_file(comprimida, mimetype='application/vnd.sqlite3', conditional=True)
+        respuesta.headers['Content-Encoding'] = 'gzip'
+    else:
+        respuesta = send_file(ruta, mimetype='application/vnd.sqlite3', conditional=True)
+    respuesta.headers['Accept-Ranges'] = 'bytes'
+    respuesta.vary.add('Accept-Encoding')
+    # Se publica con rename atomico: el cliente revalida con ETag y recibe 304 si no ha cambiado
+    respuesta.cache_control.no_cache = True
+    return respuesta
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
@@ -324,20 +597,56 @@ def health_check():
         'db_reciclaje': reciclaje_db_exists
     })
 
-if __name__ == '__main__':
+def main(argv=None):
+    """Arranca el servidor (desarrollo o produccion)"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='API REST - Sistema de Papelera Inteligente')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--debug', action='store_true', help='Servidor de desarrollo con depurador')
+    parser.add_argument('--produccion', action='store_true', help='Servidor ASGI (uvicorn) con varios workers')
+    parser.add_argument('--workers', type=int, default=None, help='Procesos worker en modo produccion')
+    parser.add_argument('--hilos', type=int, default=None, help='Hilos por worker para las consultas')
+    parser.add_argument('--profiler', action='store_true', help='Activar el profiler de muestreo')
+    args = parser.parse_args(argv)
+    
+    if args.profiler:
+        # Variable de entorno para que tambien lo activen los workers de produccion
+        os.environ['PAPELERA_PROFILER'] = '1'
+        metricas.activar_profiler()
+    
     print("\n" + "="*60)
     print("  API REST - Sistema de Papelera Inteligente")
     print("="*60)
     print("\nEndpoints disponibles:")
     print("  GET /api/usuarios - Lista de usuarios")
+    print("  GET /api/usuarios/<uid> - Perfil y puesto de un usuario")
     print("  GET /api/depositos - Lista de depósitos")
     print("  GET /api/estadisticas - Estadísticas de usuarios")
     print("  GET /api/nivel-actual - Nivel actual de la papelera")
     print("  GET /api/puntos-reciclaje - Lista de puntos de reciclaje")
+    print("  GET /api/puntos-reciclaje/buscar?q= - Buscar puntos por nombre, calle o municipio")
     print("  GET /api/punto-reciclaje-cercano - Punto más cercano")
     print("  GET /api/resumen - Resumen completo del sistema")
     print("  GET /api/health - Estado de la API")
-    print("\nIniciando servidor en http://localhost:5000\n")
+    print("  POST /api/ingesta - Recibir lote de depositos de una papelera")
+    print("  GET /api/metrics - Metricas de rendimiento (Prometheus)")
+    print(f"  GET /db/{NOMBRE_INSTANTANEA} - Instantanea para el panel web (sql.js)")
     
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    if args.produccion:
+        import papelera_asgi
+        # La misma app (y sus metricas) que este proceso, aunque se ejecute como __main__
+        papelera_asgi.servir(
+            app,
+            host=args.host,
+            port=args.port,
+            workers=args.workers or papelera_asgi.WORKERS,
+            hilos=args.hilos or papelera_asgi.HILOS_BD
+        )
+    else:
+        print(f"\nIniciando servidor en http://localhost:{args.port}\n")
+        app.run(host=args.host, port=args.port, debug=args.debug)
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Modo de produccion de la API REST de la Papelera Inteligente
+Sirve los mismos endpoints de papelera_api.py a traves de ASGI (uvicorn):
+- el bucle de eventos atiende las conexiones de los paneles/kioscos
+- cada peticion (y sus lecturas SQLite) se ejecuta en un pool de hilos
+- varios procesos worker, sin depurador
+
+Uso:
+    python papelera_api.py --produccion --workers 4 --hilos 32
+    PAPELERA_HILOS=32 uvicorn papelera_asgi:crear_app --factory --host 0.0.0.0 --port 5000 --workers 4
+"""
+
+import os
+from a2wsgi import WSGIMiddleware
+
+# Configuracion (variables de entorno para que la lean todos los workers)
+WORKERS = int(os.environ.get('PAPELERA_WORKERS', os.cpu_count() or 1))
+HILOS_BD = 32  # Hilos por worker para las consultas (PAPELERA_HILOS)
+
+def crear_app(wsgi_app=None):
+    """
+    Aplicacion ASGI con un pool de PAPELERA_HILOS hilos, leido al llamarla (no al importar
+    el modulo). Sin argumentos, como factory de uvicorn, usa la app de papelera_api.
+    """
+    if wsgi_app is None:
+        from papelera_api import app as wsgi_app
+    return WSGIMiddleware(wsgi_app, workers=int(os.environ.get('PAPELERA_HILOS', HILOS_BD)))
+
+def servir(app=None, host='0.0.0.0', port=5000, workers=WORKERS, hilos=HILOS_BD):
+    """
+    Arranca uvicorn con el numero de workers y de hilos indicado. Con un solo worker
+    sirve 'app' (la app Flask ya preparada por quien llama) en este mismo proceso.
+    """
+    import uvicorn
+
+    # Los workers crean su app con crear_app() y leen el tamaño del pool del entorno
+    os.environ['PAPELERA_HILOS'] = str(hilos)
+    print(f"Modo produccion: {workers} workers x {hilos} hilos en http://{host}:{port}\n")
+    if workers == 1:
+        uvicorn.run(crear_app(app), host=host, port=port, log_level='info')
+    else:
+        uvicorn.run('papelera_asgi:crear_app', factory=True, host=host, port=port,
+                    workers=workers, log_level='info')
+
+if __name__ == '__main__':
+    servir()
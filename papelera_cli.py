@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Linea de comandos del Sistema de Papelera Inteligente
+
+    python papelera_cli.py run              Bucle principal de la papelera (hardware)
+    python papelera_cli.py api [...]        Servidor API REST (mismas opciones que papelera_api.py)
+    python papelera_cli.py stats            Informe de uso (tabla, JSON o CSV)
+    python papelera_cli.py refresh-points   Descargar puntos de reciclaje de la API de Madrid
+    python papelera_cli.py read-card        Leer el UID de una tarjeta RFID
+    python papelera_cli.py read-distance    Medir con el sensor de ultrasonidos (o repetir una grabacion)
+    python papelera_cli.py import-users F   Alta masiva de usuarios desde CSV o JSON
+    python papelera_cli.py reconcile        Recalcular 'estadisticas' a partir de 'depositos'
+    python papelera_cli.py archive          Archivar los depositos antiguos por meses
+    python papelera_cli.py snapshot         Publicar la instantanea reducida para el panel web
+
+Cada subcomando importa solo lo que necesita: 'stats' no carga Flask, requests
+ni las librerias de hardware, y 'read-card' solo usa el bus I2C.
+'stats' abre la BD en solo lectura, asi que no hace falta parar la papelera.
+"""
+
+import sys
+import time
+import argparse
+
+
+def cmd_run(args):
+    from PapeleraInteligente import SistemaPapelera
+
+    sistema = SistemaPapelera(actualizar_puntos=not args.sin_actualizar_puntos)
+    sistema.ejecutar()
+
+
+def cmd_api(args):
+    import papelera_api
+
+    papelera_api.main(args.resto)
+
+
+def cmd_stats(args):
+    from PapeleraInteligente import DB_FILE
+    from informes import abrir_bd_lectura, generar_informe, formatear
+
+    conn = abrir_bd_lectura(args.db or DB_FILE)
+    try:
+        informe = generar_informe(conn, top=args.top, desde=args.desde, hasta=args.hasta,
+                                  ultimos=args.ultimos)
+    finally:
+        conn.close()
+    print(formatear(informe, args.formato))
+    if args.formato == "csv":
+        for aviso in informe['avisos']:
+            print(f"!! {aviso}", file=sys.stderr)
+
+
+def cmd_refresh_points(args):
+    from PapeleraInteligente import DatabaseManager, DB_FILE
+    from descarga_puntos import FUENTES, leer_fuentes
+
+    db = DatabaseManager(DB_FILE)
+    db.inicializar_reciclaje_db()
+    db.actualizar_puntos_reciclaje(leer_fuentes(args.fuentes) if args.fuentes else FUENTES,
+                                   forzar=args.forzar)
+    punto = db.obtener_punto_reciclaje_mas_cercano()
+    if punto:
+        print(f"Punto mas cercano: {punto['nombre']} ({punto['distancia_km']:.2f} km)")
+    db.conn.close()
+
+
+def cmd_read_card(args):
+    from PapeleraInteligente import WS1850S
+    from uid_tarjeta import uid_a_hex
+
+    rfid = WS1850S()
+    rfid.init()
+    print("Acerca una tarjeta...")
+    limite = time.time() + args.timeout
+    try:
+        while time.time() < limite:
+            uid = rfid.read_uid()
+            if uid:
+                print(uid_a_hex(uid))
+                return 0
+            time.sleep(0.1)
+        print("!! No se detecto ninguna tarjeta")
+        return 1
+    finally:
+        rfid.close()
+
+
+def cmd_read_distance(args):
+    import statistics
+    from ultrasonido import UltrasonidoGPIO, LineaGPIOD, LineaGrabada, grabar_eventos
+
+    linea = LineaGrabada.cargar(args.reproducir) if args.reproducir else LineaGPIOD()
+    grabacion = [] if args.grabar else None
+    sensor = UltrasonidoGPIO(linea, grabacion=grabacion)
+    distancias = []
+    try:
+        for _ in range(args.n):
+            distancia = sensor.get_distance()
+            if distancia is None:
+                print("!! Sin eco")
+            else:
+                distancias.append(distancia)
+                print(f"{distancia:.2f} cm")
+            if not args.reproducir:
+                time.sleep(args.intervalo)
+    finally:
+        sensor.cerrar()
+
+    if grabacion:
+        grabar_eventos(grabacion, args.grabar)
+        print(f"{len(grabacion)} medidas grabadas en {args.grabar}")
+    if len(distancias) > 1:
+        print(f"Media {statistics.mean(distancias):.2f} cm, desviacion {statistics.pstdev(distancias):.3f} cm, "
+              f"rango {min(distancias):.2f}-{max(distancias):.2f} cm")
+    return 0 if distancias else 1
+
+
+def cmd_import_users(args):
+    from PapeleraInteligente import DatabaseManager, DB_FILE, leer_usuarios_archivo
+
+    inicio = time.perf_counter()
+    usuarios = leer_usuarios_archivo(args.archivo)
+    db = DatabaseManager(args.db or DB_FILE)
+    try:
+        db.importar_usuarios(usuarios)
+    finally:
+        db.conn.close()
+    print(f"{len(usuarios)} filas procesadas en {time.perf_counter() - inicio:.2f} s")
+
+
+def cmd_reconcile(args):
+    from PapeleraInteligente import DB_FILE
+    from reconciliacion import abrir_bd, reconciliar, reconstruir
+
+    conn = abrir_bd(args.db or DB_FILE)
+    try:
+        inicio = time.perf_counter()
+        if args.completo:
+            resultado = reconstruir(conn, args.lote)
+        else:
+            resultado = reconciliar(conn, args.lote)
+    finally:
+        conn.close()
+    print(f"{resultado['usuarios']} usuarios revisados, {resultado['corregidos']} corregidos "
+          f"(hasta el deposito #{resultado['ultimo_id']}) en {time.perf_counter() - inicio:.2f} s")
+    if args.completo:
+        print("Totales verificados" if resultado['verificado'] else "!! Los totales no cuadran")
+        return 0 if resultado['verificado'] else 1
+
+
+def cmd_archive(args):
+    from PapeleraInteligente import DB_FILE
+    from retencion import abrir_bd, archivar, vacuum_incremental
+
+    conn = abrir_bd(args.db or DB_FILE)
+    try:
+        archivados = archivar(conn, args.dias, args.directorio, args.formato)
+        for mes, filas in archivados.items():
+            print(f"{mes}: {filas} depositos archivados")
+        if not archivados:
+            print(f"No hay depositos de mas de {args.dias} dias")
+        if args.vacuum:
+            libres = vacuum_incremental(conn, args.vacuum)
+            print(f"Vacuum incremental: quedan {libres} paginas libres")
+    finally:
+        conn.close()
+
+
+def cmd_snapshot(args):
+    from PapeleraInteligente import DB_FILE, RECICLAJE_DB_FILE, LAT_PAPELERA, LON_PAPELERA
+    from instantanea import exportar_instantanea, exportar_periodicamente
+
+    opciones = dict(db_file=args.db or DB_FILE, reciclaje_db=RECICLAJE_DB_FILE,
+                    lat=LAT_PAPELERA, lon=LON_PAPELERA, directorio=args.directorio, dias=args.dias)
+    if args.intervalo:
+        try:
+            exportar_periodicamente(args.intervalo, **opciones)
+        except KeyboardInterrupt:
+            pass
+        return
+    resumen = exportar_instantanea(**opciones)
+    filas = resumen['filas']
+    print(f"{resumen['ruta']}: {resumen['bytes']} bytes ({resumen['bytes_gzip']} con gzip)")
+    print(f"{filas['usuarios']} usuarios, {filas['depositos']} depositos de los ultimos {args.dias} dias, "
+          f"{filas['resumen_mensual']} meses de resumen, {filas['puntos_reciclaje']} puntos de reciclaje")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sistema de Papelera Inteligente")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p = sub.add_parser("run", help="Bucle principal de la papelera")
+    p.add_argument("--sin-actualizar-puntos", action="store_true",
+                   help="No descargar los puntos de reciclaje al arrancar")
+    p.set_defaults(func=cmd_run)
+
+    # Las opciones de 'api' se pasan tal cual a papelera_api.main
+    p = sub.add_parser("api", help="Servidor API REST", add_help=False)
+    p.set_defaults(func=cmd_api)
+
+    p = sub.add_parser("stats", help="Informe de uso (solo lectura, con la papelera en marcha)")
+    p.add_argument("--db", help="Ruta de la base de datos (por defecto la de la papelera)")
+    p.add_argument("--top", type=int, help="Mostrar solo los N primeros usuarios")
+    p.add_argument("--desde", help="Fecha inicial AAAA-MM-DD (incluida)")
+    p.add_argument("--hasta", help="Fecha final AAAA-MM-DD (incluida)")
+    p.add_argument("--ultimos", type=int, default=5, help="Ultimos depositos a listar (por defecto 5)")
+    p.add_argument("--formato", choices=("tabla", "json", "csv"), default="tabla")
+    p.set_defaults(func=cmd_stats)
+
+    p = sub.add_parser("refresh-points", help="Actualizar los puntos de reciclaje")
+    p.add_argument("--fuentes", help="JSON con las fuentes [{tipo, url, formato}] (URL, file:// o ruta)")
+    p.add_argument("--forzar", action="store_true", help="Descargar aunque las fuentes no hayan cambiado")
+    p.set_defaults(func=cmd_refresh_points)
+
+    p = sub.add_parser("read-card", help="Leer el UID de una tarjeta RFID")
+    p.add_argument("--timeout", type=float, default=10, help="Segundos de espera (por defecto 10)")
+    p.set_defaults(func=cmd_read_card)
+
+    p = sub.add_parser("read-distance", help="Medir con el sensor de ultrasonidos (flancos del kernel)")
+    p.add_argument("--n", type=int, default=10, help="Numero de medidas (por defecto 10)")
+    p.add_argument("--intervalo", type=float, default=0.1, help="Segundos entre medidas (por defecto 0.1)")
+    p.add_argument("--grabar", metavar="FICHERO", help="Guardar los eventos de cada medida (JSON Lines)")
+    p.add_argument("--reproducir", metavar="FICHERO", help="Repetir medidas grabadas sin hardware")
+    p.set_defaults(func=cmd_read_distance)
+
+    p = sub.add_parser("import-users", help="Alta masiva de usuarios desde CSV (uid,nombre) o JSON")
+    p.add_argument("archivo", help="Fichero .csv o .json con los usuarios")
+    p.add_argument("--db", help="Ruta de la base de datos (por defecto la de la papelera)")
+    p.set_defaults(func=cmd_import_users)
+
+    p = sub.add_parser("reconcile", help="Reparar 'estadisticas' a partir de 'depositos'")
+    p.add_argument("--completo", action="store_true",
+                   help="Recalcular todos los usuarios por lotes y verificar los totales")
+    p.add_argument("--lote", type=int, default=500, help="Usuarios por transaccion (por defecto 500)")
+    p.add_argument("--db", help="Ruta de la base de datos (por defecto la de la papelera)")
+    p.set_defaults(func=cmd_reconcile)
+
+    p = sub.add_parser("archive", help="Mover los depositos antiguos a archivos mensuales")
+    p.add_argument("--dias", type=int, default=180, help="Dias que se quedan en la BD (por defecto 180)")
+    p.add_argument("--formato", choices=("sqlite", "csv"), default="sqlite",
+                   help="BD SQLite mensual (consultable con ATTACH) o CSV comprimido")
+    p.add_argument("--directorio", default="archivo", help="Carpeta de los archivos (por defecto archivo/)")
+    p.add_argument("--vacuum", type=int, default=0, metavar="PAGINAS",
+                   help="Liberar despues hasta PAGINAS paginas con incremental_vacuum")
+    p.add_argument("--db", help="Ruta de la base de datos (por defecto la de la papelera)")
+    p.set_defaults(func=cmd_archive)
+
+    p = sub.add_parser("snapshot", help="Publicar la instantanea reducida para el panel web (sql.js)")
+    p.add_argument("--dias", type=int, default=30, help="Dias de depositos incluidos (por defecto 30)")
+    p.add_argument("--directorio", default="web", help="Carpeta que sirve la API en /db/ (por defecto web/)")
+    p.add_argument("--intervalo", type=int, default=0, metavar="SEGUNDOS",
+                   help="Regenerarla cada SEGUNDOS segundos en lugar de una sola vez")
+    p.add_argument("--db", help="Ruta de la base de datos (por defecto la de la papelera)")
+    p.set_defaults(func=cmd_snapshot)
+
+    args, resto = parser.parse_known_args(argv)
+    if args.comando == "api":
+        args.resto = resto
+    elif resto:
+        parser.error(f"argumentos no reconocidos: {' '.join(resto)}")
+    return args.func(args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Instrumentacion de la API REST de la Papelera Inteligente
+- Histogramas de latencia por endpoint, separando tiempo SQL y de serializacion JSON
+- Filas leidas de SQLite por endpoint
+- Aciertos/fallos de las caches de la API
+- Profiler de muestreo opcional (PAPELERA_PROFILER=1 o POST /api/metrics/profiler)
+
+Todo se expone en /api/metrics en formato de texto de Prometheus.
+Con varios workers (modo produccion) cada proceso lleva sus propias metricas.
+"""
+
+import os
+import sys
+import time
+import sqlite3
+import threading
+from flask import g, request, has_app_context, Response, jsonify
+from flask.json.provider import DefaultJSONProvider
+
+# Limites de los buckets de los histogramas (segundos)
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+INTERVALO_PROFILER = 0.01  # segundos entre muestras
+MAX_FUNCIONES_PROFILER = 50  # funciones exportadas en /api/metrics
+
+
+# ============== ESTRUCTURAS DE METRICAS ==============
+class Histograma:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.cuentas = [0] * len(buckets)
+        self.suma = 0.0
+        self.total = 0
+
+    def observar(self, valor):
+        for i, limite in enumerate(self.buckets):
+            if valor <= limite:
+                self.cuentas[i] += 1
+                break
+        self.suma += valor
+        self.total += 1
+
+    def lineas(self, nombre, etiquetas):
+        acumulado = 0
+        for limite, cuenta in zip(self.buckets, self.cuentas):
+            acumulado += cuenta
+            yield f'{nombre}_bucket{{{etiquetas},le="{limite}"}} {acumulado}'
+        yield f'{nombre}_bucket{{{etiquetas},le="+Inf"}} {self.total}'
+        yield f'{nombre}_sum{{{etiquetas}}} {self.suma:.6f}'
+        yield f'{nombre}_count{{{etiquetas}}} {self.total}'
+
+
+class Metricas:
+    """Registro de metricas del proceso (seguro entre hilos)"""
+    HISTOGRAMAS = (
+        ('papelera_peticion_segundos', 'Latencia total de las peticiones por endpoint'),
+        ('papelera_sql_segundos', 'Tiempo en SQLite (execute + fetch) por peticion'),
+        ('papelera_serializacion_segundos', 'Tiempo serializando JSON por peticion'),
+    )
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histogramas = {nombre: {} for nombre, _ in self.HISTOGRAMAS}
+        self.peticiones = {}  # {(endpoint, metodo, estado): n}
+        self.filas = {}  # {endpoint: n}
+        self.caches = {}  # {cache: [aciertos, fallos]}
+        self.profiler = None
+
+    def observar_peticion(self, endpoint, metodo, estado, total, sql, serializacion, filas):
+        with self.lock:
+            for nombre, valor in (
+                ('papelera_peticion_segundos', total),
+                ('papelera_sql_segundos', sql),
+                ('papelera_serializacion_segundos', serializacion),
+            ):
+                self.histogramas[nombre].setdefault(endpoint, Histograma()).observar(valor)
+            clave = (endpoint, metodo, estado)
+            self.peticiones[clave] = self.peticiones.get(clave, 0) + 1
+            self.filas[endpoint] = self.filas.get(endpoint, 0) + filas
+
+    def activar_profiler(self, activo=True):
+        if activo and not self.profiler:
+            self.profiler = ProfilerMuestreo()
+            self.profiler.start()
+        elif not activo and self.profiler:
+            self.profiler.detener()
+            self.profiler = None
+
+    def contar_cache(self, cache, acierto):
+        """Registrar un acceso a una cache de la API"""
+        with self.lock:
+            contadores = self.caches.setdefault(cache, [0, 0])
+            contadores[0 if acierto else 1] += 1
+
+    def exportar(self):
+        """Metricas en formato de texto de Prometheus"""
+        lineas = []
+        with self.lock:
+            for nombre, ayuda in self.HISTOGRAMAS:
+                lineas.append(f'# HELP {nombre} {ayuda}')
+                lineas.append(f'# TYPE {nombre} histogram')
+                for endpoint, histograma in sorted(self.histogramas[nombre].items()):
+                    lineas.extend(histograma.lineas(nombre, f'endpoint="{endpoint}"'))
+
+            lineas.append('# HELP papelera_peticiones_total Peticiones atendidas')
+            lineas.append('# TYPE papelera_peticiones_total counter')
+            for (endpoint, metodo, estado), n in sorted(self.peticiones.items()):
+                lineas.append(
+                    f'papelera_peticiones_total{{endpoint="{endpoint}",metodo="{metodo}",estado="{estado}"}} {n}'
+                )
+
+            lineas.append('# HELP papelera_filas_total Filas leidas de SQLite')
+            lineas.append('# TYPE papelera_filas_total counter')
+            for endpoint, n in sorted(self.filas.items()):
+                lineas.append(f'papelera_filas_total{{endpoint="{endpoint}"}} {n}')
+
+            lineas.append('# HELP papelera_cache_accesos_total Accesos a las caches de la API')
+            lineas.append('# TYPE papelera_cache_accesos_total counter')
+            lineas.append('# HELP papelera_cache_ratio_aciertos Proporcion de aciertos de cada cache')
+            lineas.append('# TYPE papelera_cache_ratio_aciertos gauge')
+            for cache, (aciertos, fallos) in sorted(self.caches.items()):
+                lineas.append(f'papelera_cache_accesos_total{{cache="{cache}",resultado="acierto"}} {aciertos}')
+                lineas.append(f'papelera_cache_accesos_total{{cache="{cache}",resultado="fallo"}} {fallos}')
+                ratio = aciertos / (aciertos + fallos) if aciertos + fallos else 0.0
+                lineas.append(f'papelera_cache_ratio_aciertos{{cache="{cache}"}} {ratio:.4f}')
+
+        if self.profiler:
+            lineas.extend(self.profiler.lineas())
+        return '\n'.join(lineas) + '\n'
+
+
+# ============== SQLITE MEDIDO ==============
+def acumular(campo, valor):
+    if has_app_context():
+        setattr(g, campo, getattr(g, campo, 0) + valor)
+
+
+class CursorMedido(sqlite3.Cursor):
+    """Cursor que acumula en la peticion actual el tiempo SQL y las filas leidas"""
+    def execute(self, *args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return super().execute(*args, **kwargs)
+        finally:
+            acumular('tiempo_sql', time.perf_counter() - inicio)
+
+    def executemany(self, *args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(*args, **kwargs)
+        finally:
+            acumular('tiempo_sql', time.perf_counter() - inicio)
+
+    def fetchone(self):
+        inicio = time.perf_counter()
+        fila = super().fetchone()
+        acumular('tiempo_sql', time.perf_counter() - inicio)
+        acumular('filas', 1 if fila is not None else 0)
+        return fila
+
+    def fetchmany(self, *args, **kwargs):
+        inicio = time.perf_counter()
+        filas = super().fetchmany(*args, **kwargs)
+        acumular('tiempo_sql', time.perf_counter() - inicio)
+        acumular('filas', len(filas))
+        return filas
+
+    def fetchall(self):
+        inicio = time.perf_counter()
+        filas = super().fetchall()
+        acumular('tiempo_sql', time.perf_counter() - inicio)
+        acumular('filas', len(filas))
+        return filas
+
+
+class ConexionMedida(sqlite3.Connection):
+    """Usar con sqlite3.connect(..., factory=ConexionMedida)"""
+    def cursor(self, factory=CursorMedido):
+        return super().cursor(factory)
+
+    def execute(self, *args, **kwargs):
+        return self.cursor().execute(*args, **kwargs)
+
+
+class ProveedorJSONMedido(DefaultJSONProvider):
+    """Proveedor JSON de Flask que mide el tiempo de serializacion"""
+    def dumps(self, obj, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            acumular('tiempo_serializacion', time.perf_counter() - inicio)
+
+
+# ============== PROFILER DE MUESTREO ==============
+class ProfilerMuestreo(threading.Thread):
+    """
+    Cada INTERVALO_PROFILER segundos toma la pila de todos los hilos y cuenta
+    la funcion mas interna que pertenece al proyecto (papelera_*.py).
+    """
+    def __init__(self, intervalo=INTERVALO_PROFILER):
+        super().__init__(daemon=True)
+        self.intervalo = intervalo
+        self.muestras = {}
+        self.lock = threading.Lock()
+        self._parar = threading.Event()
+        self.directorio = os.path.dirname(os.path.abspath(__file__))
+
+    def _es_del_proyecto(self, codigo):
+        return (os.path.dirname(os.path.abspath(codigo.co_filename)) == self.directorio
+                and os.path.basename(codigo.co_filename) != os.path.basename(__file__))
+
+    def run(self):
+        propio = threading.get_ident()
+        while not self._parar.wait(self.intervalo):
+            for hilo, frame in sys._current_frames().items():
+                if hilo == propio:
+                    continue
+                while frame is not None and not self._es_del_proyecto(frame.f_code):
+                    frame = frame.f_back
+                if frame is None:
+                    continue
+                codigo = frame.f_code
+                clave = f'{os.path.basename(codigo.co_filename)}:{codigo.co_name}:{frame.f_lineno}'
+                with self.lock:
+                    self.muestras[clave] = self.muestras.get(clave, 0) + 1
+
+    def detener(self):
+        self._parar.set()
+
+    def lineas(self):
+        with self.lock:
+            top = sorted(self.muestras.items(), key=lambda x: x[1], reverse=True)[:MAX_FUNCIONES_PROFILER]
+        yield '# HELP papelera_profiler_muestras_total Muestras del profiler por funcion y linea'
+        yield '# TYPE papelera_profiler_muestras_total counter'
+        for funcion, n in top:
+            yield f'papelera_profiler_muestras_total{{funcion="{funcion}"}} {n}'
+
+
+# ============== INTEGRACION CON FLASK ==============
+def instalar_metricas(app, profiler=None):
+    """Registra los hooks de medicion y los endpoints /api/metrics en la app"""
+    metricas = Metricas()
+    app.json = ProveedorJSONMedido(app)
+
+    if profiler is None:
+        profiler = os.environ.get('PAPELERA_PROFILER', '') == '1'
+    metricas.activar_profiler(profiler)
+
+    @app.before_request
+    def _inicio_peticion():
+        g.inicio_peticion = time.perf_counter()
+
+    @app.after_request
+    def _fin_peticion(response):
+        inicio = getattr(g, 'inicio_peticion', None)
+        if inicio is not None:
+            endpoint = request.url_rule.rule if request.url_rule else 'desconocido'
+            metricas.observar_peticion(
+                endpoint,
+                request.method,
+                response.status_code,
+                time.perf_counter() - inicio,
+                getattr(g, 'tiempo_sql', 0.0),
+                getattr(g, 'tiempo_serializacion', 0.0),
+                getattr(g, 'filas', 0)
+            )
+        return response
+
+    @app.route('/api/metrics', methods=['GET'])
+    def get_metrics():
+        """Metricas de la API en formato Prometheus"""
+        return Response(metricas.exportar(), mimetype='text/plain; version=0.0.4')
+
+    @app.route('/api/metrics/profiler', methods=['POST'])
+    def post_profiler():
+        """Activar (?activo=1) o desactivar (?activo=0) el profiler de muestreo"""
+        metricas.activar_profiler(request.args.get('activo', '1') == '1')
+        return jsonify({'profiler': metricas.profiler is not None})
+
+    return metricas
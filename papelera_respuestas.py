@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Codificacion de las respuestas de la API REST de la Papelera Inteligente
+- JSON con orjson (si esta instalado) en lugar del modulo json de la libreria estandar
+- MessagePack si el cliente lo pide en la cabecera Accept (application/msgpack)
+- Compresion brotli o gzip segun Accept-Encoding, solo por encima de UMBRAL_COMPRESION
+
+orjson, msgpack y brotli son opcionales: sin ellos se usa el JSON de Flask, se responde
+siempre JSON y se comprime con gzip. El tiempo de codificacion y compresion se suma al
+de serializacion de /api/metrics.
+"""
+
+import gzip
+import time
+from flask import request
+from papelera_metricas import ProveedorJSONMedido, acumular
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# ============== CONFIGURACION ==============
+UMBRAL_COMPRESION = 1024  # bytes: las respuestas mas pequenas no compensan
+NIVEL_GZIP = 6
+CALIDAD_BROTLI = 5  # buen compromiso velocidad/tamano para respuestas dinamicas
+
+TIPOS_MSGPACK = ('application/msgpack', 'application/x-msgpack')
+
+
+def _formato_pedido():
+    """'msgpack' si el cliente lo prefiere a JSON (Accept), si no 'json'"""
+    if msgpack is None:
+        return 'json'
+    mejor = request.accept_mimetypes.best_match(('application/json',) + TIPOS_MSGPACK)
+    return 'msgpack' if mejor in TIPOS_MSGPACK else 'json'
+
+
+class ProveedorRespuestas(ProveedorJSONMedido):
+    """Proveedor JSON de Flask con orjson y salida MessagePack negociada"""
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        inicio = time.perf_counter()
+        try:
+            return self._orjson(obj).decode('utf-8')
+        finally:
+            acumular('tiempo_serializacion', time.perf_counter() - inicio)
+
+    def _orjson(self, obj):
+        # Claves ordenadas como el proveedor por defecto de Flask
+        return orjson.dumps(obj, default=self.default,
+                            option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        formato = _formato_pedido()
+        if formato == 'json' and (orjson is None or self._app.debug):
+            respuesta = super().response(obj)
+        else:
+            inicio = time.perf_counter()
+            try:
+                if formato == 'msgpack':
+                    datos, tipo = msgpack.packb(obj, default=self.default), 'application/msgpack'
+                else:
+                    # Bytes directamente, sin pasar por str
+                    datos, tipo = self._orjson(obj), self.mimetype
+            finally:
+                acumular('tiempo_serializacion', time.perf_counter() - inicio)
+            respuesta = self._app.response_class(datos, mimetype=tipo)
+        if msgpack is not None:
+            respuesta.vary.add('Accept')
+        return respuesta
+
+
+def _codificacion_pedida():
+    aceptadas = request.accept_encodings
+    if brotli is not None and aceptadas['br']:
+        return 'br'
+    if aceptadas['gzip']:
+        return 'gzip'
+    return None
+
+
+def comprimir_respuesta(response):
+    """after_request: comprime las respuestas grandes si el cliente lo admite"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or request.method == 'HEAD'):
+        return response
+    response.vary.add('Accept-Encoding')
+    datos = response.get_data()
+    if len(datos) < UMBRAL_COMPRESION:
+        return response
+    codificacion = _codificacion_pedida()
+    if codificacion is None:
+        return response
+
+    inicio = time.perf_counter()
+    if codificacion == 'br':
+        datos = brotli.compress(datos, quality=CALIDAD_BROTLI)
+    else:
+        datos = gzip.compress(datos, compresslevel=NIVEL_GZIP)
+    acumular('tiempo_serializacion', time.perf_counter() - inicio)
+
+    response.set_data(datos)
+    response.headers['Content-Encoding'] = codificacion
+    return response
+
+
+def instalar_respuestas(app):
+    """
+    Sustituye el proveedor JSON y registra la compresion. Se llama despues de
+    instalar_metricas() para que la compresion se mida dentro de la peticion.
+    """
+    app.json = ProveedorRespuestas(app)
+    app.after_request(comprimir_respuesta)
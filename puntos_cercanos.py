@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Busqueda de puntos de reciclaje cercanos a un origen cualquiera (movil, kiosco...)
+- Prefiltro por caja (bounding box) en SQL con el indice (lat, lon) y despues
+  ranking exacto con Haversine solo sobre los candidatos
+- Cache LRU acotada por celda geohash del origen: todos los usuarios de la misma zona
+  comparten la consulta a SQLite. Para que la respuesta siga siendo exacta para cada
+  origen, la cache guarda los candidatos de la celda ampliados con el tamano de la celda
+  (delta) y el ranking final se calcula con el origen real.
+- La cache se vacia sola cuando cambia reciclaje.db (se regenera al actualizar los puntos)
+- Busqueda por texto (nombre, calle, municipio) con el indice FTS5 'puntos_fts', combinada
+  con la misma busqueda por cajas para ordenar por distancia (sin cache)
+"""
+
+import os
+import re
+import math
+import sqlite3
+import threading
+from collections import OrderedDict
+from descarga_puntos import preparar_puntos
+
+# ============== CONFIGURACION ==============
+PRECISION_GEOHASH = 6  # celdas de ~1.2 x 0.6 km
+CAPACIDAD_CACHE = 1024  # celdas guardadas como maximo
+RADIO_INICIAL_KM = 1.0  # primera caja de la busqueda sin radio (se duplica hasta encontrar)
+MAX_COINCIDENCIAS_DIRECTAS = 1000  # busquedas de texto con menos resultados: sin cajas
+RADIO_TIERRA_KM = 6371.0
+MEDIA_VUELTA_KM = math.pi * RADIO_TIERRA_KM
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def distancia_km(lat1, lon1, lat2, lon2):
+    """Calcula la distancia en km entre dos puntos usando la formula de Haversine."""
+    if None in (lat1, lon1, lat2, lon2):
+        return None
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = math.radians(lat2 - lat1)
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * RADIO_TIERRA_KM * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+# ============== GEOHASH ==============
+def geohash(lat, lon, precision=PRECISION_GEOHASH):
+    lat_rango, lon_rango = [-90.0, 90.0], [-180.0, 180.0]
+    resultado, bits, valor, par = [], 0, 0, True
+    while len(resultado) < precision:
+        rango, x = (lon_rango, lon) if par else (lat_rango, lat)
+        medio = (rango[0] + rango[1]) / 2
+        valor <<= 1
+        if x >= medio:
+            valor |= 1
+            rango[0] = medio
+        else:
+            rango[1] = medio
+        par = not par
+        bits += 1
+        if bits == 5:
+            resultado.append(_BASE32[valor])
+            bits, valor = 0, 0
+    return ''.join(resultado)
+
+
+def celda_geohash(codigo):
+    """(lat_min, lat_max, lon_min, lon_max) de la celda"""
+    lat_rango, lon_rango = [-90.0, 90.0], [-180.0, 180.0]
+    par = True
+    for c in codigo:
+        valor = _BASE32.index(c)
+        for desplazamiento in range(4, -1, -1):
+            rango = lon_rango if par else lat_rango
+            medio = (rango[0] + rango[1]) / 2
+            if valor >> desplazamiento & 1:
+                rango[0] = medio
+            else:
+                rango[1] = medio
+            par = not par
+    return lat_rango[0], lat_rango[1], lon_rango[0], lon_rango[1]
+
+
+# ============== CACHE ==============
+class CacheLRU:
+    """Diccionario acotado que descarta la entrada usada hace mas tiempo (seguro entre hilos)"""
+    def __init__(self, capacidad=CAPACIDAD_CACHE):
+        self.capacidad = capacidad
+        self.datos = OrderedDict()
+        self.lock = threading.Lock()
+
+    def obtener(self, clave):
+        with self.lock:
+            if clave not in self.datos:
+                return None
+            self.datos.move_to_end(clave)
+            return self.datos[clave]
+
+    def guardar(self, clave, valor):
+        with self.lock:
+            self.datos[clave] = valor
+            self.datos.move_to_end(clave)
+            while len(self.datos) > self.capacidad:
+                self.datos.popitem(last=False)
+
+    def vaciar(self):
+        with self.lock:
+            self.datos.clear()
+
+
+# ============== BUSQUEDA ==============
+def _caja(lat, lon, radio_km):
+    """Rectangulo lat/lon que contiene el circulo de radio_km"""
+    dlat = math.degrees(radio_km / RADIO_TIERRA_KM)
+    lat_min, lat_max = max(-90.0, lat - dlat), min(90.0, lat + dlat)
+    coseno = math.cos(math.radians(max(abs(lat_min), abs(lat_max))))
+    if coseno < 1e-6 or radio_km >= MEDIA_VUELTA_KM:
+        return lat_min, lat_max, -180.0, 180.0
+    dlon = math.degrees(radio_km / (RADIO_TIERRA_KM * coseno))
+    if dlon >= 180 or lon - dlon < -180 or lon + dlon > 180:
+        # Cruza el antimeridiano: sin filtro de longitud
+        return lat_min, lat_max, -180.0, 180.0
+    return lat_min, lat_max, lon - dlon, lon + dlon
+
+
+def expresion_fts(texto):
+    """
+    Texto del usuario -> consulta FTS5: todas las palabras, cada una como prefijo
+    ('calle alcal' -> '"calle"* AND "alcal"*'). None si no hay ninguna palabra.
+    """
+    palabras = re.findall(r'\w+', texto or '')
+    if not palabras:
+        return None
+    return ' AND '.join(f'"{p}"*' for p in palabras)
+
+
+def _puntos_en_caja(conn, caja, consulta=None):
+    if consulta is None:
+        return conn.execute('''
+            SELECT nombre, direccion, municipio, lat, lon, tipo
+            FROM puntos_reciclaje
+            WHERE lat BETWEEN ? AND ? AND lon BETWEEN ? AND ?
+        ''', caja).fetchall()
+    # Rango del indice (lat, lon) y los ids que encajan con el texto como lista calculada
+    # una vez ('+id' evita que SQLite busque por id todas las coincidencias)
+    return conn.execute('''
+        SELECT nombre, direccion, municipio, lat, lon, tipo
+        FROM puntos_reciclaje
+        WHERE lat BETWEEN ? AND ? AND lon BETWEEN ? AND ?
+          AND +id IN (SELECT rowid FROM puntos_fts WHERE puntos_fts MATCH ?)
+    ''', (*caja, consulta)).fetchall()
+
+
+def _en_radio(filas, lat, lon, radio_km):
+    return [f for f in filas if distancia_km(lat, lon, f[3], f[4]) <= radio_km]
+
+
+def candidatos(conn, lat, lon, radio_km=None, limite=10, margen_km=0.0, consulta=None):
+    """
+    Puntos que pueden estar entre los resultados de cualquier origen a menos de
+    margen_km de (lat, lon): todos los de radio_km + margen, o sin radio, los que
+    estan a menos de d_k + 2*margen (d_k = distancia al limite-esimo mas cercano).
+    Con 'consulta' (expresion FTS5) solo se tienen en cuenta los puntos que encajan.
+    """
+    if radio_km is not None:
+        alcance = radio_km + margen_km
+        return _en_radio(_puntos_en_caja(conn, _caja(lat, lon, alcance), consulta), lat, lon, alcance)
+
+    # Sin radio: ampliar la caja hasta que contenga 'limite' puntos dentro del circulo
+    radio = RADIO_INICIAL_KM
+    while True:
+        dentro = _en_radio(_puntos_en_caja(conn, _caja(lat, lon, radio), consulta), lat, lon, radio)
+        if len(dentro) >= limite or radio >= MEDIA_VUELTA_KM:
+            break
+        radio *= 2
+    if not dentro:
+        return []
+    distancias = sorted(distancia_km(lat, lon, f[3], f[4]) for f in dentro)
+    alcance = distancias[min(limite, len(distancias)) - 1] + 2 * margen_km
+    if alcance <= radio:
+        return _en_radio(dentro, lat, lon, alcance)
+    return _en_radio(_puntos_en_caja(conn, _caja(lat, lon, alcance), consulta), lat, lon, alcance)
+
+
+class BuscadorPuntos:
+    """Puntos de reciclaje mas cercanos a un origen, con cache por celda geohash"""
+    def __init__(self, db_file, precision=PRECISION_GEOHASH, capacidad=CAPACIDAD_CACHE, metricas=None):
+        self.db_file = db_file
+        self.precision = precision
+        self.cache = CacheLRU(capacidad)
+        self.metricas = metricas
+        self.version_bd = None
+
+    def _comprobar_version(self):
+        """Vaciar la cache si reciclaje.db ha cambiado (puntos actualizados)"""
+        version = os.stat(self.db_file).st_mtime_ns
+        if version != self.version_bd:
+            conn = sqlite3.connect(self.db_file)
+            try:
+                preparar_puntos(conn)  # BD antigua sin la columna 'tipo'
+            finally:
+                conn.close()
+            self.cache.vaciar()
+            self.version_bd = os.stat(self.db_file).st_mtime_ns
+
+    def _candidatos_celda(self, celda, radio_km, limite, conectar):
+        # Con radio los candidatos no dependen del limite
+        clave = (celda, radio_km, None if radio_km is not None else limite)
+        entrada = self.cache.obtener(clave)
+        if self.metricas:
+            self.metricas.contar_cache('puntos_reciclaje', entrada is not None)
+        if entrada is not None:
+            return entrada
+
+        lat_min, lat_max, lon_min, lon_max = celda_geohash(celda)
+        lat_c, lon_c = (lat_min + lat_max) / 2, (lon_min + lon_max) / 2
+        # Distancia maxima del centro de la celda a cualquier origen dentro de ella
+        margen = max(distancia_km(lat_c, lon_c, la, lo) for la in (lat_min, lat_max) for lo in (lon_min, lon_max))
+
+        conn = conectar(self.db_file)
+        try:
+            filas = candidatos(conn, lat_c, lon_c, radio_km, limite, margen)
+            total = None
+            if radio_km is None:
+                total = conn.execute(
+                    'SELECT COUNT(*) FROM puntos_reciclaje WHERE lat IS NOT NULL AND lon IS NOT NULL'
+                ).fetchone()[0]
+        finally:
+            conn.close()
+        entrada = ([tuple(f) for f in filas], total)
+        self.cache.guardar(clave, entrada)
+        return entrada
+
+    def _candidatos_texto(self, lat, lon, radio_km, limite, consulta, conectar):
+        conn = conectar(self.db_file)
+        try:
+            total = conn.execute(
+                'SELECT COUNT(*) FROM puntos_fts WHERE puntos_fts MATCH ?', (consulta,)
+            ).fetchone()[0]
+            if total <= MAX_COINCIDENCIAS_DIRECTAS:
+                # Pocas coincidencias: se ordenan todas directamente
+                filas = conn.execute('''
+                    SELECT nombre, direccion, municipio, lat, lon, tipo
+                    FROM puntos_reciclaje
+                    WHERE id IN (SELECT rowid FROM puntos_fts WHERE puntos_fts MATCH ?)
+                      AND lat IS NOT NULL AND lon IS NOT NULL
+                ''', (consulta,)).fetchall()
+            else:
+                filas = candidatos(conn, lat, lon, radio_km, limite, consulta=consulta)
+        finally:
+            conn.close()
+        return filas, total
+
+    def buscar(self, lat, lon, radio_km=None, limite=10, conectar=sqlite3.connect, consulta=None):
+        """
+        Devuelve (puntos, total): los 'limite' puntos mas cercanos a (lat, lon) como
+        diccionarios con distancia_km, y el total de puntos (dentro del radio, si se da).
+        Con 'consulta' (ver expresion_fts) solo los que encajan con el texto, sin cache.
+        """
+        self._comprobar_version()
+        if consulta is not None:
+            filas, total = self._candidatos_texto(lat, lon, radio_km, limite, consulta, conectar)
+        else:
+            filas, total = self._candidatos_celda(geohash(lat, lon, self.precision), radio_km, limite, conectar)
+
+        puntos = []
+        for nombre, direccion, municipio, p_lat, p_lon, tipo in filas:
+            d = distancia_km(lat, lon, p_lat, p_lon)
+            if radio_km is None or d <= radio_km:
+                puntos.append({
+                    'nombre': nombre,
+                    'direccion': direccion,
+                    'municipio': municipio,
+                    'tipo': tipo,
+                    'lat': p_lat,
+                    'lon': p_lon,
+                    'distancia_km': d
+                })
+        puntos.sort(key=lambda x: x['distancia_km'])
+        if radio_km is not None:
+            total = len(puntos)
+        for p in puntos:
+            p['distancia_km'] = round(p['distancia_km'], 2)
+        return puntos[:limite], total
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Reconciliacion de 'estadisticas' con 'depositos'
+'estadisticas' se mantiene con contadores (total_depositos + 1, kg_total + kg) al guardar
+cada deposito. Si se corrige o borra un deposito, o algo escribe solo una de las dos
+tablas, los contadores se desvian y nada los repara. Aqui se recalculan a partir de
+'depositos' (mas los resumenes mensuales de los depositos archivados, ver retencion.py),
+usuario a usuario:
+
+- incremental: solo los usuarios con depositos nuevos desde la ultima pasada (marca de
+  agua sobre depositos.id) o con depositos modificados/borrados (los anotan triggers en
+  'estadisticas_pendientes'). Cada usuario se recalcula con el indice (uid, kg_estimado).
+- completo: todos los usuarios, en lotes de LOTE_USUARIOS con una transaccion corta cada
+  uno (la papelera puede seguir guardando entre lotes) y verificacion final de totales.
+
+Uso:
+    python papelera_cli.py reconcile [--completo] [--lote 500]
+"""
+
+import sqlite3
+from retencion import preparar_retencion
+from marcas_tiempo import ahora_ms
+
+# ============== CONFIGURACION ==============
+LOTE_USUARIOS = 500  # usuarios recalculados por transaccion
+TOLERANCIA_KG = 1e-6  # diferencia de kg que se considera redondeo
+MARCA = 'estadisticas'
+
+
+def preparar_reconciliacion(conn):
+    """Indice por usuario, tabla de pendientes, triggers y marca de agua (idempotente)"""
+    preparar_retencion(conn)
+    conn.executescript('''
+        CREATE INDEX IF NOT EXISTS idx_depositos_uid ON depositos(uid, kg_estimado);
+
+        CREATE TABLE IF NOT EXISTS estadisticas_pendientes (
+            uid INTEGER PRIMARY KEY
+        );
+
+        CREATE TABLE IF NOT EXISTS reconciliacion_marcas (
+            nombre TEXT PRIMARY KEY,
+            ultimo_id INTEGER NOT NULL DEFAULT 0,
+            ultima_ejecucion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+
+        CREATE TRIGGER IF NOT EXISTS trg_depositos_modificado
+        AFTER UPDATE OF uid, kg_estimado ON depositos
+        BEGIN
+            INSERT OR IGNORE INTO estadisticas_pendientes (uid) VALUES (OLD.uid);
+            INSERT OR IGNORE INTO estadisticas_pendientes (uid) VALUES (NEW.uid);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_depositos_borrado
+        AFTER DELETE ON depositos
+        BEGIN
+            INSERT OR IGNORE INTO estadisticas_pendientes (uid) VALUES (OLD.uid);
+        END;
+    ''')
+
+
+def abrir_bd(db_file):
+    """Conexion en modo autocommit: las transacciones se abren a mano por lote"""
+    conn = sqlite3.connect(db_file, isolation_level=None, timeout=30)
+    preparar_reconciliacion(conn)
+    return conn
+
+
+def _reconciliar_uids(conn, uids):
+    """
+    Recalcula las estadisticas de 'uids' en una transaccion de escritura.
+    Devuelve el numero de usuarios corregidos.
+    """
+    if not uids:
+        return 0
+    marcadores = ', '.join('?' for _ in uids)
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        # Depositos en la BD principal + los ya archivados (resumen mensual)
+        reales = {
+            uid: (n, kg) for uid, n, kg in conn.execute(f'''
+                SELECT uid, SUM(n), TOTAL(kg) FROM (
+                    SELECT uid, COUNT(*) AS n, TOTAL(kg_estimado) AS kg
+                    FROM depositos
+                    WHERE uid IN ({marcadores})
+                    GROUP BY uid
+                    UNION ALL
+                    SELECT uid, SUM(depositos), TOTAL(kg)
+                    FROM depositos_mensual
+                    WHERE uid IN ({marcadores})
+                    GROUP BY uid
+                )
+                GROUP BY uid
+            ''', uids + uids)
+        }
+        actuales = {
+            uid: (n, kg) for uid, n, kg in conn.execute(f'''
+                SELECT uid, total_depositos, kg_total
+                FROM estadisticas
+                WHERE uid IN ({marcadores})
+            ''', uids)
+        }
+
+        corregidos = 0
+        for uid in uids:
+            n, kg = reales.get(uid, (0, 0.0))
+            actual = actuales.get(uid)
+            if actual is None:
+                if not n:
+                    continue
+                conn.execute('''
+                    INSERT INTO estadisticas (uid, nombre, total_depositos, kg_total)
+                    SELECT ?, (SELECT nombre FROM usuarios WHERE uid = ?), ?, ?
+                ''', (uid, uid, n, kg))
+                corregidos += 1
+            elif actual[0] != n or abs((actual[1] or 0.0) - kg) > TOLERANCIA_KG:
+                conn.execute('''
+                    UPDATE estadisticas
+                    SET total_depositos = ?, kg_total = ?, ultima_actualizacion = ?
+                    WHERE uid = ?
+                ''', (n, kg, ahora_ms(), uid))
+                corregidos += 1
+
+        conn.execute(f'DELETE FROM estadisticas_pendientes WHERE uid IN ({marcadores})', uids)
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return corregidos
+
+
+def _guardar_marca(conn, ultimo_id):
+    conn.execute('''
+        INSERT INTO reconciliacion_marcas (nombre, ultimo_id) VALUES (?, ?)
+        ON CONFLICT(nombre) DO UPDATE SET
+            ultimo_id = MAX(ultimo_id, excluded.ultimo_id),
+            ultima_ejecucion = CURRENT_TIMESTAMP
+    ''', (MARCA, ultimo_id))
+
+
+def reconciliar(conn, lote=LOTE_USUARIOS):
+    """Pasada incremental. Devuelve {'usuarios': revisados, 'corregidos': n, 'ultimo_id': marca}"""
+    fila = conn.execute('SELECT ultimo_id FROM reconciliacion_marcas WHERE nombre = ?', (MARCA,)).fetchone()
+    desde = fila[0] if fila else 0
+    hasta = conn.execute('SELECT COALESCE(MAX(id), 0) FROM depositos').fetchone()[0]
+
+    uids = [uid for (uid,) in conn.execute('''
+        SELECT DISTINCT uid FROM depositos WHERE id > ? AND id <= ?
+        UNION
+        SELECT uid FROM estadisticas_pendientes
+        ORDER BY uid
+    ''', (desde, hasta))]
+
+    corregidos = 0
+    for i in range(0, len(uids), lote):
+        corregidos += _reconciliar_uids(conn, uids[i:i + lote])
+    _guardar_marca(conn, hasta)
+    return {'usuarios': len(uids), 'corregidos': corregidos, 'ultimo_id': hasta}
+
+
+def reconstruir(conn, lote=LOTE_USUARIOS):
+    """
+    Recalcula todos los usuarios en lotes por uid y verifica los totales al final.
+    Devuelve {'usuarios', 'corregidos', 'ultimo_id', 'verificado'}.
+    """
+    hasta = conn.execute('SELECT COALESCE(MAX(id), 0) FROM depositos').fetchone()[0]
+    usuarios = corregidos = 0
+    ultimo_uid = -1
+    while True:
+        # Siguientes uids de cualquiera de las dos tablas (ambas recorridas por indice)
+        uids = sorted({uid for (uid,) in conn.execute('''
+            SELECT uid FROM (SELECT uid FROM estadisticas WHERE uid > ? ORDER BY uid LIMIT ?)
+            UNION
+            SELECT uid FROM (SELECT DISTINCT uid FROM depositos WHERE uid > ? ORDER BY uid LIMIT ?)
+        ''', (ultimo_uid, lote, ultimo_uid, lote))})[:lote]
+        if not uids:
+            break
+        corregidos += _reconciliar_uids(conn, uids)
+        usuarios += len(uids)
+        ultimo_uid = uids[-1]
+
+    _guardar_marca(conn, hasta)
+    return {'usuarios': usuarios, 'corregidos': corregidos, 'ultimo_id': hasta,
+            'verificado': verificar(conn)}
+
+
+def verificar(conn):
+    """Compara los totales de 'estadisticas' y 'depositos' en un mismo snapshot"""
+    conn.execute('BEGIN')
+    try:
+        total_depositos, total_kg = conn.execute('''
+            SELECT (SELECT COUNT(*) FROM depositos) + (SELECT TOTAL(depositos) FROM depositos_mensual),
+                   (SELECT TOTAL(kg_estimado) FROM depositos) + (SELECT TOTAL(kg) FROM depositos_mensual)
+        ''').fetchone()
+        suma_depositos, suma_kg = conn.execute(
+            'SELECT TOTAL(total_depositos), TOTAL(kg_total) FROM estadisticas'
+        ).fetchone()
+    finally:
+        conn.execute('COMMIT')
+    return (int(suma_depositos) == int(total_depositos)
+            and abs(suma_kg - total_kg) <= TOLERANCIA_KG * max(1, total_depositos))
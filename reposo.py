@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Boton de la papelera y espera en reposo
+Con el boton suelto y sin nada en curso, la papelera entra en reposo: apaga la antena
+del lector RFID, deja de medir y de refrescar el LCD y duerme hasta que se pulsa el
+boton. Las papeleras de exterior van con placa solar y el bucle de 200 ms gastaba CPU
+(y la antena, corriente) sin nadie delante.
+
+- BotonGPIOD: el boton por la interfaz de caracteres de GPIO (libgpiod v2); el proceso
+  duerme en el kernel hasta el flanco y despierta en menos de 1 ms
+- BotonSondeo: el GPIO de Grove, consultado cada PERIODO_SONDEO (sin gpiod)
+
+Los dos tienen read() (como grove.gpio.GPIO) y esperar_pulsacion(timeout).
+"""
+
+import time
+from ultrasonido import importar_gpiod, CHIP_GPIO
+
+# ============== CONFIGURACION ==============
+PIN_BOTON = 5  # BCM, el mismo que GPIO(5, GPIO.IN)
+PERIODO_SONDEO = 0.02  # s entre lecturas del boton sin gpiod (despertar < 100 ms)
+
+
+class BotonGPIOD:
+    """Boton con deteccion de flancos en el kernel"""
+    def __init__(self, chip=CHIP_GPIO, pin=PIN_BOTON):
+        gpiod = importar_gpiod()
+        self.pin = pin
+        self.activo = gpiod.line.Value.ACTIVE
+        self.peticion = gpiod.request_lines(chip, consumer="papelera-boton", config={
+            pin: gpiod.LineSettings(direction=gpiod.line.Direction.INPUT, edge_detection=gpiod.line.Edge.BOTH)
+        })
+
+    def read(self):
+        return 1 if self.peticion.get_value(self.pin) == self.activo else 0
+
+    def _descartar_eventos(self):
+        while self.peticion.wait_edge_events(0):
+            self.peticion.read_edge_events()
+
+    def esperar_pulsacion(self, timeout):
+        """True en cuanto el boton esta pulsado; False si pasa 'timeout' sin pulsarlo"""
+        # Flancos acumulados mientras la papelera estaba en uso
+        self._descartar_eventos()
+        limite = time.monotonic() + timeout
+        while not self.read():
+            pendiente = limite - time.monotonic()
+            if pendiente <= 0 or not self.peticion.wait_edge_events(pendiente):
+                return False
+            self.peticion.read_edge_events()  # Puede ser un rebote: se vuelve a leer
+        return True
+
+    def cerrar(self):
+        self.peticion.release()
+
+
+class BotonSondeo:
+    """GPIO de Grove con la misma interfaz; la espera consulta el boton periodicamente"""
+    def __init__(self, gpio, periodo=PERIODO_SONDEO):
+        self.gpio = gpio
+        self.periodo = periodo
+
+    def read(self):
+        return self.gpio.read()
+
+    def esperar_pulsacion(self, timeout):
+        limite = time.monotonic() + timeout
+        while not self.gpio.read():
+            if time.monotonic() >= limite:
+                return False
+            time.sleep(self.periodo)
+        return True
+
+    def cerrar(self):
+        pass
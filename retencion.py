@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Retencion y archivo de depositos antiguos
+'depositos' crece sin limite en la tarjeta SD. Los meses completos anteriores a
+RETENCION_DIAS se mueven a archivos mensuales fuera de la BD principal:
+- 'sqlite': archivo/depositos_AAAA-MM.db, que se pueden adjuntar (ATTACH) para consultarlos
+- 'csv':    archivo/depositos_AAAA-MM.csv.gz
+
+En la BD principal quedan los totales por usuario ('estadisticas') y un resumen por mes
+y usuario ('depositos_mensual'), que usan los informes y la reconciliacion. Cada mes se
+archiva en su propia transaccion; repetir un archivado interrumpido no duplica filas.
+
+Para que el espacio liberado vuelva al sistema de ficheros sin un VACUUM completo, la BD
+usa auto_vacuum=INCREMENTAL y vacuum_incremental() libera paginas poco a poco.
+
+Uso:
+    python papelera_cli.py archive [--dias 180] [--formato sqlite|csv] [--vacuum 1000]
+"""
+
+import os
+import csv
+import gzip
+import sqlite3
+from datetime import date, timedelta
+from uid_tarjeta import uid_a_hex
+from marcas_tiempo import dia_a_ms, ms_a_iso
+
+# ============== CONFIGURACION ==============
+RETENCION_DIAS = 180  # los depositos mas recientes se quedan en la BD principal
+DIRECTORIO_ARCHIVO = "archivo"
+PAGINAS_VACUUM = 1000  # paginas liberadas por cada vacuum incremental
+
+COLUMNAS = ('id', 'uid', 'porcentaje_depositado', 'kg_estimado', 'nivel_final', 'fecha')
+
+
+def preparar_retencion(conn):
+    """Tablas de resumen mensual y catalogo de archivos (idempotente)"""
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS depositos_mensual (
+            mes TEXT NOT NULL,
+            uid INTEGER NOT NULL,
+            depositos INTEGER NOT NULL,
+            kg REAL NOT NULL,
+            PRIMARY KEY (mes, uid)
+        );
+
+        CREATE TABLE IF NOT EXISTS archivos_depositos (
+            mes TEXT PRIMARY KEY,
+            ruta TEXT NOT NULL,
+            formato TEXT NOT NULL,
+            filas INTEGER NOT NULL DEFAULT 0,
+            ultimo_archivado TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    ''')
+
+
+def abrir_bd(db_file):
+    """Conexion en modo autocommit: cada mes se archiva en su propia transaccion"""
+    conn = sqlite3.connect(db_file, isolation_level=None, timeout=30)
+    preparar_retencion(conn)
+    return conn
+
+
+def limite_retencion(dias=RETENCION_DIAS, hoy=None):
+    """Primer dia del mes que contiene hoy - dias: se archivan solo meses completos"""
+    return ((hoy or date.today()) - timedelta(days=dias)).replace(day=1)
+
+
+def _siguiente_mes(mes):
+    anio, m = map(int, mes.split('-'))
+    return f"{anio + m // 12:04d}-{m % 12 + 1:02d}"
+
+
+def rango_mes(mes):
+    """'2024-01' -> [desde_ms, hasta_ms) del mes (UTC)"""
+    return dia_a_ms(f"{mes}-01"), dia_a_ms(f"{_siguiente_mes(mes)}-01")
+
+
+def meses_a_archivar(conn, limite):
+    return [mes for (mes,) in conn.execute('''
+        SELECT DISTINCT strftime('%Y-%m', fecha / 1000, 'unixepoch') FROM depositos
+        WHERE fecha < ?
+        ORDER BY 1
+    ''', (dia_a_ms(limite),))]
+
+
+# ============== ARCHIVADO ==============
+def _resumir_y_borrar(conn, mes, desde, hasta):
+    """Suma el mes al resumen mensual y lo borra de la BD principal (dentro de la transaccion)"""
+    conn.execute('''
+        INSERT INTO depositos_mensual (mes, uid, depositos, kg)
+        SELECT ?, uid, COUNT(*), TOTAL(kg_estimado)
+        FROM depositos
+        WHERE fecha >= ? AND fecha < ?
+        GROUP BY uid
+        ON CONFLICT(mes, uid) DO UPDATE SET
+            depositos = depositos + excluded.depositos,
+            kg = kg + excluded.kg
+    ''', (mes, desde, hasta))
+    return conn.execute('DELETE FROM depositos WHERE fecha >= ? AND fecha < ?', (desde, hasta)).rowcount
+
+
+def _registrar_archivo(conn, mes, ruta, formato, filas):
+    conn.execute('''
+        INSERT INTO archivos_depositos (mes, ruta, formato, filas) VALUES (?, ?, ?, ?)
+        ON CONFLICT(mes) DO UPDATE SET
+            filas = filas + excluded.filas,
+            ultimo_archivado = CURRENT_TIMESTAMP
+    ''', (mes, ruta, formato, filas))
+
+
+def _archivar_mes_sqlite(conn, mes, directorio):
+    ruta = os.path.join(directorio, f"depositos_{mes}.db")
+    desde, hasta = rango_mes(mes)
+    conn.execute('ATTACH DATABASE ? AS archivo', (ruta,))
+    try:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS archivo.depositos (
+                id INTEGER PRIMARY KEY,
+                uid INTEGER NOT NULL,
+                porcentaje_depositado INTEGER NOT NULL,
+                kg_estimado REAL NOT NULL,
+                nivel_final INTEGER NOT NULL,
+                fecha INTEGER
+            )
+        ''')
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # OR IGNORE: si un archivado anterior se corto tras escribir el archivo, no duplica
+            conn.execute(f'''
+                INSERT OR IGNORE INTO archivo.depositos ({', '.join(COLUMNAS)})
+                SELECT {', '.join(COLUMNAS)} FROM main.depositos
+                WHERE fecha >= ? AND fecha < ?
+            ''', (desde, hasta))
+            filas = _resumir_y_borrar(conn, mes, desde, hasta)
+            _registrar_archivo(conn, mes, ruta, 'sqlite', filas)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    finally:
+        conn.execute('DETACH DATABASE archivo')
+    return filas
+
+
+def _ids_en_csv(ruta):
+    if not os.path.exists(ruta):
+        return set()
+    with gzip.open(ruta, 'rt', encoding='utf-8', newline='') as f:
+        return {int(fila[0]) for fila in csv.reader(f) if fila and fila[0] != 'id'}
+
+
+def _archivar_mes_csv(conn, mes, directorio):
+    ruta = os.path.join(directorio, f"depositos_{mes}.csv.gz")
+    desde, hasta = rango_mes(mes)
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        filas = conn.execute(f'''
+            SELECT {', '.join(COLUMNAS)} FROM depositos
+            WHERE fecha >= ? AND fecha < ?
+            ORDER BY id
+        ''', (desde, hasta)).fetchall()
+
+        # Cada archivado anade un miembro gzip; las filas ya escritas (archivado cortado) se saltan
+        ya_archivados = _ids_en_csv(ruta)
+        nuevo = not os.path.exists(ruta)
+        with gzip.open(ruta, 'at', encoding='utf-8', newline='') as f:
+            escritor = csv.writer(f, lineterminator="\n")
+            if nuevo:
+                escritor.writerow(COLUMNAS)
+            escritor.writerows(
+                (id_, uid_a_hex(uid), porcentaje, kg, nivel, ms_a_iso(fecha))
+                for id_, uid, porcentaje, kg, nivel, fecha in filas if id_ not in ya_archivados
+            )
+            f.flush()
+            os.fsync(f.fileno())
+
+        borradas = _resumir_y_borrar(conn, mes, desde, hasta)
+        _registrar_archivo(conn, mes, ruta, 'csv', borradas)
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return borradas
+
+
+def archivar(conn, dias=RETENCION_DIAS, directorio=DIRECTORIO_ARCHIVO, formato='sqlite', hoy=None):
+    """Archiva los meses completos anteriores al limite. Devuelve {mes: filas}"""
+    os.makedirs(directorio, exist_ok=True)
+    archivar_mes = _archivar_mes_csv if formato == 'csv' else _archivar_mes_sqlite
+    resultado = {}
+    for mes in meses_a_archivar(conn, limite_retencion(dias, hoy)):
+        resultado[mes] = archivar_mes(conn, mes, directorio)
+    return resultado
+
+
+# ============== CONSULTAS SOBRE EL ARCHIVO ==============
+def adjuntar_archivos(conn, meses=None):
+    """
+    Adjunta los archivos SQLite de 'meses' (por defecto todos, hasta el limite de ATTACH)
+    y crea la vista temporal 'depositos_historico' = depositos + archivos adjuntos.
+    Devuelve los meses adjuntados.
+    """
+    disponibles = conn.execute(
+        "SELECT mes, ruta FROM archivos_depositos WHERE formato = 'sqlite' ORDER BY mes"
+    ).fetchall()
+    if meses is not None:
+        disponibles = [(mes, ruta) for mes, ruta in disponibles if mes in meses]
+    limite = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED) if hasattr(conn, 'getlimit') else 10
+    disponibles = disponibles[-limite:]
+
+    partes = [f"SELECT {', '.join(COLUMNAS)} FROM main.depositos"]
+    # Los archivos anteriores a las fechas en milisegundos guardan la fecha en texto
+    columnas = ', '.join(COLUMNAS[:-1]) + (
+        ", CASE WHEN typeof(fecha) = 'text' "
+        "THEN CAST(ROUND((julianday(fecha) - 2440587.5) * 86400000) AS INTEGER) ELSE fecha END AS fecha"
+    )
+    for mes, ruta in disponibles:
+        alias = f"archivo_{mes.replace('-', '_')}"
+        conn.execute('ATTACH DATABASE ? AS ' + alias, (ruta,))
+        partes.append(f"SELECT {columnas} FROM {alias}.depositos")
+    conn.execute('DROP VIEW IF EXISTS temp.depositos_historico')
+    conn.execute('CREATE TEMP VIEW depositos_historico AS ' + ' UNION ALL '.join(partes))
+    return [mes for mes, _ in disponibles]
+
+
+# ============== VACUUM INCREMENTAL ==============
+def vacuum_incremental(conn, paginas=PAGINAS_VACUUM):
+    """
+    Devuelve al sistema de ficheros hasta 'paginas' paginas libres.
+    La primera vez, si la BD no tiene auto_vacuum=INCREMENTAL, hace un VACUUM completo
+    para activarlo. Devuelve las paginas libres que quedan.
+    """
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('VACUUM')
+    conn.execute(f'PRAGMA incremental_vacuum({int(paginas)})').fetchall()
+    return conn.execute('PRAGMA freelist_count').fetchone()[0]
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Maquina de estados de las sesiones de tarjeta RFID
+Sustituye a las ramas anidadas de ejecutar() con un estado explicito, alimentado por
+eventos con marca de tiempo (boton, lectura RFID, inicio/fin de escritura en BD):
+
+    INACTIVO    -- boton pulsado -->            ESPERANDO
+    ESPERANDO   -- N lecturas del mismo UID --> ACTIVA
+    ACTIVA      -- sin lecturas > timeout -->   ESPERANDO (tarjeta retirada)
+    ACTIVA      -- deposito detectado -->       REGISTRANDO
+    REGISTRANDO -- escritura + mensaje -->      ACTIVA (misma tarjeta o la de la cola) / ESPERANDO
+
+Mientras se escribe el deposito de un usuario, la tarjeta de otro queda en cola y
+pasa a ser la activa en cuanto termina la escritura.
+No depende del hardware: se puede probar pasando tiempos y UIDs a mano.
+"""
+
+# ============== CONFIGURACION ==============
+LECTURAS_DEBOUNCE = 1  # lecturas consecutivas del mismo UID para aceptar una tarjeta
+TIMEOUT_PERDIDA = 1.5  # segundos sin lectura para considerar la tarjeta retirada
+TIEMPO_GRACIA = 3.0  # segundos tras retirarla en los que aun se le atribuye un deposito
+TIEMPO_MENSAJE = 2.0  # segundos minimos mostrando "Registrado!"
+
+INACTIVO = 'inactivo'
+ESPERANDO = 'esperando'
+ACTIVA = 'activa'
+REGISTRANDO = 'registrando'
+
+
+class SesionTarjetas:
+    def __init__(self, lecturas_debounce=LECTURAS_DEBOUNCE, timeout_perdida=TIMEOUT_PERDIDA,
+                 tiempo_gracia=TIEMPO_GRACIA, tiempo_mensaje=TIEMPO_MENSAJE):
+        self.lecturas_debounce = lecturas_debounce
+        self.timeout_perdida = timeout_perdida
+        self.tiempo_gracia = tiempo_gracia
+        self.tiempo_mensaje = tiempo_mensaje
+
+        self.estado = INACTIVO
+        self.presionado = False
+        self.uid = None  # Tarjeta activa (o cuyo deposito se esta registrando)
+        self.ultima_lectura = 0.0
+        self.anterior = None  # (uid, t) ultima tarjeta retirada, para el tiempo de gracia
+        self.siguiente = None  # Tarjeta en cola mientras se registra
+        self.candidato = None  # (uid, lecturas) pendiente de debounce
+        self.escrituras_pendientes = 0  # Depositos encolados y aun sin escribir
+        self.fin_mensaje = 0.0
+        self.eventos = []  # [(tipo, uid)] para que el bucle actualice consola/LCD
+
+    def _emitir(self, tipo, uid):
+        self.eventos.append((tipo, uid))
+
+    def eventos_pendientes(self):
+        eventos, self.eventos = self.eventos, []
+        return eventos
+
+    # ============== EVENTOS ==============
+    def boton(self, t, presionado):
+        self.presionado = presionado
+        if presionado:
+            if self.estado == INACTIVO:
+                self.estado = ESPERANDO
+            return
+        if self.estado == ACTIVA:
+            self._emitir('cancelada', self.uid)
+            self.uid = None
+        if self.estado != REGISTRANDO:
+            # Si hay una escritura en curso se termina; tick() decidira el estado
+            self.estado = INACTIVO
+        self.anterior = None
+        self.siguiente = None
+        self.candidato = None
+
+    def lectura(self, t, uid):
+        """Resultado de una lectura RFID (uid o None)"""
+        if self.estado == INACTIVO or uid is None:
+            return
+
+        if uid == self.uid:
+            self.ultima_lectura = t
+            self.candidato = None
+            return
+
+        # Debounce: el mismo UID en N lecturas consecutivas
+        if self.candidato and self.candidato[0] == uid:
+            self.candidato = (uid, self.candidato[1] + 1)
+        else:
+            self.candidato = (uid, 1)
+        if self.candidato[1] < self.lecturas_debounce:
+            return
+        self.candidato = None
+
+        if self.estado == REGISTRANDO:
+            if self.siguiente != uid:
+                self.siguiente = uid
+                self._emitir('en_cola', uid)
+            return
+
+        if self.estado == ACTIVA:
+            self._emitir('retirada', self.uid)
+            self.anterior = (self.uid, t)
+        self._activar(t, uid)
+
+    def inicio_registro(self, t, uid):
+        """El bucle ha encolado la escritura del deposito de uid"""
+        if self.estado in (ACTIVA, REGISTRANDO) and self.uid and uid != self.uid:
+            self.anterior = (self.uid, t)
+        if uid == self.siguiente:
+            # Deposito de la tarjeta en cola: pasa a ser la que se registra
+            self.siguiente = None
+        self.estado = REGISTRANDO
+        self.uid = uid
+        self.escrituras_pendientes += 1
+        self.fin_mensaje = t + self.tiempo_mensaje
+
+    def fin_registro(self, t):
+        """Una de las escrituras en BD ha terminado"""
+        self.escrituras_pendientes = max(0, self.escrituras_pendientes - 1)
+
+    def tick(self, t):
+        """Timeouts: tarjeta retirada y fin del registro"""
+        if self.estado == ACTIVA and t - self.ultima_lectura > self.timeout_perdida:
+            self._emitir('retirada', self.uid)
+            self.anterior = (self.uid, t)
+            self.uid = None
+            self.estado = ESPERANDO
+
+        elif self.estado == REGISTRANDO and not self.escrituras_pendientes and t >= self.fin_mensaje:
+            if not self.presionado:
+                self.uid = None
+                self.estado = INACTIVO
+            elif self.siguiente:
+                uid, self.siguiente = self.siguiente, None
+                self.anterior = (self.uid, t)
+                self._activar(t, uid)
+            elif self.uid and t - self.ultima_lectura <= self.timeout_perdida:
+                # La misma tarjeta sigue presente: puede seguir depositando
+                self.estado = ACTIVA
+            else:
+                self.anterior = (self.uid, t) if self.uid else None
+                self.uid = None
+                self.estado = ESPERANDO
+
+    def _activar(self, t, uid):
+        self.uid = uid
+        self.ultima_lectura = t
+        self.estado = ACTIVA
+        self._emitir('nueva', uid)
+
+    # ============== CONSULTAS ==============
+    def atribuir(self, t):
+        """
+        Tarjeta a la que se atribuye un deposito detectado ahora (o None). Durante un
+        registro, la tarjeta en cola; inicio_registro() la saca de la cola.
+        """
+        if self.estado == REGISTRANDO:
+            return self.siguiente or self.uid
+        if self.estado == ACTIVA:
+            return self.uid
+        if self.anterior and t - self.anterior[1] <= self.tiempo_gracia:
+            return self.anterior[0]
+        return None
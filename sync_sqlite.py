@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Sincronizacion incremental de las bases de datos de la papelera
+Alternativa multiplataforma a sync_sqlite.ps1: en lugar de copiar el .db entero con scp,
+solo transfiere las filas nuevas o modificadas desde la ultima sincronizacion.
+
+Uso:
+    python sync_sqlite.py ORIGEN DESTINO
+        ORIGEN  carpeta local o remota (usuario@host:/ruta) con los .db de la papelera
+        DESTINO carpeta local donde se mantienen las copias
+
+    python sync_sqlite.py ORIGEN DESTINO --completo
+        copia completa con la API de backup en linea de SQLite (solo origen local)
+
+Las marcas de agua se calculan a partir de la propia copia de destino, asi que no hace
+falta guardar estado aparte. Todas las lecturas del origen se hacen dentro de una unica
+transaccion de lectura, por lo que el cambio exportado es un snapshot consistente aunque
+el demonio este escribiendo.
+"""
+
+import os
+import re
+import sys
+import gzip
+import json
+import sqlite3
+import argparse
+import subprocess
+from datetime import datetime
+from uid_tarjeta import hex_a_uid, migrar_uids_enteros
+from marcas_tiempo import COLUMNAS_FECHA, iso_a_ms, migrar_fechas_ms
+from informes import preparar_ranking
+from descarga_puntos import preparar_puntos
+
+# ============== CONFIGURACION ==============
+BASES_DATOS = ["papelera_inteligente.db", "reciclaje.db"]
+SCRIPT_REMOTO = "/home/group2/Desktop/Laboratorios/sync_sqlite.py"
+
+# Tablas replicadas y como se detectan sus cambios:
+#   'rowid'  -> filas solo insertadas, marca = ultimo rowid copiado
+#   'fecha'  -> filas actualizadas in situ, marca = ultima fecha de actualizacion
+#   'espejo' -> tabla que se regenera por grupos (valores de la columna): cada grupo tiene
+#               una generacion (MIN(id), COUNT(*)); los grupos cuya generacion cambia se
+#               copian enteros y los que ya no existen en origen se borran
+TABLAS = {
+    "papelera_inteligente.db": {
+        # uid es la clave entera (= rowid) y no sigue el orden de alta: se usa la fecha
+        "usuarios": ("fecha", "fecha_registro"),
+        "depositos": ("rowid", "id"),
+        "estadisticas": ("fecha", "ultima_actualizacion"),
+    },
+    "reciclaje.db": {
+        "puntos_reciclaje": ("espejo", "tipo"),
+    },
+}
+
+
+def log(mensaje):
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print(f"[{timestamp}] {mensaje}", file=sys.stderr)
+
+
+def _generaciones(conn, tabla, columna):
+    """{grupo: [MIN(id), COUNT(*)]} de una tabla 'espejo'; cambia al regenerar el grupo"""
+    return {
+        grupo: [min_id, filas]
+        for grupo, min_id, filas in conn.execute(
+            f"SELECT {columna}, MIN(rowid), COUNT(*) FROM {tabla} GROUP BY {columna}"
+        )
+    }
+
+
+def _existe_tabla(conn, tabla):
+    fila = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (tabla,)
+    ).fetchone()
+    return fila is not None
+
+
+# ============== LADO ORIGEN ==============
+def exportar_cambios(origen_dir, marcas):
+    """
+    Lee del origen las filas posteriores a las marcas recibidas.
+    marcas: {db: {tabla: valor}}. Devuelve un diccionario serializable a JSON.
+    """
+    cambios = {}
+    for nombre_db, tablas in TABLAS.items():
+        ruta = os.path.join(origen_dir, nombre_db)
+        if not os.path.exists(ruta):
+            continue
+
+        conn = sqlite3.connect(f"file:{ruta}?mode=ro", uri=True, isolation_level=None)
+        try:
+            # Una sola transaccion de lectura para todas las tablas = snapshot consistente
+            conn.execute("BEGIN")
+            cambios_db = {}
+            for tabla, (modo, columna) in tablas.items():
+                if not _existe_tabla(conn, tabla):
+                    continue
+                marca = marcas.get(nombre_db, {}).get(tabla)
+
+                reemplazados = None
+                if modo == "fecha":
+                    sql = f"SELECT * FROM {tabla} WHERE ? IS NULL OR {columna} >= ?"
+                    params = (marca, marca)
+                elif modo == "espejo":
+                    destino = marca if isinstance(marca, dict) else {}
+                    generaciones = _generaciones(conn, tabla, columna)
+                    cambiados = [g for g, gen in generaciones.items() if destino.get(g) != gen]
+                    reemplazados = cambiados + [g for g in destino if g not in generaciones]
+                    # La lista de grupos cambiados se pasa como un unico parametro JSON
+                    sql = (f"SELECT * FROM {tabla} WHERE {columna} IN "
+                           f"(SELECT value FROM json_each(?)) ORDER BY rowid")
+                    params = (json.dumps(cambiados),)
+                else:
+                    # rowid no aparece en SELECT *, se pide explicitamente
+                    seleccion = "rowid, *" if columna == "rowid" else "*"
+                    sql = f"SELECT {seleccion} FROM {tabla} WHERE {columna} > ? ORDER BY {columna}"
+                    params = (marca or 0,)
+                cursor = conn.execute(sql, params)
+                columnas = [c[0] for c in cursor.description]
+                filas = cursor.fetchall()
+
+                esquema = conn.execute(
+                    "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (tabla,)
+                ).fetchone()[0]
+
+                entrada = {"esquema": esquema, "columnas": columnas, "filas": filas}
+                if reemplazados is not None:
+                    entrada["grupos"] = {"columna": columna, "reemplazados": reemplazados}
+                cambios_db[tabla] = entrada
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        cambios[nombre_db] = cambios_db
+    return cambios
+
+
+# ============== LADO DESTINO ==============
+def calcular_marcas(destino_dir):
+    """Obtiene las marcas de agua a partir de las copias ya existentes en destino"""
+    marcas = {}
+    for nombre_db, tablas in TABLAS.items():
+        ruta = os.path.join(destino_dir, nombre_db)
+        if not os.path.exists(ruta):
+            continue
+        conn = sqlite3.connect(ruta)
+        try:
+            # Copias antiguas con uid TEXT: migrar antes de comparar con el origen
+            migrar_uids_enteros(conn)
+            # ... y con fechas en texto: las marcas 'fecha' se comparan en milisegundos
+            migrar_fechas_ms(conn)
+            preparar_ranking(conn)
+            # Copias antiguas de puntos_reciclaje sin la columna 'tipo'
+            preparar_puntos(conn)
+            marcas_db = {}
+            for tabla, (modo, columna) in tablas.items():
+                if not _existe_tabla(conn, tabla):
+                    continue
+                if modo == "espejo":
+                    marcas_db[tabla] = _generaciones(conn, tabla, columna)
+                else:
+                    marcas_db[tabla] = conn.execute(f"SELECT MAX({columna}) FROM {tabla}").fetchone()[0]
+            marcas[nombre_db] = marcas_db
+        finally:
+            conn.close()
+    return marcas
+
+
+def aplicar_cambios(destino_dir, cambios):
+    """Aplica los cambios en destino, una transaccion por base de datos"""
+    os.makedirs(destino_dir, exist_ok=True)
+    resumen = {}
+    for nombre_db, tablas in cambios.items():
+        conn = sqlite3.connect(os.path.join(destino_dir, nombre_db))
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for tabla, entrada in tablas.items():
+                if not _existe_tabla(conn, tabla):
+                    conn.execute(entrada["esquema"])
+
+                columnas = entrada["columnas"]
+                filas = entrada["filas"]
+                if "grupos" in entrada:
+                    # Los grupos regenerados en origen se sustituyen enteros
+                    conn.executemany(
+                        f"DELETE FROM {tabla} WHERE {entrada['grupos']['columna']} = ?",
+                        [(grupo,) for grupo in entrada["grupos"]["reemplazados"]]
+                    )
+
+                if "uid" in columnas:
+                    # Origen aun sin migrar: UIDs en hexadecimal
+                    i = columnas.index("uid")
+                    filas = [
+                        fila[:i] + [hex_a_uid(fila[i])] + fila[i + 1:] if isinstance(fila[i], str) else fila
+                        for fila in map(list, filas)
+                    ]
+                if COLUMNAS_FECHA.get(tabla) in columnas:
+                    # Origen aun sin migrar: fechas en texto
+                    i = columnas.index(COLUMNAS_FECHA[tabla])
+                    filas = [
+                        fila[:i] + [iso_a_ms(fila[i])] + fila[i + 1:] if isinstance(fila[i], str) else fila
+                        for fila in map(list, filas)
+                    ]
+
+                marcadores = ", ".join("?" for _ in columnas)
+                conn.executemany(
+                    f"INSERT OR REPLACE INTO {tabla} ({', '.join(columnas)}) VALUES ({marcadores})",
+                    filas
+                )
+                resumen[f"{nombre_db}:{tabla}"] = len(filas)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+    return resumen
+
+
+def copia_completa(origen_dir, destino_dir):
+    """Copia consistente de cada BD con la API de backup en linea de SQLite"""
+    os.makedirs(destino_dir, exist_ok=True)
+    for nombre_db in BASES_DATOS:
+        ruta = os.path.join(origen_dir, nombre_db)
+        if not os.path.exists(ruta):
+            continue
+        origen = sqlite3.connect(f"file:{ruta}?mode=ro", uri=True)
+        destino = sqlite3.connect(os.path.join(destino_dir, nombre_db))
+        try:
+            origen.backup(destino)
+            log(f"Copia completa {nombre_db} completada")
+        finally:
+            destino.close()
+            origen.close()
+
+
+# ============== TRANSPORTE ==============
+def _es_remoto(origen):
+    """usuario@host:/ruta (sin confundir con una unidad de Windows como C:\\)"""
+    return re.match(r"^[^/\\@]+@[^:/\\]+:", origen) is not None
+
+
+def exportar_remoto(origen, marcas):
+    """Ejecuta la exportacion en la Raspberry por ssh y lee el cambio comprimido"""
+    host, ruta = origen.split(":", 1)
+    comando = ["ssh", host, "python3", SCRIPT_REMOTO, "--exportar", ruta,
+               "--marcas", "'" + json.dumps(marcas, separators=(",", ":")) + "'"]
+    salida = subprocess.run(comando, check=True, stdout=subprocess.PIPE).stdout
+    return json.loads(gzip.decompress(salida))
+
+
+def sincronizar(origen, destino_dir):
+    marcas = calcular_marcas(destino_dir)
+    if _es_remoto(origen):
+        cambios = exportar_remoto(origen, marcas)
+    else:
+        cambios = exportar_cambios(origen, marcas)
+
+    resumen = aplicar_cambios(destino_dir, cambios)
+    total = sum(resumen.values())
+    for tabla, n in resumen.items():
+        log(f"  {tabla}: {n} filas")
+    log(f"Sincronizacion completada: {total} filas transferidas")
+    return resumen
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sincronizacion incremental de las BD SQLite de la papelera")
+    parser.add_argument("origen", nargs="?", help="Carpeta origen (local o usuario@host:/ruta)")
+    parser.add_argument("destino", nargs="?", help="Carpeta destino local")
+    parser.add_argument("--completo", action="store_true", help="Copia completa con la API de backup")
+    parser.add_argument("--exportar", metavar="DIR", help=argparse.SUPPRESS)
+    parser.add_argument("--marcas", default="{}", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.exportar:
+        # Modo usado por ssh desde el equipo destino: cambio comprimido por stdout
+        cambios = exportar_cambios(args.exportar, json.loads(args.marcas))
+        sys.stdout.buffer.write(gzip.compress(json.dumps(cambios, separators=(",", ":")).encode("utf-8")))
+        return 0
+
+    if not args.origen or not args.destino:
+        parser.error("Hay que indicar ORIGEN y DESTINO")
+
+    log(f"Iniciando sincronizacion {args.origen} -> {args.destino}")
+    try:
+        if args.completo:
+            if _es_remoto(args.origen):
+                parser.error("--completo solo admite un origen local")
+            copia_completa(args.origen, args.destino)
+        else:
+            sincronizar(args.origen, args.destino)
+    except Exception as e:
+        log(f"ERROR: Fallo la sincronizacion: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
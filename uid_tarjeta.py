@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Representacion de los UID de las tarjetas RFID
+Internamente (lector, caches y base de datos) un UID es un entero de 4 bytes:
+ocupa menos que el texto hexadecimal en cada fila de 'depositos' y en sus indices,
+y las uniones por uid comparan enteros. El formato hexadecimal ("0A1B2C3D") solo
+se usa en los bordes: API REST, ficheros de importacion, informes y consola.
+
+migrar_uids_enteros() convierte las bases de datos antiguas (uid TEXT).
+"""
+
+import re
+from migracion_bd import existe_tabla, tipo_columna, reescribir_tablas
+
+UID_MAX = 0xFFFFFFFF
+
+
+def uid_a_hex(uid):
+    """Entero -> texto hexadecimal de 8 caracteres en mayusculas"""
+    return f"{uid:08X}"
+
+
+def hex_a_uid(texto):
+    """Texto hexadecimal -> entero. Lanza ValueError si no es un UID de 4 bytes"""
+    uid = int(str(texto).strip(), 16)
+    if not 0 <= uid <= UID_MAX:
+        raise ValueError(f"UID fuera de rango: {texto}")
+    return uid
+
+
+def bytes_a_uid(datos):
+    """Los 4 bytes leidos del lector -> entero"""
+    return int.from_bytes(bytes(datos[:4]), 'big')
+
+
+# ============== MIGRACION ==============
+def migrar_uids_enteros(conn, tablas=('usuarios', 'depositos', 'estadisticas', 'outbox_depositos')):
+    """
+    Reescribe las tablas con 'uid TEXT' como 'uid INTEGER' convirtiendo los valores.
+    Conserva indices y contadores AUTOINCREMENT. Todo en una transaccion; no hace
+    nada si la BD ya esta migrada. Devuelve las tablas migradas.
+    """
+    pendientes = [
+        t for t in tablas
+        if existe_tabla(conn, t) and tipo_columna(conn, t, 'uid') == 'TEXT'
+    ]
+    if not pendientes:
+        return []
+
+    conn.create_function('hex_a_uid', 1, hex_a_uid, deterministic=True)
+    reescribir_tablas(
+        conn, pendientes,
+        lambda tabla, esquema: re.sub(r'\buid\s+TEXT\b', 'uid INTEGER', esquema, flags=re.IGNORECASE),
+        {'uid': 'hex_a_uid(uid)'}
+    )
+    return pendientes
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Sensor de ultrasonidos con marcas de tiempo de los flancos tomadas por el kernel
+GroveUltrasonicRanger.get_distance() cronometra el eco en espacio de usuario con una
+espera activa: gasta CPU y cualquier cambio de contexto alarga o acorta el pulso medido
+(en 12 cm de recorrido, 1 mm es ~1% de llenado). UltrasonidoGPIO pide los flancos del eco
+al kernel por la interfaz de caracteres de GPIO (/dev/gpiochipN, libgpiod v2): el kernel
+anota el instante de cada flanco al atender la interrupcion y el proceso duerme en
+wait_edge_events() hasta que llegan.
+
+La linea se abstrae para poder repetir medidas grabadas sin hardware:
+- LineaGPIOD: la linea real (mismo pin SIG para el disparo y el eco)
+- LineaGrabada: reproduce eventos grabados con grabar_eventos() (JSON Lines)
+
+Uso:
+    python papelera_cli.py read-distance --n 20 --grabar eco.jsonl
+    python papelera_cli.py read-distance --reproducir eco.jsonl
+"""
+
+import json
+import time
+
+# ============== CONFIGURACION ==============
+CHIP_GPIO = "/dev/gpiochip0"  # Raspberry Pi 5 con kernels antiguos: /dev/gpiochip4
+PIN_ULTRASONIDO = 18  # BCM, el mismo que GroveUltrasonicRanger(18)
+TIMEOUT_ECO = 0.05  # s: el eco mas largo del sensor (~4 m) dura ~25 ms
+INTENTOS_MEDIDA = 3
+US_POR_CM = 29  # µs por cm (ida), la misma constante que la libreria de Grove
+
+SUBIDA = 'subida'
+BAJADA = 'bajada'
+
+
+def importar_gpiod():
+    """
+    libgpiod v2, solo al abrir una linea: los comandos que no usan el hardware
+    (stats, archive...) no lo cargan. RuntimeError si no esta instalado.
+    """
+    try:
+        import gpiod
+        import gpiod.line
+    except ImportError:
+        raise RuntimeError("Falta el paquete gpiod (libgpiod v2): pip install gpiod") from None
+    return gpiod
+
+
+def distancia_pulso(inicio_ns, fin_ns):
+    """Duracion del eco (ns) -> distancia en cm (ida y vuelta)"""
+    return (fin_ns - inicio_ns) / 1000 / US_POR_CM / 2
+
+
+def pulso_eco(eventos):
+    """
+    (inicio_ns, fin_ns) del primer pulso completo en [(tipo, timestamp_ns)], o None.
+    Se descartan las bajadas anteriores a la primera subida (restos del disparo).
+    """
+    inicio = None
+    for tipo, marca in eventos:
+        if tipo == SUBIDA:
+            inicio = marca
+        elif inicio is not None:
+            return inicio, marca
+    return None
+
+
+# ============== LINEAS ==============
+class LineaGPIOD:
+    """Pin SIG del sensor por la interfaz de caracteres de GPIO (libgpiod v2)"""
+    def __init__(self, chip=CHIP_GPIO, pin=PIN_ULTRASONIDO):
+        gpiod = importar_gpiod()
+        Direction, Edge, Value = gpiod.line.Direction, gpiod.line.Edge, gpiod.line.Value
+        self.pin = pin
+        self.activo, self.inactivo = Value.ACTIVE, Value.INACTIVE
+        self.flanco_subida = gpiod.EdgeEvent.Type.RISING_EDGE
+        self.salida = {pin: gpiod.LineSettings(direction=Direction.OUTPUT, output_value=Value.INACTIVE)}
+        # Marcas de tiempo CLOCK_MONOTONIC (las de por defecto) en cada flanco del eco
+        self.entrada = {pin: gpiod.LineSettings(direction=Direction.INPUT, edge_detection=Edge.BOTH)}
+        self.peticion = gpiod.request_lines(chip, consumer="papelera-ultrasonido", config=self.salida)
+        self.disparo_ns = 0
+
+    def disparar(self):
+        """Pulso de disparo y paso a entrada con deteccion de flancos"""
+        self.peticion.reconfigure_lines(self.salida)
+        self.disparo_ns = time.monotonic_ns()
+        self.peticion.set_value(self.pin, self.activo)
+        time.sleep(0.00001)  # >= 10 µs
+        self.peticion.set_value(self.pin, self.inactivo)
+        self.peticion.reconfigure_lines(self.entrada)
+
+    def esperar_eventos(self, timeout):
+        """[(tipo, timestamp_ns)] recibidos en 'timeout' segundos ([] si no llega ninguno)"""
+        if not self.peticion.wait_edge_events(timeout):
+            return []
+        # Los flancos anteriores al disparo son restos de la medida anterior
+        return [
+            (SUBIDA if e.event_type == self.flanco_subida else BAJADA, e.timestamp_ns)
+            for e in self.peticion.read_edge_events()
+            if e.timestamp_ns >= self.disparo_ns
+        ]
+
+    def cerrar(self):
+        self.peticion.release()
+
+
+class LineaGrabada:
+    """
+    Reproduce medidas grabadas: cada disparar() pasa a la siguiente medida y
+    esperar_eventos() entrega sus eventos. Vuelve a empezar al agotarlas.
+    """
+    def __init__(self, medidas):
+        self.medidas = [[(tipo, marca) for tipo, marca in m] for m in medidas]
+        self.indice = -1
+        self.pendientes = []
+
+    @classmethod
+    def cargar(cls, ruta):
+        with open(ruta, encoding='utf-8') as f:
+            return cls(json.loads(linea) for linea in f if linea.strip())
+
+    def disparar(self):
+        self.indice = (self.indice + 1) % len(self.medidas)
+        self.pendientes = list(self.medidas[self.indice])
+
+    def esperar_eventos(self, timeout):
+        eventos, self.pendientes = self.pendientes, []
+        return eventos
+
+    def cerrar(self):
+        pass
+
+
+# ============== SENSOR ==============
+class UltrasonidoGPIO:
+    """Misma interfaz que GroveUltrasonicRanger (get_distance en cm) sin espera activa"""
+    def __init__(self, linea=None, timeout=TIMEOUT_ECO, intentos=INTENTOS_MEDIDA, grabacion=None):
+        self.linea = linea if linea is not None else LineaGPIOD()
+        self.timeout = timeout
+        self.intentos = intentos
+        self.grabacion = grabacion  # lista donde guardar los eventos de cada medida
+
+    def _medir(self):
+        self.linea.disparar()
+        eventos = []
+        limite = time.monotonic() + self.timeout
+        while True:
+            pendiente = limite - time.monotonic()
+            nuevos = self.linea.esperar_eventos(max(0, pendiente))
+            eventos.extend(nuevos)
+            pulso = pulso_eco(eventos)
+            if pulso or not nuevos or pendiente <= 0:
+                break
+        if self.grabacion is not None:
+            self.grabacion.append(eventos)
+        return distancia_pulso(*pulso) if pulso else None
+
+    def get_distance(self):
+        """Distancia en cm, o None si no llega el eco en 'intentos' disparos"""
+        for _ in range(self.intentos):
+            distancia = self._medir()
+            if distancia is not None:
+                return distancia
+        return None
+
+    def cerrar(self):
+        self.linea.cerrar()
+
+
+def grabar_eventos(grabacion, ruta):
+    """Guarda los eventos de cada medida (una por linea) para LineaGrabada.cargar()"""
+    with open(ruta, 'w', encoding='utf-8') as f:
+        for eventos in grabacion:
+            f.write(json.dumps(eventos) + '\n')